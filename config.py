@@ -3,16 +3,7 @@ from dotenv import load_dotenv
 import logging
 import pathlib
 
-# ロギング設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log')
-    ]
-)
-
+# ログの出力先はエントリーポイントで modules.logging_setup.setup_logging() を呼んで設定する
 logger = logging.getLogger('youtube-shorts-bot')
 
 # 環境変数読み込み
@@ -21,32 +12,105 @@ load_dotenv()
 # プロジェクトルートディレクトリ
 ROOT_DIR = pathlib.Path(__file__).parent.absolute()
 
+# ログ設定（キューを経由して専用のスレッドで書き出す）
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')  # 空にするとファイルには書き出さない
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text または json（1行1件、ジョブID付き）
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # このサイズを超えたらローテーション
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # 設定した場合はサイズではなく時間でローテーション（例: midnight）
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))  # 残す過去のログファイル数
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '2000'))  # FFmpegのコマンド・出力などを切り詰める文字数
+
 # Discord設定
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_CHANNEL_ID = os.getenv('DISCORD_CHANNEL_ID')
 
 # AI API設定
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')  # 後方互換性のために残す
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')  # ヘッジ要求用のバックエンド
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 
 # YouTube API設定
 YOUTUBE_CLIENT_ID = os.getenv('YOUTUBE_CLIENT_ID')
 YOUTUBE_CLIENT_SECRET = os.getenv('YOUTUBE_CLIENT_SECRET')
 YOUTUBE_REDIRECT_URI = os.getenv('YOUTUBE_REDIRECT_URI', 'http://localhost:8080')
+YOUTUBE_API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT')  # APIの接続先（疑似サーバーで計測・テストする場合に指定）
+YOUTUBE_TOKEN_REFRESH_MARGIN = 300  # トークン期限の何秒前に更新するか
+YOUTUBE_HTTP_TIMEOUT = 120  # YouTube APIとの通信タイムアウト（秒）
+YOUTUBE_UPLOAD_CHUNK_SIZE = int(os.getenv('YOUTUBE_UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))  # アップロードのチャンクサイズ（256KBの倍数）
+YOUTUBE_UPLOAD_MAX_RETRIES = 10  # チャンク送信の最大リトライ回数
+YOUTUBE_UPLOAD_MAX_BACKOFF = 60  # リトライ間隔の上限（秒）
+YOUTUBE_DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', '10000'))  # プロジェクトごとの1日のクォータ
+YOUTUBE_UPLOAD_QUOTA_COST = 1600  # videos.insert 1回あたりのクォータ消費量
+YOUTUBE_MAX_CONCURRENT_UPLOADS = int(os.getenv('YOUTUBE_MAX_CONCURRENT_UPLOADS', '1'))  # チャンネルごとの同時アップロード数
+YOUTUBE_UPLOAD_WORKERS = int(os.getenv('YOUTUBE_UPLOAD_WORKERS', '4'))  # 全チャンネル合計の同時アップロード数（専用スレッド数）
 
 # ディレクトリ設定
 OUTPUT_DIR = os.path.join(ROOT_DIR, os.getenv('OUTPUT_DIR', 'outputs'))
 TEMP_DIR = os.path.join(ROOT_DIR, os.getenv('TEMP_DIR', 'temp'))
 BACKGROUNDS_DIR = os.path.join(ROOT_DIR, os.getenv('BACKGROUNDS_DIR', 'assets/backgrounds'))
 CREDENTIALS_DIR = os.path.join(ROOT_DIR, 'credentials')
+UPLOAD_STATE_DIR = os.path.join(TEMP_DIR, 'upload_sessions')  # アップロード再開情報の保存先
+DATA_DIR = os.path.join(ROOT_DIR, os.getenv('DATA_DIR', 'data'))  # 再起動後も保持する状態の保存先
+UPLOAD_QUEUE_FILE = os.path.join(DATA_DIR, 'upload_queue.json')  # クォータ待ちのアップロード予約
+UPLOAD_QUOTA_FILE = os.path.join(DATA_DIR, 'upload_quota.json')  # プロジェクトごとのクォータ使用量
+JOB_JOURNAL_FILE = os.path.join(DATA_DIR, 'jobs.jsonl')  # ジョブの状態遷移の記録（再起動時の再開に使う）
+JOB_JOURNAL_MAX_BYTES = int(os.getenv('JOB_JOURNAL_MAX_BYTES', str(1024 * 1024)))  # 超えたら終了したジョブの記録を削除する
 
 # ファイルパス
 DISCORD_TOKEN_FILE = os.path.join(CREDENTIALS_DIR, 'discord_token.txt')
 OPENAI_API_KEY_FILE = os.path.join(CREDENTIALS_DIR, 'openai_api_key.txt')
 ANTHROPIC_API_KEY_FILE = os.path.join(CREDENTIALS_DIR, 'anthropic_api_key.txt')
 YOUTUBE_CLIENT_SECRETS_FILE = os.path.join(CREDENTIALS_DIR, 'client_secrets.json')
+YOUTUBE_CHANNELS_FILE = os.path.join(CREDENTIALS_DIR, 'youtube_channels.json')  # 複数チャンネルの設定（任意）
+
+# Discordの送信設定（ジョブの状況メッセージは間隔ごとにまとめて編集する）
+DISCORD_STATUS_INTERVAL = float(os.getenv('DISCORD_STATUS_INTERVAL', '3'))  # 編集をまとめる間隔（秒）
+DISCORD_STATUS_EDITS_PER_CHANNEL = int(os.getenv('DISCORD_STATUS_EDITS_PER_CHANNEL', '2'))  # 1回の間隔でチャンネルごとに編集する上限
+DISCORD_SENDS_PER_MINUTE = int(os.getenv('DISCORD_SENDS_PER_MINUTE', '60'))  # 投稿・編集を合わせた送信数の上限
+
+# ジョブ投入用HTTP APIの設定（Discordと同じパイプラインにジョブを投入する）
+HTTP_API_ENABLED = os.getenv('HTTP_API_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # ボットと同じプロセスで起動するか
+HTTP_API_HOST = os.getenv('HTTP_API_HOST', '127.0.0.1')
+HTTP_API_PORT = int(os.getenv('HTTP_API_PORT', '8081'))  # 8080 はYouTubeのOAuth認証で使用
+HTTP_API_TOKEN = os.getenv('HTTP_API_TOKEN', '')  # 設定した場合は Authorization: Bearer <token> が必要
+HTTP_API_INTERACTIVE_TOKEN = os.getenv('HTTP_API_INTERACTIVE_TOKEN', '')  # このトークンで認証した場合のみ interactive を指定できる
+HTTP_API_MAX_BATCH = int(os.getenv('HTTP_API_MAX_BATCH', '500'))  # 1回のリクエストで投入できるジョブ数
+HTTP_API_RESULT_CACHE = int(os.getenv('HTTP_API_RESULT_CACHE', '10000'))  # 結果を保持する完了済みジョブ数
+
+# メトリクス設定（Prometheus形式。ジョブAPIとは別のポートの /metrics で公開する）
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))  # 0にすると /metrics を公開しない
+METRICS_FILE = os.getenv('METRICS_FILE', '')  # 設定した場合は一定間隔でこのファイルにも書き出す
+METRICS_FILE_INTERVAL = float(os.getenv('METRICS_FILE_INTERVAL', '15'))  # ファイルに書き出す間隔（秒）
+
+# トレース設定（ジョブごとの処理の内訳をChromeのトレースイベント形式で書き出す）
+TRACE_DIR = os.getenv('TRACE_DIR', '')  # 設定した場合は完了したジョブごとに <ジョブID>.json を書き出す
+
+# パイプライン設定（ステージごとの同時実行数）
+PIPELINE_LLM_CONCURRENCY = int(os.getenv('PIPELINE_LLM_CONCURRENCY', '2'))  # テキスト生成
+PIPELINE_RENDER_CONCURRENCY = int(os.getenv('PIPELINE_RENDER_CONCURRENCY', '1'))  # 動画作成（FFmpegはCPUを使い切るため1）
+PIPELINE_UPLOAD_CONCURRENCY = int(os.getenv('PIPELINE_UPLOAD_CONCURRENCY', '2'))  # アップロード
+PIPELINE_BACKGROUND_CONCURRENCY = int(os.getenv('PIPELINE_BACKGROUND_CONCURRENCY', '1'))  # 背景プレートの作成（テキスト生成と並行）
+# テキスト生成・動画作成を別プロセスで実行するワーカー数（0: ボットと同じプロセスで実行、auto: CPUコア数）
+WORKER_PROCESSES = os.getenv('WORKER_PROCESSES', '0')
+WORKER_PROCESSES = (os.cpu_count() or 1) if WORKER_PROCESSES == 'auto' else int(WORKER_PROCESSES)
+WORKER_MAX_TASK_RETRIES = int(os.getenv('WORKER_MAX_TASK_RETRIES', '1'))  # ワーカーが処理中に異常終了した場合の再実行回数
+# ジョブの受け付け上限（処理中・待機中の合計。超えたリクエストは拒否する）
+PIPELINE_MAX_PENDING = int(os.getenv('PIPELINE_MAX_PENDING', '10'))  # 全体
+PIPELINE_MAX_PER_USER = int(os.getenv('PIPELINE_MAX_PER_USER', '2'))  # ユーザーごと
+PIPELINE_MAX_PER_CHANNEL = int(os.getenv('PIPELINE_MAX_PER_CHANNEL', '5'))  # チャンネルごと
+# interactive（Discord）のリクエストのために空けておく枠（HTTP APIの normal、バッチの bulk は使えない）
+PIPELINE_INTERACTIVE_RESERVED = int(os.getenv('PIPELINE_INTERACTIVE_RESERVED', '1'))  # ステージごとの同時実行数（同時実行数-1まで。同時実行数1のステージでは interactive の待機中に bulk を始めない）
+PIPELINE_INTERACTIVE_RESERVED_PENDING = int(os.getenv('PIPELINE_INTERACTIVE_RESERVED_PENDING', '3'))  # 受け付け上限のうちの件数
+# ステージごとの期限（秒。超えたジョブは中止して失敗にする。0は無制限）
+PIPELINE_LLM_TIMEOUT = float(os.getenv('PIPELINE_LLM_TIMEOUT', '120'))  # テキスト生成
+PIPELINE_RENDER_TIMEOUT = float(os.getenv('PIPELINE_RENDER_TIMEOUT', '300'))  # 動画作成（背景プレートの完成待ちを含む）
+PIPELINE_UPLOAD_TIMEOUT = float(os.getenv('PIPELINE_UPLOAD_TIMEOUT', '1800'))  # アップロード
+# 同じテーマのジョブが実行中の場合の扱い（share: そのジョブに合流して同じ動画を受け取る、variant: 別の動画を作成する）
+PIPELINE_DUPLICATE_POLICY = os.getenv('PIPELINE_DUPLICATE_POLICY', 'share')
 
 # 動画設定
+FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT', '600'))  # FFmpeg・FFprobeの1回の実行の上限（秒）
 VIDEO_DURATION = 6  # 秒
 VIDEO_WIDTH = 1080  # 幅（ショート動画の推奨サイズ）
 VIDEO_HEIGHT = 1920  # 高さ（ショート動画の推奨サイズ）
@@ -58,6 +122,32 @@ TEXT_COLOR = 'white'  # テキスト色
 TEXT_STROKE_COLOR = 'black'  # テキスト縁取り色
 TEXT_STROKE_WIDTH = 2  # テキスト縁取り幅
 
+# テキスト生成設定
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-sonnet-20240229')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+TEXT_BACKENDS = [name.strip() for name in os.getenv('TEXT_BACKENDS', 'anthropic,openai').split(',') if name.strip()]  # 優先順（先頭がプライマリ、1つだけの場合はヘッジしない）
+TEXT_LOCAL_FALLBACK = os.getenv('TEXT_LOCAL_FALLBACK', 'true').lower() == 'true'  # 期限切れ時にテンプレートから生成するか
+TEXT_HEDGE_DEFAULT_DELAY = 8.0  # 応答時間の計測数が少ない間にヘッジ要求を送るまでの秒数
+TEXT_HEDGE_MIN_SAMPLES = 20  # p95を使い始める計測数
+TEXT_HEDGE_WINDOW = 200  # p95の計算に使う直近の計測数
+TEXT_HEDGE_MAX_WORKERS = 8  # ヘッジ要求を実行するスレッド数
+TEXT_HARD_DEADLINE = float(os.getenv('TEXT_HARD_DEADLINE', '30'))  # ローカル生成にフォールバックするまでの秒数
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '60'))  # LLM APIの1回のリクエストのタイムアウト（秒）
+TEXT_BATCH_MAX_VARIATIONS = int(os.getenv('TEXT_BATCH_MAX_VARIATIONS', '5'))  # 1回の呼び出しで生成するバリエーション数の上限
+TEXT_GENERATION_MAX_CONCURRENCY = int(os.getenv('TEXT_GENERATION_MAX_CONCURRENCY', '3'))  # 並列API呼び出し数の上限
+QUOTE_MIN_DISPLAY_WIDTH = 4  # 名言の最小表示幅（全角1文字=2）
+QUOTE_MAX_DISPLAY_WIDTH = 44  # 名言の最大表示幅（全角20文字＋句読点の余裕）
+
+# LLM APIのレート制限設定（プロセス全体で共有）
+LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '50'))  # 1分あたりのリクエスト数上限
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', '40000'))  # 1分あたりのトークン数上限
+LLM_EXPECTED_OUTPUT_TOKENS = 1000  # 1回の呼び出しで見込む出力トークン数
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '20'))  # レート制限待ちの呼び出し数の上限
+LLM_QUEUE_TIMEOUT = 120  # レート制限待ちの最大秒数
+LLM_MAX_RETRIES = 5  # 429/529/5xx エラー時の最大リトライ回数
+LLM_RETRY_BASE_DELAY = 1.0  # リトライ間隔の基準（秒、指数的に増加）
+LLM_RETRY_MAX_DELAY = 60.0  # リトライ間隔の上限（秒）
+
 # ファイルから認証情報を読み込む関数
 def read_token_from_file(file_path):
     """ファイルからトークンを読み込む"""
@@ -77,28 +167,33 @@ if not ANTHROPIC_API_KEY:
     ANTHROPIC_API_KEY = read_token_from_file(ANTHROPIC_API_KEY_FILE)
 
 # 設定の検証
-def validate_config():
-    """設定値の検証"""
+def validate_config(require_discord=True):
+    """
+    設定値の検証
+    
+    Args:
+        require_discord (bool): Discord Tokenを必須とするか（バッチ処理では不要）
+    """
     config_valid = True
     
-    if not DISCORD_TOKEN:
+    if require_discord and not DISCORD_TOKEN:
         logger.error("Discord Tokenが設定されていません")
         config_valid = False
-        
-    if not ANTHROPIC_API_KEY:
-        logger.error("Anthropic API Keyが設定されていません")
+    
+    if not ANTHROPIC_API_KEY and not OPENAI_API_KEY:
+        logger.error("Anthropic API Key / OpenAI API Keyのいずれも設定されていません")
         config_valid = False
-        
+    
     if not os.path.exists(YOUTUBE_CLIENT_SECRETS_FILE):
         logger.error(f"YouTube Client Secrets File ({YOUTUBE_CLIENT_SECRETS_FILE}) が見つかりません")
         config_valid = False
-        
+    
     return config_valid
 
 # ディレクトリの存在確認と作成
 def ensure_directories():
     """必要なディレクトリの存在を確認し、なければ作成"""
-    for directory in [OUTPUT_DIR, TEMP_DIR, BACKGROUNDS_DIR, CREDENTIALS_DIR]:
+    for directory in [OUTPUT_DIR, TEMP_DIR, BACKGROUNDS_DIR, CREDENTIALS_DIR, DATA_DIR]:
         if not os.path.exists(directory):
             os.makedirs(directory)
             logger.info(f"ディレクトリを作成しました: {directory}")
@@ -3,26 +3,49 @@ YouTubeショート自動生成・投稿システムのメインエントリー
 """
 import os
 import sys
+import uuid
 import logging
 import asyncio
+import functools
+import threading
 from datetime import datetime
 
 # 自作モジュールのインポート
 import config
 from modules.text_generator import TextGenerator
 from modules.video_creator import VideoCreator
+from modules.ffmpeg_handler import probe_video, estimate_overlay_cost
 from modules.youtube_uploader import YouTubeUploader
+from modules.upload_scheduler import UploadScheduler
+from modules.pipeline import PipelineScheduler, PriorityExecutor, QueueFull
+from modules.job_journal import JobJournal
 from modules.discord_bot import DiscordBot
+from modules.http_api import JobAPI
+from modules.worker_pool import WorkerPool, generate_text_task, render_overlay_task
+from modules.rate_limiter import collect_metrics as collect_rate_limit_metrics
+from modules import metrics, tracing
+from modules.logging_setup import setup_logging, job_context
 
 logger = logging.getLogger('youtube-shorts-bot.main')
 
 class YouTubeShortsBot:
     """YouTubeショート自動生成・投稿システムのメインクラス"""
     
-    def __init__(self):
-        """初期化"""
+    def __init__(self, use_discord=True, stage_concurrency=None, max_pending=None, use_http_api=None,
+                 journal_path=None):
+        """
+        初期化
+        
+        Args:
+            use_discord (bool): Discordボットを使うかどうか（バッチ処理では使わない）
+            stage_concurrency (dict, optional): ステージ名と同時実行数の辞書（未指定のステージは設定値）
+            max_pending (int, optional): 処理中・待機中のジョブ数の上限（未指定の場合は設定値）
+            use_http_api (bool, optional): ジョブ投入用のHTTP APIを起動するかどうか（未指定の場合は設定値）
+            journal_path (str, optional): ジョブの状態遷移の記録先（未指定の場合は JOB_JOURNAL_FILE。
+                バッチ処理では別のファイルにして、ボットの起動時に再開されないようにする）
+        """
         # 設定の検証
-        if not config.validate_config():
+        if not config.validate_config(require_discord=use_discord):
             logger.error("設定の検証に失敗しました。終了します。")
             sys.exit(1)
         
@@ -33,109 +56,594 @@ class YouTubeShortsBot:
         self.text_generator = TextGenerator()
         self.video_creator = VideoCreator()
         self.youtube_uploader = YouTubeUploader()
-        self.discord_bot = DiscordBot()
+        self.upload_scheduler = UploadScheduler(self.youtube_uploader)
+        self.discord_bot = DiscordBot() if use_discord else None
+        # テキスト生成・動画作成は別プロセスのワーカーで実行できる（Discordのハートビートと処理がGILを取り合わない）
+        # アップロードはクォータの記録と予約を持つため、このプロセスで実行する
+        self.worker_pool = WorkerPool().start() if config.WORKER_PROCESSES > 0 else None
+        
+        # ステージごとに同時実行数を持つパイプライン（別々のジョブのステージが重なって進む）
+        # ジョブの状態遷移を記録し、再起動時に未完了のジョブを途中のステージから再開する
+        self.journal = JobJournal(journal_path)
+        self.pipeline = PipelineScheduler(max_pending=max_pending, journal=self.journal)
+        concurrency = {
+            'llm': config.PIPELINE_LLM_CONCURRENCY,
+            'render': config.PIPELINE_RENDER_CONCURRENCY,
+            'upload': config.PIPELINE_UPLOAD_CONCURRENCY,
+        }
+        concurrency.update(stage_concurrency or {})
+        # expected_seconds は実績が貯まるまで待ち時間の見込みに使う目安
+        # 同じ優先度クラスの中では、cost で見積もった処理量の小さいジョブから処理する
+        # timeout を超えたステージは中止して失敗にする（FFmpegの終了・通信の切断まで行う）
+        self.pipeline.add_stage('llm', self.generate_text_stage, concurrency['llm'], expected_seconds=15,
+                                timeout=config.PIPELINE_LLM_TIMEOUT)
+        self.pipeline.add_stage('render', self.render_stage, concurrency['render'], expected_seconds=30,
+                                cost=self.estimate_render_cost, timeout=config.PIPELINE_RENDER_TIMEOUT)
+        self.pipeline.add_stage('upload', self.upload_stage, concurrency['upload'], expected_seconds=30,
+                                cost=self.estimate_upload_cost, timeout=config.PIPELINE_UPLOAD_TIMEOUT)
+        # 背景プレートはテキストに依存しないため、リクエストの受付と同時にテキスト生成と並行して作成する
+        self.background_executor = PriorityExecutor(
+            max_workers=config.PIPELINE_BACKGROUND_CONCURRENCY, thread_name_prefix='pipeline-background')
+        
+        # Discordと同じパイプラインにジョブを投入するHTTP API
+        if use_http_api is None:
+            use_http_api = config.HTTP_API_ENABLED
+        self.http_api = JobAPI(self.submit_shorts_request, self.pipeline) if use_http_api else None
+        # レート制限の状況は /metrics の出力時に集計する（キューの長さなどは start_metrics でイベントループ上の集計を登録する）
+        metrics.register_collector(collect_rate_limit_metrics)
+        self._metrics_started = False
         
         # Discordボットのコールバック設定
-        self.discord_bot.set_callback(self.process_shorts_request)
+        if self.discord_bot is not None:
+            self.discord_bot.set_callback(self.process_shorts_request)
+            self.discord_bot.set_submitter(self.submit_shorts_request)
+            self.discord_bot.set_canceller(self.cancel_shorts_request)
+            self.discord_bot.add_startup_hook(self.start_background_tasks)
+            self.pipeline.add_listener(self.discord_bot.update_job_status)
+            self.upload_scheduler.set_result_listener(self.notify_scheduled_upload)
+    
+    async def start_background_tasks(self):
+        """イベントループ上で動くバックグラウンド処理を起動する"""
+        self.upload_scheduler.start()
+        self.pipeline.start()
+        await self.start_metrics()
+        self.resume_jobs()
+        if self.http_api is not None:
+            await self.http_api.start()
+    
+    async def start_metrics(self):
+        """メトリクスの集計・ファイルへの書き出し・/metrics の公開を開始する（イベントループ内で呼び出す）"""
+        if self._metrics_started:
+            return
+        self._metrics_started = True
+        # パイプラインの状態はイベントループが持つため、書き出し用のスレッドから出力する場合もループ上で集計する
+        metrics.register_collector(self.collect_metrics, loop=asyncio.get_running_loop())
+        metrics.start_file_export()
+        await metrics.start_server()
     
-    async def process_shorts_request(self, theme):
+    def resume_jobs(self):
+        """
+        前回の終了時に未完了だったジョブを記録から復元し、最後に完了したステージの次から再開する
+        
+        Returns:
+            list: 再開したジョブのリスト
+        """
+        self.journal.compact()
+        jobs = []
+        for state in self.journal.unfinished():
+            # 作成済みの動画ファイルが残っていない場合は動画作成からやり直す
+            video_path = state['data'].get('video_path')
+            if state['stage'] == 'render' and not (video_path and os.path.exists(video_path)):
+                state['stage'] = 'llm'
+            
+            options = {'request_options': state['key_options'], 'cancel_event': threading.Event(), 'plate_info': {}}
+            if state['stage'] != 'render':
+                options['background'] = self.background_executor.submit(
+                    functools.partial(self.prepare_plate, options['cancel_event'], options['plate_info']),
+                    priority=state['priority'])
+            job = self.pipeline.restore(state, **options)
+            if 'background' in options:
+                job.add_done_callback(self._discard_background_callback(options['background']))
+            asyncio.get_running_loop().create_task(self.notify_resumed_job(job))
+            jobs.append(job)
+        
+        if jobs:
+            logger.info(f"前回未完了だったジョブを{len(jobs)}件再開しました")
+        return jobs
+    
+    async def notify_resumed_job(self, job):
+        """
+        再開したジョブの結果をリクエスト元のDiscordチャンネルに通知する
+        
+        Args:
+            job (PipelineJob): 再開したジョブ
+        """
+        result = await job.wait()
+        if result.get('queued'):
+            message = (f'再起動前に受け付けた「{job.theme}」の動画を作成しましたが、'
+                       f'クォータが不足しているためアップロードを予約しました。')
+        elif result.get('success'):
+            message = (f'再起動前に受け付けた「{job.theme}」の動画の生成とアップロードが完了しました！\n'
+                       f'https://youtu.be/{result.get("video_id")}')
+        else:
+            message = f'再起動前に受け付けた「{job.theme}」の動画の生成に失敗しました。エラー: {result.get("error")}'
+        if self.discord_bot is not None:
+            await self.discord_bot.send_message(job.channel_id, message)
+    
+    async def notify_scheduled_upload(self, item, video_id):
+        """
+        予約されていたアップロードの結果をDiscordに通知する
+        
+        Args:
+            item (dict): 予約キューの項目
+            video_id (str): アップロードした動画のID、失敗した場合はNone
+        """
+        channel_id = item.get('notify', {}).get('channel_id')
+        if video_id:
+            message = f'予約していた「{item["title"]}」のアップロードが完了しました！\nhttps://youtu.be/{video_id}'
+        else:
+            message = f'予約していた「{item["title"]}」のアップロードに失敗しました。'
+        if self.discord_bot is not None:
+            await self.discord_bot.send_message(channel_id, message)
+    
+    def submit_shorts_request(self, theme, user_id=None, channel_id=None, fresh=None, options=None, priority='normal'):
+        """
+        ショート動画リクエストをパイプラインに投入する
+        
+        テキスト生成・動画作成・アップロードはステージごとのキューで処理され、
+        別のリクエストの異なるステージと並行して進む。背景プレートの作成はテキスト生成と同時に始める。
+        同じテーマのジョブが実行中の場合は、新しく作らずにそのジョブの結果を共有する。
+        
+        Args:
+            theme (str): 動画のテーマ
+            user_id (str, optional): リクエストしたDiscordユーザーのID
+            channel_id (str, optional): リクエスト元のDiscordチャンネルID（予約アップロードの完了通知先）
+            fresh (bool, optional): 同じテーマのジョブが実行中でも別の動画を作成するかどうか
+                                    （未指定の場合は PIPELINE_DUPLICATE_POLICY に従う）
+            options (dict, optional): アップロードのオプション（'title', 'description', 'tags', 'privacy_status'）
+            priority (str): 優先度クラス（'interactive'、'normal'、'bulk'）
+        
+        Returns:
+            PipelineJob: 投入または合流したジョブ（待ち順と完了見込みを持ち、job.wait() で結果を待つ）
+        
+        Raises:
+            QueueFull: 受け付けの上限に達している場合
+            ValueError: 優先度クラスが正しくない場合
+        """
+        options = options or {}
+        if fresh is None:
+            fresh = config.PIPELINE_DUPLICATE_POLICY == 'variant'
+        if not fresh:
+            job = self.pipeline.attach(theme, user_id=user_id, channel_id=channel_id, key_options=options,
+                                       priority=priority)
+            if job is not None:
+                return job
+        
+        # 拒否するリクエストの背景プレートを作らないよう、先に受け付けられるか確認する
+        self.pipeline.check_admission(user_id, channel_id, priority)
+        logger.info(f"「{theme}」のショート動画生成開始")
+        # 取り消し・期限切れのときは背景プレートの作成も中止する
+        cancel_event = threading.Event()
+        # 背景プレートの作成もジョブのログ・トレースに含まれるよう、ジョブIDを先に決めておく
+        job_id = uuid.uuid4().hex[:12]
+        plate_info = {}
+        with job_context(job_id):
+            background = self.background_executor.submit(
+                functools.partial(self.prepare_plate, cancel_event, plate_info), priority=priority)
+        discard_background = self._discard_background_callback(background)
+        
+        try:
+            job = self.pipeline.submit(theme, user_id=user_id, channel_id=channel_id, key_options=options,
+                                       priority=priority, cancel_event=cancel_event, request_options=options,
+                                       background=background, plate_info=plate_info, job_id=job_id)
+        except Exception:
+            discard_background(None)
+            raise
+        job.add_done_callback(discard_background)
+        return job
+    
+    def prepare_plate(self, cancel_event, plate_info):
+        """
+        背景プレートを作成し、動画作成の見積もりに使う解像度と長さを記録する（スレッドプールで実行）
+        
+        Args:
+            cancel_event (threading.Event): セットされたら作成を中止するイベント
+            plate_info (dict): 背景プレートの情報（probe_video の戻り値）の記録先
+        
+        Returns:
+            str: 背景プレートのパス、失敗した場合はNone
+        """
+        plate_path = self.video_creator.prepare_background(cancel_event=cancel_event)
+        if plate_path:
+            plate_info.update(probe_video(plate_path) or {})
+        return plate_path
+    
+    def _discard_background_callback(self, background):
+        """途中のステージで失敗して使われなかった背景プレートを、完成後に削除する関数を返す"""
+        def discard_background(_):
+            background.add_done_callback(lambda future: self.video_creator.discard_background(future.result()))
+        return discard_background
+    
+    def cancel_shorts_request(self, job_id=None, user_id=None):
+        """
+        ショート動画リクエストを取り消す
+        
+        待機中のジョブは待ち行列から外し、処理中のジョブはFFmpegの終了やアップロードの切断まで行って枠を空ける。
+        
+        Args:
+            job_id (str, optional): ジョブID（未指定の場合はそのユーザーが最後にリクエストした未完了のジョブ）
+            user_id (str, optional): 取り消すユーザーのID（指定した場合は自分がリクエストしたジョブのみ取り消せる）
+        
+        Returns:
+            tuple: (結果, ジョブ)。結果は 'cancelled'、'detached'、'not_found'、'forbidden' のいずれか
+                   （PipelineScheduler.cancel を参照）、ジョブが見つからない場合はNone
+        """
+        if job_id is None:
+            mine = [job for job in self.pipeline.jobs.values()
+                    if any(requester['user_id'] == user_id for requester in job.requesters)]
+            if not mine:
+                return 'not_found', None
+            job_id = max(mine, key=lambda job: job.created_at).id
+        job = self.pipeline.jobs.get(job_id)
+        return self.pipeline.cancel(job_id, user_id=user_id), job
+    
+    async def process_shorts_request(self, theme, channel_id=None, user_id=None):
         """
         ショート動画リクエストを処理する
         
         Args:
             theme (str): 動画のテーマ
-            
+            channel_id (str, optional): リクエスト元のDiscordチャンネルID（予約アップロードの完了通知先）
+            user_id (str, optional): リクエストしたDiscordユーザーのID
+        
         Returns:
             dict: 処理結果
         """
         try:
-            logger.info(f"「{theme}」のショート動画生成開始")
-            
-            # 1. テキスト生成
-            text, slug = self.text_generator.generate_text(theme)
-            if not text:
-                return {'success': False, 'error': 'テキスト生成に失敗しました'}
-            
-            # 出力ファイル名を作成
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"{slug}_{timestamp}.mp4"
-            output_path = os.path.join(config.OUTPUT_DIR, output_filename)
-            
-            # 2. 動画作成
-            video_path = self.video_creator.create_video(text, output_path, subtitles=text)
-            if not video_path:
-                return {'success': False, 'error': '動画作成に失敗しました'}
-            
-            # 3. YouTube認証
-            if not self.youtube_uploader.authenticate():
-                return {'success': False, 'error': 'YouTube認証に失敗しました'}
-            
-            # 4. YouTubeアップロード
-            title = f"{theme} | ショート動画"
-            description = f"{theme}についてのショート動画です。\n\n{text}"
-            tags = [theme, "ショート", "shorts", "自動生成"]
-            
-            video_id = self.youtube_uploader.upload_video(
-                video_path=video_path,
-                title=title,
-                description=description,
-                tags=tags,
-                privacy_status="unlisted"  # 限定公開
-            )
-            
-            if not video_id:
-                return {'success': False, 'error': 'YouTubeアップロードに失敗しました'}
-            
-            # 成功レスポンス
+            job = self.submit_shorts_request(theme, user_id=user_id, channel_id=channel_id, priority='interactive')
+            return await job.wait()
+        except QueueFull as e:
+            return {'success': False, 'rejected': True, 'error': str(e)}
+        except Exception as e:
+            logger.error(f"処理中にエラーが発生: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    def estimate_render_cost(self, job):
+        """
+        動画作成の処理量を見積もる
+        
+        テキスト描画は背景プレートを再エンコードするため、作成時に取得したプレートの解像度と長さ、
+        エンコード設定から見積もる（イベントループ上で呼ばれるため、ここではFFprobeを実行しない）。
+        
+        Args:
+            job (PipelineJob): 対象のジョブ
+        
+        Returns:
+            float: 処理量の見積もり、背景プレートがまだ作成中・情報を取得できなかった場合はNone
+                   （見積もれたジョブを先に処理する）
+        """
+        background = job.options.get('background')
+        if background is None or not background.done() or background.exception():
+            return None
+        plate_info = job.options.get('plate_info')
+        return estimate_overlay_cost(plate_info) if plate_info else None
+    
+    def estimate_upload_cost(self, job):
+        """
+        アップロードの処理量を見積もる
+        
+        Args:
+            job (PipelineJob): 対象のジョブ
+        
+        Returns:
+            int: 動画ファイルのバイト数
+        """
+        return os.path.getsize(job.data['video_path'])
+    
+    def generate_text_stage(self, job):
+        """
+        1. テキスト生成ステージ（スレッドプールで実行）
+        
+        Args:
+            job (PipelineJob): 処理するジョブ
+        
+        Returns:
+            dict: 失敗した場合の処理結果、成功した場合はNone
+        """
+        quotes = []
+        
+        def on_quote(index, quote):
+            # 確定した名言から状況メッセージに表示する（リトライ・再実行で番号が戻った場合は置き換える）
+            del quotes[index:]
+            quotes.append(quote)
+            self.pipeline.report_progress(job, quotes=list(quotes))
+        
+        if self.worker_pool is not None:
+            # 待機中に取り消された場合はNoneが返る
+            text, slug = self.worker_pool.call(generate_text_task, job.theme, cancel_event=job.cancel_event,
+                                               on_progress=lambda value: on_quote(*value)) or (None, None)
+        else:
+            text, slug = self.text_generator.generate_text(job.theme, cancel_event=job.cancel_event,
+                                                           on_quote=on_quote)
+        if not text:
+            return {'success': False, 'error': 'テキスト生成に失敗しました'}
+        job.data['text'] = text
+        job.data['slug'] = slug
+        return None
+    
+    def render_stage(self, job):
+        """
+        2. 動画作成ステージ（スレッドプールで実行）
+        
+        Args:
+            job (PipelineJob): 処理するジョブ
+        
+        Returns:
+            dict: 失敗した場合の処理結果、成功した場合はNone
+        """
+        # 出力ファイル名を作成
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_filename = f"{job.data['slug']}_{timestamp}.mp4"
+        output_path = os.path.join(config.OUTPUT_DIR, output_filename)
+        
+        # テキスト生成と並行して作成していた背景プレートにテキストを描画する
+        background = job.options['background']
+        # 取り消し・期限切れの場合は背景プレートの完成を待たない
+        while not background.done():
+            if job.cancel_event.wait(0.5):
+                return {'success': False, 'cancelled': True, 'error': '動画作成は中止されました'}
+        plate_path = background.result()
+        if not plate_path:
+            return {'success': False, 'error': '背景動画の作成に失敗しました'}
+        
+        text = job.data['text']
+        if self.worker_pool is not None:
+            video_path = self.worker_pool.call(render_overlay_task, plate_path, output_path, text,
+                                               cancel_event=job.cancel_event)
+        else:
+            video_path = self.video_creator.render_overlay(plate_path, output_path, subtitles=text,
+                                                           cancel_event=job.cancel_event)
+        if not video_path:
+            return {'success': False, 'error': '動画作成に失敗しました'}
+        job.data['video_path'] = video_path
+        return None
+    
+    async def upload_stage(self, job):
+        """
+        3. YouTubeアップロードステージ（クォータが不足している場合は予約される）
+        
+        Args:
+            job (PipelineJob): 処理するジョブ
+        
+        Returns:
+            dict: 処理結果
+        """
+        theme = job.theme
+        text = job.data['text']
+        video_path = job.data['video_path']
+        channel_id = job.channel_id
+        
+        options = job.options.get('request_options') or {}
+        title = options.get('title') or f"{theme} | ショート動画"
+        description = options.get('description') or f"{theme}についてのショート動画です。\n\n{text}"
+        tags = options.get('tags') or [theme, "ショート", "shorts", "自動生成"]
+        
+        def record_session(channel_name, session_uri):
+            # 再起動後も同じチャンネルのセッションで続きから送信できるよう記録する
+            session = {'upload_channel': channel_name, 'upload_session': session_uri}
+            job.data.update(session)
+            self.pipeline.record(job, 'artifact', data=session)
+        
+        # YouTube認証はアップロード先に選んだチャンネルだけ、保存済みのトークンで行う（トークンがなければ失敗にする）
+        upload = await self.upload_scheduler.submit(
+            video_path=video_path,
+            title=title,
+            description=description,
+            tags=tags,
+            privacy_status=options.get('privacy_status') or "unlisted",  # 既定は限定公開
+            notify={'channel_id': channel_id} if channel_id else None,
+            channel=job.data.get('upload_channel'),
+            session_callback=record_session,
+            # 中断したセッションを再開する場合、クォータは作成時に記録済み
+            resume=bool(job.data.get('upload_session'))
+        )
+        
+        if upload['status'] == 'queued':
             return {
                 'success': True,
-                'video_id': video_id,
+                'queued': True,
+                'position': upload['position'],
+                'release_in': upload['release_in'],
+                'queue_id': upload['queue_id'],
                 'text': text,
                 'video_path': video_path
             }
-            
-        except Exception as e:
-            logger.error(f"処理中にエラーが発生: {str(e)}")
-            return {'success': False, 'error': str(e)}
+        
+        if upload['status'] != 'uploaded':
+            return {'success': False, 'error': 'YouTubeアップロードに失敗しました'}
+        
+        # 成功レスポンス
+        return {
+            'success': True,
+            'video_id': upload['video_id'],
+            'text': text,
+            'video_path': video_path
+        }
+    
+    def collect_metrics(self):
+        """
+        キューの長さ・実行中の数など、その時点の値をメトリクスとして返す（メトリクスの出力時に呼ばれる）
+        
+        Returns:
+            list: (メトリクス名, 種類, 説明, [(ラベルの辞書, 値), ...]) のリスト
+        """
+        pipeline = self.pipeline.metrics()
+        stages = pipeline['stages'].items()
+        families = [
+            ('shorts_stage_queued', 'gauge', 'ステージの待ち行列のジョブ数',
+             [({'stage': name}, stage['queued']) for name, stage in stages]),
+            ('shorts_stage_busy', 'gauge', 'ステージで処理中のジョブ数',
+             [({'stage': name}, stage['busy']) for name, stage in stages]),
+            ('shorts_stage_concurrency', 'gauge', 'ステージの同時実行数',
+             [({'stage': name}, stage['concurrency']) for name, stage in stages]),
+            ('shorts_pending_jobs', 'gauge', '未完了のジョブ数（優先度クラス別）',
+             [({'priority': priority}, count) for priority, count in pipeline['pending_by_priority'].items()]),
+            ('shorts_upload_reserved', 'gauge', 'クォータ不足で予約中のアップロード数',
+             [({}, len(self.upload_scheduler.queue))]),
+        ]
+        
+        if self.worker_pool is not None:
+            workers = self.worker_pool.metrics()
+            families += [
+                ('shorts_worker_tasks', 'gauge', 'ワーカープロセスの待機中・処理中のタスク数',
+                 [({'state': 'queued'}, workers['queued']), ({'state': 'running'}, workers['running'])]),
+                ('shorts_worker_processes', 'gauge', '稼働中のワーカープロセス数', [({}, workers['alive'])]),
+                ('shorts_worker_restarts_total', 'counter', '異常終了したワーカープロセスの再起動回数',
+                 [({}, workers['restarts'])]),
+                ('shorts_worker_tasks_total', 'counter', 'ワーカープロセスのタスク数（結果別）',
+                 [({'result': result}, workers[result]) for result in ('completed', 'failed', 'retried', 'cancelled')]),
+            ]
+        return families
+    
+    async def serve_api(self):
+        """Discordを使わずにHTTP APIだけでジョブを受け付ける（停止されるまで戻らない）"""
+        await self.start_background_tasks()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # 終了時は送信中のアップロードを次のチャンクの前で中止する（再開情報は残る）
+            self.youtube_uploader.cancel_all()
+            await self.http_api.stop()
+            await metrics.stop_server()
+            self.shutdown_workers()
+            metrics.stop_file_export()
+    
+    def shutdown_workers(self):
+        """ワーカープロセスを停止する"""
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
     
     def run(self):
         """ボットを起動"""
         logger.info("YouTube Shorts自動生成・投稿システムを起動中...")
         
+        # 保存済みのトークンがあれば起動時にYouTubeクライアントを作成しておく
+        self.youtube_uploader.authenticate_saved()
+        
         # Discordボット起動（ブロッキング呼び出し）
         self.discord_bot.run()
+        
+        # 終了時は送信中のアップロードを次のチャンクの前で中止する（再開情報は残る）
+        self.youtube_uploader.cancel_all()
+        self.shutdown_workers()
+        metrics.stop_file_export()
 
 
 if __name__ == "__main__":
-    # ロギング設定
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('bot.log')
-        ]
-    )
+    # ロギング設定（キューを経由して専用のスレッドで書き出す）
+    setup_logging()
     
     # 単体テスト関数
-    async def test_single_theme():
+    def test_single_theme():
         """テーマを指定して単体テストを実行"""
         # テストするテーマ
         test_theme = "猫"
         
-        bot = YouTubeShortsBot()
-        result = await bot.process_shorts_request(test_theme)
+        bot = YouTubeShortsBot(use_discord=False)
+        
+        async def run_theme():
+            # バッチモードと同じく、予約キューの送り出しとメトリクスを起動してから処理する
+            bot.upload_scheduler.start()
+            await bot.start_metrics()
+            try:
+                return await bot.process_shorts_request(test_theme)
+            finally:
+                await metrics.stop_server()
         
-        if result['success']:
+        try:
+            result = asyncio.run(run_theme())
+        finally:
+            bot.shutdown_workers()
+            metrics.stop_file_export()
+        
+        if result.get('queued'):
+            logger.info(f"クォータ不足のためアップロードを予約しました: {result}")
+        elif result['success']:
             logger.info(f"テスト成功: {result}")
             logger.info(f"動画URL: https://youtu.be/{result['video_id']}")
         else:
             logger.error(f"テスト失敗: {result}")
     
+    def run_batch(argv):
+        """テーマの一覧からショート動画をまとめて生成・投稿する（Discordは使わない）"""
+        import json
+        import argparse
+        from modules.batch_runner import BatchRunner, load_batch_rows, default_results_path
+        
+        parser = argparse.ArgumentParser(prog='main.py batch', description='テーマの一覧からショート動画をまとめて生成・投稿します')
+        parser.add_argument('input', nargs='?', default='-', help='テーマの一覧ファイル（text/CSV/JSONL、省略時は標準入力）')
+        parser.add_argument('--format', choices=['auto', 'text', 'csv', 'jsonl'], default='auto', help='入力の形式')
+        parser.add_argument('--output', default=None,
+                            help=f'結果を書き出すJSONLファイル（既定: {os.path.relpath(config.OUTPUT_DIR, config.ROOT_DIR)}/batch_日時.jsonl）')
+        parser.add_argument('--llm-workers', type=int, default=None, help='テキスト生成の同時実行数')
+        parser.add_argument('--render-workers', type=int, default=None, help='動画作成の同時実行数')
+        parser.add_argument('--upload-workers', type=int, default=None, help='アップロードの同時実行数')
+        parser.add_argument('--max-pending', type=int, default=None, help='同時に投入しておくジョブ数の上限')
+        parser.add_argument('--trace', default=None,
+                            help='全ジョブの処理の内訳を1つのファイルに書き出す（Chromeのトレースイベント形式）')
+        args = parser.parse_args(argv)
+        
+        stage_concurrency = {
+            name: value for name, value in
+            [('llm', args.llm_workers), ('render', args.render_workers), ('upload', args.upload_workers)]
+            if value
+        }
+        rows = load_batch_rows(args.input, args.format)
+        results_path = args.output or default_results_path()
+        # バッチのジョブはボットの記録とは別のファイルに記録する（Discordボットの起動時に再開しない）
+        bot = YouTubeShortsBot(use_discord=False, stage_concurrency=stage_concurrency, max_pending=args.max_pending,
+                               journal_path=f'{os.path.splitext(results_path)[0]}.journal.jsonl')
+        runner = BatchRunner(bot, results_path=results_path)
+        if args.trace:
+            tracing.start_batch()
+        
+        async def run_rows():
+            # 予約したアップロードもバッチの実行中にクォータが空けば送り出す
+            bot.upload_scheduler.start()
+            await bot.start_metrics()
+            try:
+                return await runner.run(rows)
+            finally:
+                await metrics.stop_server()
+        
+        try:
+            summary = asyncio.run(run_rows())
+        finally:
+            bot.shutdown_workers()
+            metrics.stop_file_export()
+            if args.trace:
+                tracing.write_batch(args.trace)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0 if summary['failed'] == 0 else 1
+    
     # 引数によってテストか実行かを切り替え
     if len(sys.argv) > 1 and sys.argv[1] == 'test':
         # テストモード
-        asyncio.run(test_single_theme())
+        test_single_theme()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        # バッチモード
+        sys.exit(run_batch(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'auth':
+        # YouTubeの認証（ブラウザで認証してトークンを保存する。チャンネル名を省略した場合はすべて）
+        uploader = YouTubeUploader()
+        sys.exit(0 if uploader.authenticate(sys.argv[2] if len(sys.argv) > 2 else None) else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'api':
+        # HTTP APIのみのモード（Discordは使わない）
+        bot = YouTubeShortsBot(use_discord=False, use_http_api=True)
+        try:
+            asyncio.run(bot.serve_api())
+        except KeyboardInterrupt:
+            pass
     else:
         # 通常実行モード
         bot = YouTubeShortsBot()
@@ -0,0 +1,248 @@
+"""
+テーマの一覧からショート動画をまとめて生成・投稿するバッチ処理のモジュール
+Discordを使わずに、ファイルまたは標準入力から読み込んだテーマをパイプラインで並行処理する
+"""
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules.pipeline import QueueFull
+
+logger = logging.getLogger('youtube-shorts-bot.batch_runner')
+
+# 行ごとに指定できるアップロードのオプション
+BATCH_OPTION_KEYS = ('title', 'description', 'tags', 'privacy_status')
+
+# 真として扱う文字列（CSVの fresh 列）
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+
+
+def _parse_row(row):
+    """
+    1行分の入力をテーマとオプションに変換する
+    
+    Args:
+        row (dict or str): CSV・JSONLの行（辞書）、またはテーマの文字列
+    
+    Returns:
+        dict: {'theme', 'options', 'fresh'}、テーマがない場合はNone
+    """
+    if isinstance(row, str):
+        row = {'theme': row}
+    theme = (row.get('theme') or '').strip()
+    if not theme:
+        return None
+    
+    options = {}
+    for key in BATCH_OPTION_KEYS:
+        value = row.get(key)
+        if value in (None, '', []):
+            continue
+        if key == 'tags' and isinstance(value, str):
+            # CSVではカンマと区別するため | で区切る
+            value = [tag.strip() for tag in value.split('|') if tag.strip()]
+        options[key] = value
+    
+    fresh = row.get('fresh')
+    if isinstance(fresh, str):
+        fresh = fresh.strip().lower() in TRUE_VALUES if fresh.strip() else None
+    return {'theme': theme, 'options': options, 'fresh': fresh}
+
+
+def load_batch_rows(path='-', fmt='auto'):
+    """
+    テーマの一覧を読み込む
+    
+    形式は text（1行1テーマ）、csv（theme列とオプション列を持つヘッダー付きCSV）、
+    jsonl（1行1オブジェクト、またはテーマの文字列）のいずれか。
+    
+    Args:
+        path (str): 入力ファイルのパス（'-' の場合は標準入力）
+        fmt (str): 'auto'、'text'、'csv'、'jsonl' のいずれか（auto は拡張子、標準入力の場合は内容から判定）
+    
+    Returns:
+        list: _parse_row の結果のリスト
+    """
+    if path == '-':
+        content = sys.stdin.read()
+    else:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            content = f.read()
+    
+    if fmt == 'auto':
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.csv', '.jsonl'):
+            fmt = extension[1:]
+        elif content.lstrip().startswith('{'):
+            fmt = 'jsonl'
+        else:
+            fmt = 'text'
+    
+    if fmt == 'csv':
+        raw_rows = list(csv.DictReader(content.splitlines()))
+    elif fmt == 'jsonl':
+        raw_rows = []
+        for number, line in enumerate(content.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                raw_rows.append(json.loads(line))
+            except ValueError as e:
+                logger.warning(f"{number}行目を読み込めないためスキップします: {e}")
+    else:
+        raw_rows = [line for line in content.splitlines() if not line.lstrip().startswith('#')]
+    
+    rows = [row for row in (_parse_row(raw) for raw in raw_rows) if row]
+    logger.info(f"{len(rows)}件のテーマを読み込みました（形式: {fmt}）")
+    return rows
+
+
+def default_results_path():
+    """結果を書き出す既定のファイルのパス（OUTPUT_DIR/batch_日時.jsonl）を返す"""
+    return os.path.join(config.OUTPUT_DIR, f"batch_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+
+class BatchRunner:
+    """テーマの一覧をパイプラインに順に投入し、結果と処理速度を記録するクラス"""
+    
+    def __init__(self, bot, results_path=None):
+        """
+        初期化
+        
+        Args:
+            bot (YouTubeShortsBot): ジョブを投入するインスタンス（Discordなしで作成したもの）
+            results_path (str, optional): 結果を書き出すJSONLファイルのパス
+        """
+        self.bot = bot
+        self.results_path = results_path or default_results_path()
+        self.counts = {'succeeded': 0, 'queued': 0, 'failed': 0}
+        # クォータ不足で予約キューに入れたアップロードのID
+        self._queued_uploads = set()
+        self._results_file = None
+    
+    async def run(self, rows):
+        """
+        すべての行を処理する
+        
+        ジョブは bulk の優先度で投入し、Discordなどからのリクエストを先に処理させる。
+        パイプラインの受け付け上限に達したら、実行中のジョブが終わるのを待ってから次の行を投入する。
+        
+        Args:
+            rows (list): load_batch_rows の結果
+        
+        Returns:
+            dict: 処理速度のまとめ（summary を参照）
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.results_path)), exist_ok=True)
+        start = time.monotonic()
+        pending = set()
+        
+        self._results_file = open(self.results_path, 'w', encoding='utf-8')
+        try:
+            pipeline = self.bot.pipeline
+            for index, row in enumerate(rows):
+                # 受け付けの上限（interactive のために空けておく分を除く）に達している間は、実行中のジョブが終わるのを待つ
+                while pending and not pipeline.has_capacity('bulk'):
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                while True:
+                    try:
+                        job = self.bot.submit_shorts_request(row['theme'], fresh=row['fresh'], options=row['options'],
+                                                             priority='bulk')
+                        break
+                    except QueueFull:
+                        if not pending:
+                            raise
+                        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.get_running_loop().create_task(self._collect(index, row, job)))
+            
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            self._results_file.close()
+        
+        summary = self.summary(len(rows), time.monotonic() - start)
+        logger.info(f"バッチ処理が完了しました: {json.dumps(summary, ensure_ascii=False)}")
+        if summary['unfinished_uploads']:
+            logger.warning(f"{summary['unfinished_uploads']}件の動画はアップロードが完了していません。"
+                           f"予約キュー（{self.bot.upload_scheduler.queue_file}）に残っており、"
+                           f"ボットまたは次のバッチの実行中にクォータが空いたらアップロードされます")
+        return summary
+    
+    async def _collect(self, index, row, job):
+        """ジョブの完了を待って結果を書き出す"""
+        try:
+            result = await job.wait()
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        if result.get('queued'):
+            status = 'queued'
+            self._queued_uploads.add(result.get('queue_id'))
+        elif result.get('success'):
+            status = 'succeeded'
+        else:
+            status = 'failed'
+        self.counts[status] += 1
+        
+        record = {
+            'index': index,
+            'theme': row['theme'],
+            'options': row['options'],
+            'status': status,
+            'job_id': job.id,
+            'video_id': result.get('video_id'),
+            'video_path': result.get('video_path'),
+            'error': result.get('error'),
+            'seconds': round((datetime.now() - job.created_at).total_seconds(), 2),
+            'stage_seconds': job.stage_seconds,
+        }
+        self._results_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._results_file.flush()
+        
+        done = sum(self.counts.values())
+        logger.info(f"[{done}] 「{row['theme']}」: {status}")
+    
+    def summary(self, total, elapsed):
+        """
+        処理件数・処理速度・ステージごとの稼働率をまとめる
+        
+        Args:
+            total (int): 入力の行数
+            elapsed (float): 経過秒数
+        
+        Returns:
+            dict: 件数、経過秒数、1分あたりの完成数、ステージごとの平均所要時間と稼働率、
+                  予約キューに残っていてアップロードが完了していない件数（unfinished_uploads）
+        """
+        elapsed = max(elapsed, 1e-6)
+        metrics = self.bot.pipeline.metrics()
+        stages = {}
+        for name, stage in metrics['stages'].items():
+            stages[name] = {
+                'concurrency': stage['concurrency'],
+                'processed': stage['processed'],
+                'failed': stage['failed'],
+                'average_seconds': stage['average_seconds'],
+                # 同時実行数いっぱいに稼働していた時間の割合（最も高いステージがボトルネック）
+                'utilization': round(stage['busy_seconds'] / (elapsed * stage['concurrency']), 3),
+            }
+        completed = self.counts['succeeded'] + self.counts['queued']
+        waiting = {item['id'] for item in self.bot.upload_scheduler.queue}
+        return {
+            'total': total,
+            **self.counts,
+            'unfinished_uploads': len(self._queued_uploads & waiting),
+            'coalesced': metrics['coalesced'],
+            'elapsed_seconds': round(elapsed, 1),
+            'videos_per_minute': round(completed / elapsed * 60, 2),
+            'results_path': self.results_path,
+            'stages': stages,
+        }
@@ -11,13 +11,23 @@ from discord.ext import commands
 # 親ディレクトリをインポートパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from modules.pipeline import QueueFull
+from modules.status_reporter import StatusReporter
 
 logger = logging.getLogger('youtube-shorts-bot.discord_bot')
 
+# 状況メッセージに表示するステージの説明（パイプラインのステージ名に対応）
+STAGE_LABELS = {
+    'llm': '文章を生成しています',
+    'render': '動画を作成しています',
+    'upload': 'YouTubeにアップロードしています',
+}
+
 class ShortsBot(commands.Bot):
     """YouTubeショート動画生成ボット"""
     
-    def __init__(self, command_prefix='!', intents=None, channel_id=None, callback=None):
+    def __init__(self, command_prefix='!', intents=None, channel_id=None, callback=None, startup_hooks=None,
+                 submitter=None, status_reporter=None, canceller=None):
         """初期化"""
         if intents is None:
             intents = discord.Intents.default()
@@ -27,10 +37,37 @@ class ShortsBot(commands.Bot):
         
         self.channel_id = channel_id or config.DISCORD_CHANNEL_ID
         self.callback = callback
+        self.submitter = submitter
+        self.canceller = canceller
+        self.status_reporter = status_reporter or StatusReporter()
+        self.startup_hooks = startup_hooks or []
         
         # コマンド登録
         self.add_commands()
     
+    async def setup_hook(self):
+        """ログイン後、イベントループ上でバックグラウンド処理を起動する"""
+        self.status_reporter.start()
+        for hook in self.startup_hooks:
+            await hook()
+    
+    async def send_to_channel(self, channel_id, message):
+        """
+        チャンネルIDを指定してメッセージを送信する
+        
+        Args:
+            channel_id (str): 送信先のチャンネルID（未指定の場合は既定のチャンネル）
+            message (str): 送信するメッセージ
+        """
+        channel_id = channel_id or self.channel_id
+        if not channel_id:
+            return
+        channel = self.get_channel(int(channel_id))
+        if channel:
+            await self.status_reporter.send(channel, message)
+        else:
+            logger.warning(f"チャンネル {channel_id} が見つかりません")
+    
     async def on_ready(self):
         """ボット起動時の処理"""
         logger.info(f'{self.user.name} としてログインしました')
@@ -62,6 +99,38 @@ class ShortsBot(commands.Bot):
                 await ctx.send('テーマを指定してください。例: `!shorts 猫`')
                 return
             
+            # ジョブキューに投入し、待ち順と完了見込みを返す（上限に達している場合は拒否）
+            if self.submitter:
+                # 先頭に --new を付けると、同じテーマの動画を作成中でも別の動画を作成する
+                fresh = None
+                if theme.startswith('--new'):
+                    fresh = True
+                    theme = theme[len('--new'):].strip()
+                    if not theme:
+                        await ctx.send('テーマを指定してください。例: `!shorts --new 猫`')
+                        return
+                try:
+                    # チャットのリクエストはバッチなどより優先して処理する
+                    job = self.submitter(theme, user_id=str(ctx.author.id), channel_id=str(ctx.channel.id),
+                                         fresh=fresh, priority='interactive')
+                except QueueFull as e:
+                    await ctx.send(f'「{theme}」のリクエストを受け付けられませんでした。{e}')
+                    return
+                if len(job.requesters) > 1:
+                    header = (f'「{job.theme}」のショート動画を作成中のため、同じ動画をお届けします。'
+                              f'完了見込み: 約{_format_duration(job.eta_seconds)}'
+                              f'（別の動画にしたい場合は `!shorts --new {theme}`）')
+                else:
+                    header = (f'「{theme}」についてのショート動画生成を受け付けました。'
+                              f'待ち順: {job.position}番目、完了見込み: 約{_format_duration(job.eta_seconds)}'
+                              f'（取り消す場合は `!cancel {job.id}`）')
+                # 状況は1つのメッセージを編集して表示する（ステージが進むたびに新しいメッセージは送らない）
+                await self.status_reporter.post(job.id, ctx.channel, format_job_status(job), header=header)
+                # 投稿を待つ間に進んだ状況を反映する
+                self.status_reporter.update(job.id, format_job_status(job), final=job.done)
+                asyncio.create_task(self.run_callback(ctx, theme, job))
+                return
+            
             # 処理開始メッセージ
             await ctx.send(f'「{theme}」についてのショート動画生成を開始します...')
             
@@ -72,13 +141,31 @@ class ShortsBot(commands.Bot):
             else:
                 await ctx.send('コールバック関数が設定されていません')
         
+        @self.command(name='cancel', help='リクエストしたショート動画の生成を取り消します')
+        async def cancel_shorts(ctx, job_id=None):
+            """ショート動画の生成を取り消すコマンド（ジョブIDを省略した場合は最後のリクエスト）"""
+            if not self.canceller:
+                await ctx.send('取り消しには対応していません')
+                return
+            outcome, job = self.canceller(job_id, user_id=str(ctx.author.id))
+            if outcome == 'cancelled':
+                await ctx.send(f'「{job.theme}」のショート動画の生成を取り消しました。')
+            elif outcome == 'detached':
+                await ctx.send(f'「{job.theme}」のリクエストを取り消しました（同じ動画を待っている他のユーザーの分は続行します）。')
+            elif outcome == 'forbidden':
+                await ctx.send('他のユーザーのリクエストは取り消せません。')
+            else:
+                await ctx.send('取り消せるリクエストが見つかりませんでした（完了済みの可能性があります）。')
+        
         @self.command(name='help_shorts', help='ボットの使い方を表示します')
         async def help_shorts(ctx):
             """ヘルプコマンド"""
             help_text = """
 **YouTube Shorts 自動生成ボットの使い方**
 
-`!shorts テーマ` - 指定したテーマでショート動画を生成します
+`!shorts テーマ` - 指定したテーマでショート動画を生成します（同じテーマを作成中の場合はその動画を共有します）
+`!shorts --new テーマ` - 同じテーマを作成中でも別の動画を生成します
+`!cancel [ジョブID]` - リクエストを取り消します（ジョブIDを省略した場合は最後のリクエスト）
 `!help_shorts` - このヘルプを表示します
 
 **例**
@@ -86,29 +173,85 @@ class ShortsBot(commands.Bot):
 """
             await ctx.send(help_text)
     
-    async def run_callback(self, ctx, theme):
+    async def run_callback(self, ctx, theme, job=None):
         """
-        コールバック関数を実行
+        コールバック関数を実行（投入済みのジョブがある場合はその完了を待つ）して結果を通知する
         
         Args:
             ctx: コマンドコンテキスト
             theme (str): 動画のテーマ
+            job (PipelineJob, optional): 投入済みのジョブ
         """
         try:
-            # コールバック実行
-            result = await self.callback(theme)
+            if job is not None:
+                result = await job.wait()
+                if str(ctx.author.id) not in (requester['user_id'] for requester in job.requesters):
+                    # !cancel でこのユーザーの分だけ取り消した（他のユーザーの分は続行した）
+                    return
+            else:
+                # コールバック実行
+                result = await self.callback(theme, channel_id=str(ctx.channel.id))
             
-            if result.get('success'):
+            if result.get('queued'):
+                hours = result.get('release_in', 0) / 3600
+                await self.status_reporter.send(ctx.channel,
+                                                f'動画を作成しましたが、YouTube APIの本日のクォータが不足しているためアップロードを予約しました。\n'
+                                                f'予約順: {result.get("position")}番目（クォータのリセットまで約{hours:.1f}時間）。'
+                                                f'アップロードが完了したらこのチャンネルでお知らせします。')
+            elif result.get('success'):
                 video_id = result.get('video_id')
                 video_url = f"https://youtu.be/{video_id}" if video_id else "不明"
-                await ctx.send(f'動画の生成とアップロードが完了しました！\n{video_url}')
+                await self.status_reporter.send(ctx.channel, f'動画の生成とアップロードが完了しました！\n{video_url}')
+            elif result.get('cancelled'):
+                # 取り消しは !cancel の応答で通知済み
+                return
             else:
                 error = result.get('error', '不明なエラー')
-                await ctx.send(f'動画の生成に失敗しました。エラー: {error}')
+                await self.status_reporter.send(ctx.channel, f'動画の生成に失敗しました。エラー: {error}')
         
         except Exception as e:
             logger.error(f'コールバック実行中にエラーが発生: {str(e)}')
-            await ctx.send(f'エラーが発生しました: {str(e)}')
+            await self.status_reporter.send(ctx.channel, f'エラーが発生しました: {str(e)}')
+
+
+def _format_duration(seconds):
+    """秒数を「○分」「○秒」の表記にする"""
+    if seconds is None:
+        return '不明'
+    if seconds < 60:
+        return f'{max(1, round(seconds))}秒'
+    return f'{round(seconds / 60)}分'
+
+
+def format_job_status(job):
+    """
+    ジョブの状況メッセージの内容を作成する
+    
+    Args:
+        job (PipelineJob): 対象のジョブ
+    
+    Returns:
+        str: 状況を表す1行（テキスト生成中は、確定した名言を続けて表示する）
+    """
+    if job.done:
+        result = job.result or {}
+        if result.get('queued'):
+            return '状況: 動画は完成しました（アップロードは予約済み）'
+        if result.get('success'):
+            return '状況: 完了しました'
+        if result.get('cancelled'):
+            return '状況: 取り消されました'
+        return f'状況: 失敗しました（{result.get("error", "不明なエラー")}）'
+    
+    stages = list(STAGE_LABELS)
+    if job.stage not in stages:
+        return '状況: 処理を待っています'
+    step = stages.index(job.stage) + 1
+    status = f'状況: {STAGE_LABELS[job.stage]}... ({step}/{len(stages)})'
+    quotes = job.data.get('quotes')
+    if job.stage == 'llm' and quotes:
+        status += '\n' + '\n'.join(f'> {quote}' for quote in quotes)
+    return status
 
 
 class DiscordBot:
@@ -131,16 +274,71 @@ class DiscordBot:
         self.command_prefix = command_prefix
         self.bot = None
         self.callback = None
+        self.submitter = None
+        self.canceller = None
+        self.status_reporter = StatusReporter()
+        self.startup_hooks = []
     
     def set_callback(self, callback):
         """
         コールバック関数を設定
         
         Args:
-            callback: 非同期コールバック関数 async def callback(theme) -> dict
+            callback: 非同期コールバック関数 async def callback(theme, channel_id=None) -> dict
         """
         self.callback = callback
     
+    def set_submitter(self, submitter):
+        """
+        ジョブを投入する関数を設定（設定されている場合は受け付け時に待ち順と完了見込みを返す）
+        
+        Args:
+            submitter: submitter(theme, user_id=None, channel_id=None, fresh=None, priority='normal') -> PipelineJob
+                       上限に達している場合は QueueFull を送出する
+        """
+        self.submitter = submitter
+    
+    def set_canceller(self, canceller):
+        """
+        ジョブを取り消す関数を設定（!cancel コマンドで使用）
+        
+        Args:
+            canceller: canceller(job_id=None, user_id=None) -> (結果, PipelineJob)
+                       結果は 'cancelled'、'detached'、'not_found'、'forbidden' のいずれか
+        """
+        self.canceller = canceller
+    
+    def add_startup_hook(self, hook):
+        """
+        ボット起動時にイベントループ上で実行する処理を追加
+        
+        Args:
+            hook: 非同期関数 async def hook()
+        """
+        self.startup_hooks.append(hook)
+    
+    def update_job_status(self, job):
+        """
+        ジョブの状況メッセージを更新する（パイプラインの状態の変化の通知先として登録する）
+        
+        Args:
+            job (PipelineJob): 状態が変化したジョブ
+        """
+        self.status_reporter.update(job.id, format_job_status(job), final=job.done)
+    
+    async def send_message(self, channel_id, message):
+        """
+        ボットからチャンネルにメッセージを送信する（起動前は何もしない）
+        
+        Args:
+            channel_id (str): 送信先のチャンネルID
+            message (str): 送信するメッセージ
+        """
+        if self.bot is None or not self.bot.is_ready():
+            logger.warning("Discordボットが起動していないためメッセージを送信できません")
+            return
+        await self.bot.send_to_channel(channel_id, message)
+    
     def run(self):
         """Discordボットを起動"""
         intents = discord.Intents.default()
@@ -150,16 +348,24 @@ class DiscordBot:
             command_prefix=self.command_prefix,
             intents=intents,
             channel_id=self.channel_id,
-            callback=self.callback
+            callback=self.callback,
+            startup_hooks=self.startup_hooks,
+            submitter=self.submitter,
+            status_reporter=self.status_reporter,
+            canceller=self.canceller
         )
         
         logger.info("Discordボットを起動中...")
-        self.bot.run(self.token)
+        # discord.py 独自のハンドラーを付けず、discord のログも logging_setup のキューから書き出す
+        self.bot.run(self.token, log_handler=None)
 
 
 if __name__ == "__main__":
     # テスト用コード
-    async def test_callback(theme):
+    from modules.logging_setup import setup_logging
+    setup_logging()
+    
+    async def test_callback(theme, channel_id=None):
         """テスト用のコールバック関数"""
         print(f"テーマ「{theme}」についての処理を実行します")
         # 実際の処理は行わずに成功を返す
@@ -0,0 +1,384 @@
+"""
+YouTube Data APIの動画アップロード（videos.insert の再開可能アップロード）を模擬するローカルサーバー
+Googleに接続せずにアップロード処理の速度計測や再開動作の確認を行うために使用する
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import struct
+import logging
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('youtube-shorts-bot.fake_youtube_server')
+
+# アップロードを受け付けるパス（discovery文書の mediaUpload に対応）
+UPLOAD_PATHS = ('/upload/youtube/v3/videos', '/resumable/upload/youtube/v3/videos')
+
+# 帯域制限時に一度に読み込むバイト数
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    """再開可能アップロードのリクエストを処理するハンドラ"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        """アクセスログはデバッグレベルで出力する"""
+        logger.debug(f"{self.address_string()} {format % args}")
+    
+    def _send_json(self, status, data, headers=None):
+        """JSONレスポンスを送信する"""
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_error(self, status, reason, message):
+        """Google APIと同じ形式のエラーレスポンスを送信する"""
+        self._send_json(status, {
+            'error': {
+                'code': status,
+                'message': message,
+                'errors': [{'reason': reason, 'domain': 'youtube.api', 'message': message}],
+            }
+        })
+    
+    def _send_resume_incomplete(self, received):
+        """308 Resume Incomplete を送信する（受信済みの範囲を Range で返す）"""
+        self.send_response(308)
+        if received > 0:
+            self.send_header('Range', f"bytes=0-{received - 1}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def _read_body(self, length, drop=False):
+        """
+        リクエスト本文を読み込む（帯域制限を適用する）
+        
+        Args:
+            length (int): 本文のバイト数
+            drop (bool): Trueの場合は半分だけ読んで接続を切断する
+        
+        Returns:
+            bytes: 本文、切断した場合はNone
+        """
+        server = self.server
+        limit = length // 2 if drop else length
+        chunks = []
+        received = 0
+        start = time.monotonic()
+        while received < limit:
+            data = self.rfile.read(min(READ_BLOCK_SIZE, limit - received))
+            if not data:
+                break
+            chunks.append(data)
+            received += len(data)
+            if server.bandwidth:
+                ahead = received / server.bandwidth - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+        
+        if drop:
+            # 応答を返さずに接続をリセットする（通信途中の切断を模擬）
+            self.close_connection = True
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            return None
+        return b''.join(chunks)
+    
+    def do_POST(self):
+        """アップロードセッションの開始"""
+        server = self.server
+        server.delay()
+        parsed = urlsplit(self.path)
+        query = parse_qs(parsed.query)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        
+        if parsed.path not in UPLOAD_PATHS or query.get('uploadType') != ['resumable']:
+            self._send_error(400, 'badRequest', 'Only resumable uploads are supported')
+            return
+        
+        if not server.charge_quota():
+            self._send_error(403, 'quotaExceeded',
+                             'The request cannot be completed because you have exceeded your quota.')
+            return
+        
+        try:
+            metadata = json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            self._send_error(400, 'parseError', 'Invalid JSON metadata')
+            return
+        
+        total = self.headers.get('X-Upload-Content-Length')
+        session_id = server.create_session(metadata, int(total) if total else None)
+        host = self.headers.get('Host') or f"{server.server_address[0]}:{server.server_address[1]}"
+        location = f"http://{host}{parsed.path}?uploadType=resumable&upload_id={session_id}"
+        
+        self.send_response(200)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def do_PUT(self):
+        """チャンクの受信と受信済み位置の問い合わせ"""
+        server = self.server
+        server.delay()
+        parsed = urlsplit(self.path)
+        session_id = parse_qs(parsed.query).get('upload_id', [None])[0]
+        length = int(self.headers.get('Content-Length', 0))
+        session = server.sessions.get(session_id)
+        
+        if session is None:
+            self.rfile.read(length)
+            self._send_error(404, 'notFound', 'Upload session not found')
+            return
+        
+        # Content-Range: bytes start-end/total または bytes */total（受信済み位置の問い合わせ）
+        content_range = self.headers.get('Content-Range', '')
+        range_part, _, total_part = content_range.replace('bytes ', '').partition('/')
+        if total_part and total_part != '*':
+            session['total'] = int(total_part)
+        
+        if range_part == '*' or length == 0:
+            server.count('status_queries')
+            self._respond_progress(session)
+            return
+        
+        injected = server.next_fault()
+        if injected == 'drop':
+            server.count('dropped_connections')
+            self._read_body(length, drop=True)
+            return
+        
+        data = self._read_body(length)
+        if data is None or len(data) < length:
+            return
+        
+        if injected == 'error':
+            server.count('injected_errors')
+            self._send_error(server.error_status, 'backendError', 'Injected server error')
+            return
+        
+        start = int(range_part.split('-')[0])
+        with server.lock:
+            if start <= session['received']:
+                # 再送で重なった部分は捨てる
+                new_bytes = data[session['received'] - start:]
+                session['received'] += len(new_bytes)
+                server.stats['bytes_received'] += len(new_bytes)
+            server.stats['chunks'] += 1
+        self._respond_progress(session)
+    
+    def _respond_progress(self, session):
+        """受信状況に応じて308または完了レスポンスを返す"""
+        server = self.server
+        if session['total'] is not None and session['received'] >= session['total']:
+            video = server.complete_session(session)
+            self._send_json(200, video)
+        else:
+            self._send_resume_incomplete(session['received'])
+
+
+class FakeYouTubeServer(ThreadingHTTPServer):
+    """YouTube Data APIの再開可能アップロードを模擬するサーバー"""
+    
+    daemon_threads = True
+    
+    def __init__(self, host='127.0.0.1', port=0, bandwidth=None, latency=0.0, error_rate=0.0, drop_rate=0.0,
+                 error_status=503, daily_quota=None, upload_cost=None, seed=None):
+        """
+        初期化
+        
+        Args:
+            host (str): 待ち受けるホスト
+            port (int): 待ち受けるポート（0の場合は空いているポート）
+            bandwidth (float, optional): 受信帯域の上限（バイト/秒）
+            latency (float): 各リクエストに加える遅延（秒）
+            error_rate (float): チャンクの受信後に5xxエラーを返す確率
+            drop_rate (float): チャンクの受信途中で接続を切断する確率
+            error_status (int): 注入するエラーのHTTPステータス
+            daily_quota (int, optional): クォータの上限（未指定の場合は無制限）
+            upload_cost (int, optional): アップロード1回のクォータ消費量
+            seed (int, optional): エラー注入の乱数シード
+        """
+        super().__init__((host, port), FakeYouTubeHandler)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.error_status = error_status
+        self.daily_quota = daily_quota
+        self.upload_cost = upload_cost or config.YOUTUBE_UPLOAD_QUOTA_COST
+        self.quota_used = 0
+        self.sessions = {}
+        self.videos = {}
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._faults = []
+        self._thread = None
+        self.stats = {
+            'sessions': 0,
+            'chunks': 0,
+            'bytes_received': 0,
+            'status_queries': 0,
+            'injected_errors': 0,
+            'dropped_connections': 0,
+            'quota_rejections': 0,
+            'completed': 0,
+        }
+    
+    @property
+    def url(self):
+        """APIのルートURL（config.YOUTUBE_API_ENDPOINT に設定する値）"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+    
+    def start(self):
+        """バックグラウンドのスレッドで待ち受けを開始する"""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-youtube-server', daemon=True)
+        self._thread.start()
+        logger.info(f"疑似YouTube APIサーバーを起動しました: {self.url}")
+        return self
+    
+    def stop(self):
+        """待ち受けを停止する"""
+        self.shutdown()
+        self.server_close()
+    
+    def delay(self):
+        """設定された遅延を加える"""
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def count(self, name):
+        """統計を1増やす"""
+        with self.lock:
+            self.stats[name] += 1
+    
+    def inject(self, fault, count=1):
+        """
+        次のチャンクに障害を注入する（確率による注入より優先される）
+        
+        Args:
+            fault (str): 'error'（5xxエラー）または 'drop'（接続の切断）
+            count (int): 注入するチャンク数
+        """
+        with self.lock:
+            self._faults.extend([fault] * count)
+    
+    def next_fault(self):
+        """次のチャンクに注入する障害を返す（注入しない場合はNone）"""
+        with self.lock:
+            if self._faults:
+                return self._faults.pop(0)
+            roll = self._random.random()
+        if roll < self.drop_rate:
+            return 'drop'
+        if roll < self.drop_rate + self.error_rate:
+            return 'error'
+        return None
+    
+    def charge_quota(self):
+        """
+        アップロード1回分のクォータを消費する
+        
+        Returns:
+            bool: 消費できた場合True、上限を超える場合False
+        """
+        with self.lock:
+            if self.daily_quota is not None and self.quota_used + self.upload_cost > self.daily_quota:
+                self.stats['quota_rejections'] += 1
+                return False
+            self.quota_used += self.upload_cost
+            return True
+    
+    def create_session(self, metadata, total):
+        """アップロードセッションを作成し、IDを返す"""
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = {'metadata': metadata, 'total': total, 'received': 0, 'video': None}
+            self.stats['sessions'] += 1
+        return session_id
+    
+    def complete_session(self, session):
+        """アップロードの完了を記録し、動画リソースを返す"""
+        with self.lock:
+            if session['video'] is None:
+                video_id = uuid.uuid4().hex[:11]
+                session['video'] = {
+                    'kind': 'youtube#video',
+                    'id': video_id,
+                    'snippet': session['metadata'].get('snippet', {}),
+                    'status': dict(session['metadata'].get('status', {}), uploadStatus='uploaded'),
+                }
+                self.videos[video_id] = {'size': session['received'], 'metadata': session['metadata']}
+                self.stats['completed'] += 1
+            return session['video']
+
+
+if __name__ == "__main__":
+    # 疑似サーバーに対してアップロードを行い、速度と再開の動作を計測する
+    import argparse
+    import tempfile
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    parser = argparse.ArgumentParser(description='疑似YouTube APIサーバーでのアップロード計測')
+    parser.add_argument('--size-mb', type=float, default=32, help='アップロードするファイルのサイズ（MB）')
+    parser.add_argument('--bandwidth-mbps', type=float, default=None, help='受信帯域の上限（MB/s）')
+    parser.add_argument('--latency', type=float, default=0.0, help='リクエストごとの遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='チャンクに5xxエラーを返す確率')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='チャンクの途中で切断する確率')
+    parser.add_argument('--chunk-mb', type=float, default=None, help='チャンクサイズ（MB、256KBの倍数に丸める）')
+    parser.add_argument('--seed', type=int, default=None, help='エラー注入の乱数シード')
+    args = parser.parse_args()
+    
+    server = FakeYouTubeServer(
+        bandwidth=args.bandwidth_mbps * 1e6 if args.bandwidth_mbps else None,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    ).start()
+    
+    work_dir = tempfile.mkdtemp(prefix='fake_youtube_')
+    config.YOUTUBE_API_ENDPOINT = server.url
+    config.UPLOAD_STATE_DIR = os.path.join(work_dir, 'upload_sessions')
+    if args.chunk_mb:
+        config.YOUTUBE_UPLOAD_CHUNK_SIZE = max(1, int(args.chunk_mb * 4)) * 256 * 1024
+    
+    from modules.youtube_uploader import YouTubeChannel
+    
+    video_path = os.path.join(work_dir, 'benchmark.mp4')
+    with open(video_path, 'wb') as f:
+        f.write(os.urandom(int(args.size_mb * 1e6)))
+    
+    channel = YouTubeChannel(name='benchmark', token_file=os.path.join(work_dir, 'token.pickle'))
+    start = time.perf_counter()
+    video_id = channel.upload_video(video_path, title='ベンチマーク', description='疑似サーバーへのアップロード')
+    elapsed = time.perf_counter() - start
+    
+    size = os.path.getsize(video_path)
+    print(f"動画ID: {video_id}")
+    print(f"転送: {size / 1e6:.1f} MB / {elapsed:.2f}秒 = {size / elapsed / 1e6:.2f} MB/s "
+          f"(チャンク {config.YOUTUBE_UPLOAD_CHUNK_SIZE / 1e6:.2f} MB)")
+    print(f"サーバー統計: {json.dumps(server.stats, ensure_ascii=False)}")
+    
+    server.stop()
+    sys.exit(0 if video_id and server.videos.get(video_id, {}).get('size') == size else 1)
@@ -6,49 +6,182 @@ FFmpegを直接実行して動画を処理するためのモジュール
 """
 
 import os
+import sys
+import json
+import time
+import threading
 import subprocess
 import logging
 import shlex
 
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules import metrics, tracing
+from modules.logging_setup import truncate
+
 logger = logging.getLogger('youtube-shorts-bot.ffmpeg_handler')
 
-def run_ffmpeg_command(command, log_output=True):
+FFMPEG_SECONDS = metrics.histogram('shorts_ffmpeg_seconds', 'FFmpeg・FFprobeの1回の実行時間（秒）', ('step', 'outcome'))
+FFMPEG_ACTIVE = metrics.gauge('shorts_ffmpeg_active', '実行中のFFmpegプロセス数', ('step',))
+
+# 中止・タイムアウトを確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+# テキスト描画のエンコード設定のプリセット（動画作成の処理量の見積もりにも使う）
+OVERLAY_PRESET = "fast"
+
+# x264のプリセットごとのエンコード時間の目安（medium を1とした相対値）
+X264_PRESET_COST = {
+    'ultrafast': 0.25, 'superfast': 0.35, 'veryfast': 0.5, 'faster': 0.7, 'fast': 0.85,
+    'medium': 1.0, 'slow': 1.6, 'slower': 2.6, 'veryslow': 5.0,
+}
+
+def run_ffmpeg_command(command, log_output=True, cancel_event=None, timeout=None, step='ffmpeg'):
     """
     FFmpegコマンドを実行する
     
+    中止された場合やタイムアウトした場合はFFmpegのプロセスを終了し、書きかけの出力ファイル（最後の引数）を削除する。
+    実行時間と結果は工程ごとにメトリクスに記録し、処理中のジョブのトレースには子プロセスのCPU時間も含めて記録する。
+    
     Args:
         command (list): FFmpegコマンドとその引数のリスト
         log_output (bool): 出力をログに記録するかどうか
-        
+        cancel_event (threading.Event, optional): セットされたら実行を中止するイベント
+        timeout (float, optional): 実行時間の上限（秒、未指定の場合は FFMPEG_TIMEOUT）
+        step (str): メトリクスに記録する工程名（'overlay'、'plate' など）
+    
     Returns:
         bool: コマンドが成功したかどうか
     """
+    timeout = timeout or config.FFMPEG_TIMEOUT
+    # 実行のたびに出力される数KBのバナーは不要なので抑える
+    if command[0] == 'ffmpeg' and '-hide_banner' not in command:
+        command = [command[0], '-hide_banner'] + command[1:]
+    start = time.monotonic()
+    with tracing.span(step, 'ffmpeg', output=os.path.basename(command[-1])) as span_args:
+        with FFMPEG_ACTIVE.track_inprogress(step=step):
+            success, rusage = _execute(command, log_output, cancel_event, timeout)
+        elapsed = time.monotonic() - start
+        if success:
+            outcome = 'success'
+        elif cancel_event is not None and cancel_event.is_set():
+            outcome = 'cancelled'
+        elif elapsed >= timeout:
+            outcome = 'timeout'
+        else:
+            outcome = 'error'
+        span_args['outcome'] = outcome
+        span_args.update(tracing.child_usage(rusage))
+    FFMPEG_SECONDS.observe(elapsed, step=step, outcome=outcome)
+    return success
+
+def _read_stream(stream, chunks):
+    """パイプの出力を最後まで読み込む（読み込み用のスレッドで実行する）"""
+    chunks.append(stream.read())
+    stream.close()
+
+def _wait(process):
+    """
+    終了したプロセスを回収し、子プロセスのリソース使用量を返す
+    
+    Returns:
+        resource.struct_rusage: リソース使用量（os.wait4 がない環境ではNone）
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # 他の箇所ですでに回収されている
+        process.wait()
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+def _run_process(command, cancel_event, timeout):
+    """
+    コマンドを実行して終了を待つ（中止・タイムアウトの場合はプロセスを終了する）
+    
+    communicate() は内部でプロセスを回収してしまい os.wait4 でリソース使用量を取得できないため、
+    出力は別スレッドで読み込み、終了したプロセスは _wait で回収する。
+    
+    Args:
+        command (list): コマンドとその引数のリスト
+        cancel_event (threading.Event, optional): セットされたら実行を中止するイベント
+        timeout (float): 実行時間の上限（秒）
+    
+    Returns:
+        tuple: (プロセス, 標準出力, 標準エラー出力, リソース使用量, 中止した理由（完了した場合はNone）)
+    """
+    deadline = time.monotonic() + timeout
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    
+    stdout_chunks, stderr_chunks = [], []
+    readers = [
+        threading.Thread(target=_read_stream, args=(process.stdout, stdout_chunks), daemon=True),
+        threading.Thread(target=_read_stream, args=(process.stderr, stderr_chunks), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    
+    reason = None
+    while any(reader.is_alive() for reader in readers):
+        if cancel_event is not None and cancel_event.is_set():
+            reason = "中止されました"
+        elif time.monotonic() >= deadline:
+            reason = f"{timeout:.0f}秒以内に完了しませんでした"
+        else:
+            for reader in readers:
+                reader.join(CANCEL_POLL_INTERVAL / len(readers))
+            continue
+        process.kill()
+        break
+    
+    rusage = _wait(process)
+    for reader in readers:
+        reader.join()
+    return process, ''.join(stdout_chunks), ''.join(stderr_chunks), rusage, reason
+
+def _execute(command, log_output, cancel_event, timeout):
+    """
+    FFmpegを実行して終了を待つ（中止・タイムアウトの場合は書きかけの出力ファイルを削除する）
+    
+    Returns:
+        tuple: (成功したかどうか, 子プロセスのリソース使用量またはNone)
+    """
     try:
-        logger.info(f"FFmpegコマンドを実行: {' '.join(command)}")
+        logger.info(f"FFmpegコマンドを実行: {truncate(' '.join(command))}")
         
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        process, _, stderr, rusage, reason = _run_process(command, cancel_event, timeout)
         
-        stdout, stderr = process.communicate()
+        if reason is not None:
+            if os.path.exists(command[-1]):
+                os.remove(command[-1])
+            logger.warning(f"FFmpegの実行が{reason}: {command[-1]}")
+            return False, rusage
         
         if process.returncode != 0:
-            logger.error(f"FFmpegエラー: {stderr}")
-            return False
+            logger.error(f"FFmpegエラー: {truncate(stderr)}")
+            return False, rusage
         
         if log_output and stderr:
-            logger.debug(f"FFmpeg出力: {stderr}")
-            
-        return True
+            logger.debug(f"FFmpeg出力: {truncate(stderr)}")
+        
+        return True, rusage
     
     except Exception as e:
         logger.error(f"FFmpeg実行エラー: {e}")
-        return False
+        return False, None
 
-def add_text_to_video(input_video, output_video, text, font_size=70, font_color="white", bg_opacity=0.5):
+def add_text_to_video(input_video, output_video, text, font_size=70, font_color="white", bg_opacity=0.5,
+                      cancel_event=None):
     """
     動画に直接テキストを描画する (ハードサブ方式)
     drawtextフィルターを使用して、動画の中央にテキストを描画
@@ -60,7 +193,8 @@ def add_text_to_video(input_video, output_video, text, font_size=70, font_color=
         font_size (int): フォントサイズ
         font_color (str): フォント色(「white」, 「yellow」など)
         bg_opacity (float): 背景の不透明度(0.0～1.0)
-        
+        cancel_event (threading.Event, optional): セットされたらFFmpegを終了して中止するイベント
+    
     Returns:
         bool: 成功したかどうか
     """
@@ -99,51 +233,98 @@ def add_text_to_video(input_video, output_video, text, font_size=70, font_color=
         "-i", input_video,
         "-vf", filter_complex,
         "-c:v", "libx264",
-        "-preset", "fast",
+        "-preset", OVERLAY_PRESET,
         "-crf", "22",
         "-c:a", "copy" if os.path.exists(input_video) else "-an",
         "-y",  # 既存ファイルを上書き
         output_video
     ]
     
-    logger.info(f"テキスト描画フィルター: {filter_complex}")
-    return run_ffmpeg_command(command)
+    logger.info(f"テキスト描画フィルター: {truncate(filter_complex)}")
+    return run_ffmpeg_command(command, cancel_event=cancel_event, step='overlay')
 
 
 # 元の関数名を維持するためのエイリアス
 add_subtitles_to_video = add_text_to_video
 
-def convert_to_vertical(input_video, output_video, target_width=1080, target_height=1920):
+def probe_video(input_video):
     """
-    動画を縦長形式（9:16比率）に変換する
-    水平方向にクロップし、縦幅を調整して適切な比率にする
+    FFprobeで動画の解像度と長さを取得する
     
     Args:
         input_video (str): 入力動画のパス
-        output_video (str): 出力動画のパス
-        target_width (int): 出力動画の幅
-        target_height (int): 出力動画の高さ
-        
+    
     Returns:
-        bool: 成功したかどうか
+        dict: {'width', 'height', 'duration'}（長さは秒、取得できない場合は0）、動画情報を取得できない場合はNone
     """
-    # 入力動画の情報を取得
     probe_cmd = [
         "ffprobe",
         "-v", "error",
         "-select_streams", "v:0",
-        "-show_entries", "stream=width,height",
-        "-of", "csv=p=0:s=x",
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "json",
         input_video
     ]
     
-    try:
-        result = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
-        source_width, source_height = map(int, result.stdout.strip().split('x'))
-        logger.info(f"元の動画サイズ: {source_width}x{source_height}")
-    except Exception as e:
-        logger.error(f"動画情報取得エラー: {e}")
-        return False
+    info = None
+    start = time.monotonic()
+    with tracing.span('probe', 'ffmpeg', input=os.path.basename(input_video)) as span_args:
+        try:
+            with FFMPEG_ACTIVE.track_inprogress(step='probe'):
+                process, stdout, stderr, rusage, reason = _run_process(probe_cmd, None, config.FFMPEG_TIMEOUT)
+            span_args.update(tracing.child_usage(rusage))
+            if reason is not None:
+                raise subprocess.TimeoutExpired(probe_cmd, config.FFMPEG_TIMEOUT)
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, probe_cmd, stdout, stderr)
+            data = json.loads(stdout)
+            stream = data['streams'][0]
+            info = {
+                'width': int(stream['width']),
+                'height': int(stream['height']),
+                'duration': float(data.get('format', {}).get('duration') or 0),
+            }
+            outcome = 'success'
+        except Exception as e:
+            outcome = 'timeout' if isinstance(e, subprocess.TimeoutExpired) else 'error'
+            logger.error(f"動画情報取得エラー: {e}")
+        span_args['outcome'] = outcome
+    FFMPEG_SECONDS.observe(time.monotonic() - start, step='probe', outcome=outcome)
+    return info
+
+def estimate_overlay_cost(info):
+    """
+    テキスト描画（背景プレートの再エンコード）の処理量を見積もる
+    
+    エンコード時間は画素数と長さにほぼ比例するため、解像度×長さにプリセットの係数を掛けた値を使う。
+    
+    Args:
+        info (dict): probe_video が返す背景プレートの情報
+    
+    Returns:
+        float: 処理量の見積もり（画素×秒、ジョブ同士の比較用）
+    """
+    duration = info.get('duration') or config.VIDEO_DURATION
+    return info['width'] * info['height'] * duration * X264_PRESET_COST.get(OVERLAY_PRESET, 1.0)
+
+def build_vertical_filter(input_video, target_width=1080, target_height=1920):
+    """
+    動画を縦長形式（9:16比率）にするフィルター文字列を作成する
+    
+    Args:
+        input_video (str): 入力動画のパス
+        target_width (int): 出力動画の幅
+        target_height (int): 出力動画の高さ
+    
+    Returns:
+        str: FFmpegの -vf に指定するフィルター、動画情報を取得できない場合はNone
+    """
+    # 入力動画の情報を取得
+    info = probe_video(input_video)
+    if info is None:
+        return None
+    source_width, source_height = info['width'], info['height']
+    logger.info(f"元の動画サイズ: {source_width}x{source_height}")
     
     # アスペクト比を計算
     source_aspect = source_width / source_height
@@ -160,21 +341,40 @@ def convert_to_vertical(input_video, output_video, target_width=1080, target_hei
         x_offset = int((source_width - crop_width) / 2)
         
         # フィルター文字列を作成
-        filter_complex = f"crop={crop_width}:{crop_height}:{x_offset}:0,scale={target_width}:{target_height}"
-    else:  # 縦長動画の場合
-        # 方法２：直接スケールを適用し、上下に黒いバーを付ける
-        if source_aspect < target_aspect:
-            # 入力がターゲットよりも縦長の場合は幅に合わせる
-            scaled_width = target_width
-            scaled_height = int(scaled_width / source_aspect)
-            y_padding = int((target_height - scaled_height) / 2)
-            filter_complex = f"scale={scaled_width}:{scaled_height},pad={target_width}:{target_height}:0:{y_padding}:black"
-        else:
-            # それ以外は高さに合わせる
-            scaled_height = target_height
-            scaled_width = int(scaled_height * source_aspect)
-            x_padding = int((target_width - scaled_width) / 2)
-            filter_complex = f"scale={scaled_width}:{scaled_height},pad={target_width}:{target_height}:{x_padding}:0:black"
+        return f"crop={crop_width}:{crop_height}:{x_offset}:0,scale={target_width}:{target_height}"
+    
+    # 縦長動画の場合
+    # 方法２：直接スケールを適用し、上下に黒いバーを付ける
+    if source_aspect < target_aspect:
+        # 入力がターゲットよりも縦長の場合は幅に合わせる
+        scaled_width = target_width
+        scaled_height = int(scaled_width / source_aspect)
+        y_padding = int((target_height - scaled_height) / 2)
+        return f"scale={scaled_width}:{scaled_height},pad={target_width}:{target_height}:0:{y_padding}:black"
+    
+    # それ以外は高さに合わせる
+    scaled_height = target_height
+    scaled_width = int(scaled_height * source_aspect)
+    x_padding = int((target_width - scaled_width) / 2)
+    return f"scale={scaled_width}:{scaled_height},pad={target_width}:{target_height}:{x_padding}:0:black"
+
+def convert_to_vertical(input_video, output_video, target_width=1080, target_height=1920):
+    """
+    動画を縦長形式（9:16比率）に変換する
+    水平方向にクロップし、縦幅を調整して適切な比率にする
+    
+    Args:
+        input_video (str): 入力動画のパス
+        output_video (str): 出力動画のパス
+        target_width (int): 出力動画の幅
+        target_height (int): 出力動画の高さ
+    
+    Returns:
+        bool: 成功したかどうか
+    """
+    filter_complex = build_vertical_filter(input_video, target_width, target_height)
+    if filter_complex is None:
+        return False
     
     # コマンドを構築
     command = [
@@ -190,8 +390,48 @@ def convert_to_vertical(input_video, output_video, target_width=1080, target_hei
     ]
     
     logger.info(f"縦長動画変換フィルター: {filter_complex}")
-    return run_ffmpeg_command(command)
+    return run_ffmpeg_command(command, step='vertical')
 
+def prepare_vertical_clip(input_video, output_video, target_width=1080, target_height=1920, start_time=0,
+                          duration=None, mute=False, cancel_event=None):
+    """
+    シーク・縦長変換・長さの調整・ミュートを1回のエンコードで行う
+    
+    入力側でシークし、必要な長さだけをデコードするため、背景動画全体を変換してから切り出すより速い。
+    
+    Args:
+        input_video (str): 入力動画のパス
+        output_video (str): 出力動画のパス
+        target_width (int): 出力動画の幅
+        target_height (int): 出力動画の高さ
+        start_time (float): 開始時間（秒）
+        duration (float): 動画の長さ（秒）。Noneの場合は最後まで
+        mute (bool): 音声を削除するかどうか
+        cancel_event (threading.Event, optional): セットされたらFFmpegを終了して中止するイベント
+    
+    Returns:
+        bool: 成功したかどうか
+    """
+    filter_complex = build_vertical_filter(input_video, target_width, target_height)
+    if filter_complex is None:
+        return False
+    
+    command = ["ffmpeg", "-ss", str(start_time)]
+    if duration is not None:
+        command.extend(["-t", str(duration)])
+    command.extend([
+        "-i", input_video,
+        "-vf", filter_complex,
+        # 後で字幕を描画して再エンコードするため、中間ファイルは高画質・高速な設定にする
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", "18",
+    ])
+    command.extend(["-an"] if mute else ["-c:a", "copy"])
+    command.extend(["-y", output_video])
+    
+    logger.info(f"背景動画の下準備フィルター: {filter_complex}")
+    return run_ffmpeg_command(command, cancel_event=cancel_event, step='plate')
 
 # 目的のために元の関数名を導入するようにエイリアスを定義
 crop_video = convert_to_vertical
@@ -205,7 +445,7 @@ def trim_video(input_video, output_video, start_time=0, duration=None):
         output_video (str): 出力動画のパス
         start_time (float): 開始時間（秒）
         duration (float): 動画の長さ（秒）。Noneの場合は最後まで
-        
+    
     Returns:
         bool: 成功したかどうか
     """
@@ -230,7 +470,7 @@ def trim_video(input_video, output_video, start_time=0, duration=None):
         output_video
     ])
     
-    return run_ffmpeg_command(command)
+    return run_ffmpeg_command(command, step='trim')
 
 def mute_video(input_video, output_video):
     """
@@ -239,7 +479,7 @@ def mute_video(input_video, output_video):
     Args:
         input_video (str): 入力動画のパス
         output_video (str): 出力動画のパス
-        
+    
     Returns:
         bool: 成功したかどうか
     """
@@ -252,4 +492,4 @@ def mute_video(input_video, output_video):
         output_video
     ]
     
-    return run_ffmpeg_command(command)
+    return run_ffmpeg_command(command, step='mute')
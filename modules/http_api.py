@@ -0,0 +1,228 @@
+"""
+ジョブの投入・状況確認を行うHTTP APIのモジュール
+Discordと同じパイプラインにジョブを投入し、社内ツールや負荷試験から直接利用できるようにする
+"""
+import os
+import sys
+import hmac
+import logging
+from collections import OrderedDict
+
+from aiohttp import web
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules.pipeline import QueueFull
+
+logger = logging.getLogger('youtube-shorts-bot.http_api')
+
+# APIから指定できる優先度クラス（interactive とその予約枠はDiscordのユーザー用）
+API_PRIORITY_CLASSES = ('normal', 'bulk')
+
+
+class JobAPI:
+    """ジョブの投入（単体・まとめて）と状況・結果の取得を行うHTTPサーバー"""
+    
+    def __init__(self, submitter, pipeline, host=None, port=None, token=None, max_batch=None, result_cache=None,
+                 interactive_token=None):
+        """
+        初期化
+        
+        Args:
+            submitter: submitter(theme, user_id=None, channel_id=None, fresh=None, options=None, priority='normal')
+                       -> PipelineJob
+                       上限に達している場合は QueueFull を送出する
+            pipeline (PipelineScheduler): 状況の取得に使うパイプライン
+            host (str, optional): 待ち受けるアドレス
+            port (int, optional): 待ち受けるポート
+            token (str, optional): 設定されている場合は Authorization: Bearer <token> を必須にする
+            interactive_token (str, optional): このトークンで認証したリクエストのみ priority に interactive を指定できる
+            max_batch (int, optional): 1回のリクエストで投入できるジョブ数の上限
+            result_cache (int, optional): 結果を保持しておく完了済みジョブ数
+        """
+        self.submitter = submitter
+        self.pipeline = pipeline
+        self.host = host or config.HTTP_API_HOST
+        self.port = port if port is not None else config.HTTP_API_PORT
+        self.token = token if token is not None else config.HTTP_API_TOKEN
+        self.interactive_token = interactive_token if interactive_token is not None else config.HTTP_API_INTERACTIVE_TOKEN
+        self.max_batch = max_batch or config.HTTP_API_MAX_BATCH
+        self.result_cache = result_cache or config.HTTP_API_RESULT_CACHE
+        # APIから投入したジョブ（完了後も結果の取得用に一定数保持する）
+        self._jobs = OrderedDict()
+        self._runner = None
+        
+        self.app = web.Application(middlewares=[self._auth_middleware])
+        self.app.add_routes([
+            web.post('/jobs', self.handle_submit),
+            web.get('/jobs/{job_id}', self.handle_status),
+            web.delete('/jobs/{job_id}', self.handle_cancel),
+            web.get('/health', self.handle_health),
+        ])
+    
+    @web.middleware
+    async def _auth_middleware(self, request, handler):
+        """トークンが設定されている場合は認証する（/health は除く。interactive 用のトークンでも認証できる）"""
+        authorization = request.headers.get('Authorization', '')
+        request['interactive'] = bool(self.interactive_token) and hmac.compare_digest(
+            authorization, f"Bearer {self.interactive_token}")
+        if self.token and request.path != '/health' and not request['interactive']:
+            if not hmac.compare_digest(authorization, f"Bearer {self.token}"):
+                return web.json_response({'error': '認証に失敗しました'}, status=401)
+        return await handler(request)
+    
+    async def start(self):
+        """サーバーを起動する（イベントループ内で呼び出す）"""
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"ジョブAPIを起動しました: http://{self.host}:{self.port}")
+    
+    async def stop(self):
+        """サーバーを停止する"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    def _remember(self, job):
+        """投入したジョブを保持する（完了済みのジョブは古いものから破棄する）"""
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+        overflow = len(self._jobs) - self.result_cache
+        if overflow <= 0:
+            return
+        for job_id in [job_id for job_id, kept in self._jobs.items() if kept.done][:overflow]:
+            del self._jobs[job_id]
+    
+    def _submit_one(self, item, interactive=False):
+        """
+        1件を投入する
+        
+        Args:
+            item (dict | str): 投入するジョブ
+            interactive (bool): interactive 用のトークンで認証したリクエストかどうか
+        
+        Returns:
+            tuple: (レスポンスの項目, HTTPステータス)
+        """
+        if isinstance(item, str):
+            item = {'theme': item}
+        theme = (item.get('theme') or '').strip() if isinstance(item, dict) else ''
+        if not theme:
+            return {'error': 'theme を指定してください'}, 400
+        options = item.get('options') or {}
+        if not isinstance(options, dict):
+            return {'theme': theme, 'error': 'options はオブジェクトで指定してください'}, 400
+        priority = item.get('priority') or 'normal'
+        if priority == 'interactive' and not interactive:
+            return {'theme': theme, 'error': 'interactive は HTTP_API_INTERACTIVE_TOKEN で認証した場合のみ指定できます'}, 403
+        if priority not in API_PRIORITY_CLASSES + ('interactive',):
+            return {'theme': theme, 'error': f"priority は {', '.join(API_PRIORITY_CLASSES)} のいずれかで指定してください"}, 400
+        
+        try:
+            job = self.submitter(theme, user_id=item.get('user_id'), channel_id=item.get('channel_id'),
+                                 fresh=item.get('fresh'), options=options, priority=priority)
+        except QueueFull as e:
+            return {'theme': theme, 'status': 'rejected', 'error': str(e)}, 429
+        
+        self._remember(job)
+        return {
+            'id': job.id,
+            'theme': job.theme,
+            'priority': job.priority,
+            'status': 'accepted',
+            'coalesced': len(job.requesters) > 1,
+            'position': job.position,
+            'eta_seconds': round(job.eta_seconds or 0, 1),
+        }, 202
+    
+    def _retry_after(self):
+        """受け付けを拒否したときに、再投入まで待つ目安の秒数を返す"""
+        stages = self.pipeline.metrics()['stages']
+        if not stages:
+            return 1
+        throughput = min(stage['concurrency'] / max(stage['average_seconds'], 0.1) for stage in stages.values())
+        return max(1, round(1 / throughput))
+    
+    async def handle_submit(self, request):
+        """
+        POST /jobs
+        
+        本文は {"theme": ..., "options": {...}, "fresh": bool, "priority": "normal"} の1件、
+        または {"jobs": [...]} のまとめて投入。
+        まとめて投入した場合は、受け付けの上限を超えた分だけが rejected になる。
+        """
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'error': '本文がJSONではありません'}, status=400)
+        
+        if isinstance(body, dict) and 'jobs' in body:
+            items = body['jobs']
+            if not isinstance(items, list):
+                return web.json_response({'error': 'jobs は配列で指定してください'}, status=400)
+            if len(items) > self.max_batch:
+                return web.json_response({'error': f'1回に投入できるのは{self.max_batch}件までです'}, status=413)
+            results = [self._submit_one(item, request['interactive'])[0] for item in items]
+            accepted = sum(result.get('status') == 'accepted' for result in results)
+            status = 202 if accepted else 429
+            headers = {} if accepted == len(items) else {'Retry-After': str(self._retry_after())}
+            return web.json_response({'accepted': accepted, 'jobs': results}, status=status, headers=headers)
+        
+        if not isinstance(body, dict):
+            return web.json_response({'error': '本文はオブジェクトで指定してください'}, status=400)
+        result, status = self._submit_one(body, request['interactive'])
+        headers = {'Retry-After': str(self._retry_after())} if status == 429 else {}
+        return web.json_response(result, status=status, headers=headers)
+    
+    async def handle_status(self, request):
+        """GET /jobs/{job_id} ジョブの状況と、完了している場合は結果を返す"""
+        job_id = request.match_info['job_id']
+        job = self._jobs.get(job_id) or self.pipeline.jobs.get(job_id)
+        if job is None:
+            return web.json_response({'error': 'ジョブが見つかりません'}, status=404)
+        
+        status = {
+            'id': job.id,
+            'theme': job.theme,
+            'priority': job.priority,
+            'stage': job.stage,
+            'done': job.done,
+            'requesters': len(job.requesters),
+            'created_at': job.created_at.isoformat(),
+            'stage_seconds': job.stage_seconds,
+        }
+        if job.done:
+            status['result'] = job.result
+        else:
+            position = self.pipeline.position(job)
+            status['position'] = position
+            if position is not None:
+                status['eta_seconds'] = round(self.pipeline.estimate_seconds(position - 1), 1)
+        return web.json_response(status)
+    
+    async def handle_cancel(self, request):
+        """
+        DELETE /jobs/{job_id} ジョブを取り消す
+        
+        クエリ user_id を指定した場合は、そのユーザーのリクエスト分だけを取り消す（他のリクエスト元がいる場合）。
+        """
+        job_id = request.match_info['job_id']
+        outcome = self.pipeline.cancel(job_id, user_id=request.query.get('user_id'))
+        if outcome == 'not_found':
+            job = self._jobs.get(job_id)
+            if job is not None and job.done:
+                return web.json_response({'id': job_id, 'error': 'ジョブは完了済みです', 'result': job.result},
+                                         status=409)
+            return web.json_response({'error': 'ジョブが見つかりません'}, status=404)
+        if outcome == 'forbidden':
+            return web.json_response({'id': job_id, 'error': 'このユーザーのリクエストではありません'}, status=403)
+        return web.json_response({'id': job_id, 'status': outcome})
+    
+    async def handle_health(self, request):
+        """GET /health パイプラインの状況を返す"""
+        return web.json_response({'status': 'ok', 'pipeline': self.pipeline.metrics()})
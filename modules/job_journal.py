@@ -0,0 +1,211 @@
+"""
+パイプラインのジョブの状態遷移を追記形式で記録するモジュール
+プロセスが途中で終了しても、再起動時に未完了のジョブを最後に完了したステージの次から再開できるようにする
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('youtube-shorts-bot.job_journal')
+
+
+class JobJournal:
+    """ジョブの受け付け・ステージ完了・成果物・終了を1行1イベントのJSONで記録するクラス"""
+    
+    def __init__(self, path=None, max_bytes=None):
+        """
+        初期化
+        
+        Args:
+            path (str, optional): 記録先のファイル（未指定の場合は JOB_JOURNAL_FILE）
+            max_bytes (int, optional): このサイズを超えたら終了したジョブの記録を削除する（未指定の場合は JOB_JOURNAL_MAX_BYTES）
+        """
+        self.path = path or config.JOB_JOURNAL_FILE
+        self.max_bytes = max_bytes or config.JOB_JOURNAL_MAX_BYTES
+        # 未完了のジョブの記録だけで大きい場合に毎回削除し直さないよう、次に削除するサイズを持つ
+        self._compact_at = self.max_bytes
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+    
+    def append(self, job_id, event, **fields):
+        """
+        イベントを追記する（書き込みは専用のスレッドで行い、呼び出し元のイベントループを止めない）
+        
+        書き込みに失敗してもジョブは止めない。
+        
+        Args:
+            job_id (str): ジョブID
+            event (str): 'submitted'（受け付け）、'stage'（ステージ完了）、'artifact'（ステージ途中の成果物）、
+                         'finished'（終了）のいずれか
+            **fields: イベントの内容（JSONに変換できる値。呼び出した時点の内容を記録する）
+        """
+        record = {'ts': datetime.now().isoformat(), 'job_id': job_id, 'event': event}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        self._start_writer()
+        self._queue.put(line)
+    
+    def flush(self, timeout=None):
+        """
+        キューに残っているイベントを書き終えるまで待つ
+        
+        Args:
+            timeout (float, optional): 待つ時間の上限（秒）
+        """
+        if self._writer is None:
+            return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+    
+    def _start_writer(self):
+        """書き込み用のスレッドを開始する（初回のみ）"""
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='job-journal', daemon=True)
+                self._writer.start()
+                # 終了時にキューに残っている記録を書き出す
+                atexit.register(self.flush, 5)
+    
+    def _write_loop(self):
+        """キューに溜まったイベントをまとめて書き込む（fsync はまとめて1回にする）"""
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [item for item in items if isinstance(item, str)]
+            if lines:
+                self._write(lines)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+    
+    def _write(self, lines):
+        """イベントをファイルに追記し、上限を超えた場合は終了したジョブの記録を削除する"""
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(line + '\n' for line in lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = f.tell()
+            except OSError as e:
+                logger.error(f"ジョブの記録に失敗しました: {e}")
+                return
+            if size < self._compact_at:
+                return
+            try:
+                self._compact()
+            except OSError as e:
+                logger.error(f"ジョブの記録の整理に失敗しました: {e}")
+                return
+            self._compact_at = max(self.max_bytes, os.path.getsize(self.path) * 2)
+    
+    def _read(self):
+        """記録を読み込む（書き込み途中で終了した最後の行などの壊れた行は読み飛ばす）"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"ジョブの記録の壊れた行を読み飛ばします: {line[:80]!r}")
+        return records
+    
+    def replay(self):
+        """
+        記録を再生して各ジョブの最新の状態を作る
+        
+        Returns:
+            dict: ジョブIDと状態の辞書（受け付け順）。状態は {'id', 'theme', 'user_id', 'channel_id', 'key_options',
+                  'priority', 'stage'（最後に完了したステージ、未完了の場合はNone）, 'data'（ステージ間の成果物）, 'finished'}
+        """
+        states = {}
+        self.flush()
+        with self._lock:
+            records = self._read()
+        for record in records:
+            job_id = record.get('job_id')
+            event = record.get('event')
+            if event == 'submitted':
+                states[job_id] = {
+                    'id': job_id,
+                    'theme': record.get('theme'),
+                    'user_id': record.get('user_id'),
+                    'channel_id': record.get('channel_id'),
+                    'key_options': record.get('key_options') or {},
+                    'priority': record.get('priority') or 'normal',
+                    'stage': None,
+                    'data': {},
+                    'finished': False,
+                }
+                continue
+            state = states.get(job_id)
+            if state is None:
+                continue
+            if event == 'stage':
+                state['stage'] = record.get('stage')
+                state['data'].update(record.get('data') or {})
+            elif event == 'artifact':
+                state['data'].update(record.get('data') or {})
+            elif event == 'finished':
+                state['finished'] = True
+        return states
+    
+    def unfinished(self):
+        """
+        未完了のジョブの状態を受け付け順に返す
+        
+        Returns:
+            list: replay の状態のリスト
+        """
+        return [state for state in self.replay().values() if not state['finished']]
+    
+    def compact(self):
+        """
+        終了したジョブの記録を削除して、未完了のジョブの記録だけを残す
+        
+        起動時に呼ぶほか、実行中もファイルが max_bytes を超えるたびに書き込み用のスレッドが行う。
+        
+        Returns:
+            int: 残したジョブ数
+        """
+        self.flush()
+        with self._lock:
+            return self._compact()
+    
+    def _compact(self):
+        """終了したジョブの記録を削除する（self._lock を取得した状態で呼ぶ）"""
+        records = self._read()
+        finished = {record.get('job_id') for record in records if record.get('event') == 'finished'}
+        kept = [record for record in records if record.get('job_id') not in finished]
+        if len(kept) == len(records):
+            return len({record.get('job_id') for record in kept})
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in kept:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logger.info(f"ジョブの記録から終了した{len(finished)}件を削除しました")
+        return len({record.get('job_id') for record in kept})
@@ -0,0 +1,193 @@
+"""
+ログの出力設定を行うモジュール
+ログはキューに入れて専用のスレッドで書き出し（イベントループをファイルI/Oで止めない）、
+ファイルのローテーション・JSON形式での出力・ジョブIDの付与を行う
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+# テキスト形式のログの書式（%(context)s はワーカー名・ジョブID）
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(context)s%(message)s'
+
+# 処理中のジョブID（パイプラインのステージごとに設定され、ログに付与される）
+job_id = contextvars.ContextVar('job_id', default=None)
+
+_listener = None
+_worker_queue = None
+_worker_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """ログにジョブIDとプロセス名を付与するフィルター（記録した時点のコンテキストで実行する）"""
+    
+    def filter(self, record):
+        # ワーカープロセスから転送されたログは、ワーカー側で付与した値をそのまま使う
+        if not hasattr(record, 'job_id'):
+            record.job_id = job_id.get()
+        if not hasattr(record, 'context'):
+            tags = []
+            if record.processName != 'MainProcess':
+                tags.append(record.processName)
+            if record.job_id:
+                tags.append(f'job={record.job_id}')
+            record.context = f"[{' '.join(tags)}] " if tags else ''
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1件のJSONでログを出力するフォーマッター"""
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'job_id': getattr(record, 'job_id', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _Dispatcher(logging.Handler):
+    """ワーカープロセスから受け取ったログを、受け付けプロセスの同じ名前のロガーに渡すハンドラー"""
+    
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _file_handler():
+    """ローテーションするファイルハンドラーを作成する（LOG_ROTATE_WHEN を設定した場合は時間、それ以外はサイズで）"""
+    directory = os.path.dirname(config.LOG_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+
+
+def _install_queue_handler(log_queue, level):
+    """ルートロガーの出力先をキューだけにする"""
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+
+def setup_logging(level=None):
+    """
+    ログの出力を設定する（エントリーポイントで一度だけ呼ぶ。2回目以降は何もしない）
+    
+    ログはキューを経由して専用のスレッドが標準エラー出力と LOG_FILE に書き出す。
+    
+    Args:
+        level (str, optional): ログレベル（未指定の場合は LOG_LEVEL）
+    """
+    global _listener
+    if _listener is not None:
+        return
+    
+    handlers = [logging.StreamHandler()]
+    if config.LOG_FILE:
+        handlers.append(_file_handler())
+    formatter = JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    _install_queue_handler(log_queue, level or config.LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """キューに残っているログを書き出して、書き出し用のスレッドを停止する"""
+    global _listener, _worker_listener
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def worker_log_queue(context):
+    """
+    ワーカープロセスのログを受け取るキューを返す（初回に受け付けプロセス側の受信スレッドを開始する）
+    
+    ワーカーのログは受け付けプロセスの書き出し用のスレッドにまとめ、複数のプロセスが同じファイルをローテーションしないようにする。
+    
+    Args:
+        context (multiprocessing.context.BaseContext): ワーカープロセスの起動に使うコンテキスト
+    
+    Returns:
+        multiprocessing.Queue: ワーカープロセスに渡すキュー
+    """
+    global _worker_queue, _worker_listener
+    if _worker_queue is None:
+        _worker_queue = context.Queue()
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, _Dispatcher())
+        _worker_listener.start()
+    return _worker_queue
+
+
+def setup_worker_logging(log_queue, level=None):
+    """
+    ワーカープロセスのログを受け付けプロセスに送るように設定する
+    
+    Args:
+        log_queue (multiprocessing.Queue): worker_log_queue が返したキュー
+        level (str, optional): ログレベル（未指定の場合は LOG_LEVEL）
+    """
+    _install_queue_handler(log_queue, level or config.LOG_LEVEL)
+
+
+@contextmanager
+def job_context(value):
+    """ブロックの中で記録するログにジョブIDを付与する"""
+    token = job_id.set(value)
+    try:
+        yield
+    finally:
+        job_id.reset(token)
+
+
+def truncate(text, limit=None):
+    """
+    長い出力（FFmpegのコマンドラインやstderrなど）を先頭と末尾だけ残して切り詰める
+    
+    Args:
+        text (str): 対象の文字列
+        limit (int, optional): 残す文字数（未指定の場合は LOG_MAX_FIELD_CHARS、0以下は切り詰めない）
+    
+    Returns:
+        str: 切り詰めた文字列（エラーの原因が出やすい末尾を多めに残す）
+    """
+    text = str(text)
+    limit = config.LOG_MAX_FIELD_CHARS if limit is None else limit
+    if limit <= 0 or len(text) <= limit:
+        return text
+    head = limit // 4
+    tail = limit - head
+    return f"{text[:head]} …（{len(text) - limit}文字省略）… {text[-tail:]}"
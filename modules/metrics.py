@@ -0,0 +1,547 @@
+"""
+Prometheus形式のメトリクスを集計するモジュール
+ステージごとの件数・処理時間のヒストグラムとキューの長さなどのゲージを、専用のポートの /metrics とファイルに出力する
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('youtube-shorts-bot.metrics')
+
+# 処理時間のヒストグラムの区切り（秒）。p50/p95/p99 は histogram_quantile で求める
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# /metrics のContent-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# イベントループ上で集計する値を待つ時間の上限（秒）
+COLLECT_TIMEOUT = 5
+
+_lock = threading.Lock()
+_metrics = {}
+# (集計関数, 集計を実行するイベントループ) のリスト
+_collectors = []
+# ワーカープロセスから受け取った集計関数の値（送り元ごとの最新の値）
+_remote_families = {}
+# ワーカープロセスでは増分を記録し、タスクの結果と一緒に受け付けプロセスへ送る
+_forwarding = False
+_file_exporter = None
+_server = None
+
+
+def _escape(value):
+    """ラベルの値をエスケープする"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    """ラベルの組を {name="value",...} の表記にする"""
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    """値を出力形式の数値表記にする"""
+    value = float(value)
+    if value == float('inf'):
+        return '+Inf'
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """メトリクスの共通部分（ラベルの組ごとに値を持つ）"""
+    
+    type_name = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        初期化
+        
+        Args:
+            name (str): メトリクス名
+            documentation (str): 説明（# HELP に出力する）
+            labelnames (tuple): ラベル名
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._unsent = {}
+    
+    def _key(self, labels):
+        """ラベルの値を記録用のキーにする"""
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"{self.name} にないラベルです: {', '.join(sorted(unknown))}")
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+    
+    def samples(self):
+        """
+        出力するサンプルを返す
+        
+        Returns:
+            list: (メトリクス名, ラベルの組, 値) のリスト
+        """
+        with _lock:
+            return [(self.name, list(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """増えるだけの件数（ワーカープロセスの分も合算する）"""
+    
+    type_name = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        """
+        件数を増やす
+        
+        Args:
+            amount (float): 増やす量
+            **labels: ラベルの値
+        """
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            if _forwarding:
+                self._unsent[key] = self._unsent.get(key, 0) + amount
+    
+    def _drain(self):
+        unsent, self._unsent = self._unsent, {}
+        return unsent
+    
+    def _merge(self, values, source):
+        for key, amount in values.items():
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """現在の値（実行中の数など。ワーカープロセスの値は送り元ごとの最新の値を合算する）"""
+    
+    type_name = 'gauge'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        初期化
+        
+        Args:
+            name (str): メトリクス名
+            documentation (str): 説明
+            labelnames (tuple): ラベル名
+        """
+        super().__init__(name, documentation, labelnames)
+        # 送り元ごとの {ラベルのキー: 値}
+        self._remote = {}
+    
+    def set(self, value, **labels):
+        """値を設定する"""
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        """値を増やす"""
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        """値を減らす"""
+        self.inc(-amount, **labels)
+    
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """ブロックを実行している間だけ値を1増やす"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+    
+    def samples(self):
+        """受け付けプロセスとワーカープロセスの値を合算したサンプルを返す"""
+        with _lock:
+            values = dict(self._values)
+            for remote in self._remote.values():
+                for key, value in remote.items():
+                    values[key] = values.get(key, 0) + value
+        return [(self.name, list(zip(self.labelnames, key)), value) for key, value in values.items()]
+    
+    def _drain(self):
+        # 増分ではなく現在の値をそのまま送る
+        return dict(self._values)
+    
+    def _merge(self, values, source):
+        self._remote[source] = values
+
+
+class Histogram(_Metric):
+    """処理時間などの分布（区切りごとの累積件数・合計・件数。ワーカープロセスの分も合算する）"""
+    
+    type_name = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        初期化
+        
+        Args:
+            name (str): メトリクス名
+            documentation (str): 説明
+            labelnames (tuple): ラベル名
+            buckets (tuple): 区切りの上限値（昇順、+Inf は自動で加える）
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _empty(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+    
+    @staticmethod
+    def _add(entry, counts, total, count):
+        for index, value in enumerate(counts):
+            entry[0][index] += value
+        entry[1] += total
+        entry[2] += count
+    
+    def observe(self, value, **labels):
+        """
+        値を1件記録する
+        
+        Args:
+            value (float): 記録する値（秒・バイト数など）
+            **labels: ラベルの値
+        """
+        key = self._key(labels)
+        counts = [0] * (len(self.buckets) + 1)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        counts[index] = 1
+        with _lock:
+            self._add(self._values.setdefault(key, self._empty()), counts, value, 1)
+            if _forwarding:
+                self._add(self._unsent.setdefault(key, self._empty()), counts, value, 1)
+    
+    @contextmanager
+    def time(self, **labels):
+        """ブロックの実行時間を記録する"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+    
+    def samples(self):
+        """区切りごとの累積件数（_bucket）・合計（_sum）・件数（_count）のサンプルを返す"""
+        bounds = self.buckets + (float('inf'),)
+        samples = []
+        with _lock:
+            for key, (counts, total, count) in self._values.items():
+                pairs = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, value in zip(bounds, counts):
+                    cumulative += value
+                    samples.append((f'{self.name}_bucket', pairs + [('le', _format_value(bound))], cumulative))
+                samples.append((f'{self.name}_sum', pairs, total))
+                samples.append((f'{self.name}_count', pairs, count))
+        return samples
+    
+    def _drain(self):
+        unsent, self._unsent = self._unsent, {}
+        return unsent
+    
+    def _merge(self, values, source):
+        for key, (counts, total, count) in values.items():
+            self._add(self._values.setdefault(key, self._empty()), counts, total, count)
+
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    """メトリクスを登録する（同じ名前で登録済みの場合はそれを返す）"""
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"メトリクス {name} は別の種類・ラベルで登録されています")
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """
+    カウンターを登録する
+    
+    Args:
+        name (str): メトリクス名（'_total' で終わる名前にする）
+        documentation (str): 説明
+        labelnames (tuple): ラベル名
+    
+    Returns:
+        Counter: 登録したカウンター
+    """
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    """
+    ゲージを登録する
+    
+    Returns:
+        Gauge: 登録したゲージ
+    """
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """
+    ヒストグラムを登録する
+    
+    Returns:
+        Histogram: 登録したヒストグラム
+    """
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def register_collector(collector, loop=None):
+    """
+    出力のたびに呼ばれ、その時点の値を返す関数を登録する（キューの長さなど、別に状態を持つ値に使う）
+    
+    Args:
+        collector (callable): collector() -> [(メトリクス名, 種類, 説明, [(ラベルの辞書, 値), ...]), ...]
+        loop (asyncio.AbstractEventLoop, optional): イベントループが持つ状態を読む場合はそのループを指定する
+            （他のスレッドから出力する場合も、集計はこのループ上で行う）
+    """
+    with _lock:
+        _collectors.append((collector, loop))
+
+
+def _collect(collector, loop):
+    """集計関数を実行する（イベントループが指定されている場合はそのループ上で実行した結果を待つ）"""
+    if loop is None or not loop.is_running():
+        return collector()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return collector()
+    
+    async def snapshot():
+        return collector()
+    
+    return asyncio.run_coroutine_threadsafe(snapshot(), loop).result(timeout=COLLECT_TIMEOUT)
+
+
+def _collect_families(collectors):
+    """集計関数を実行し、(メトリクス名, 種類, 説明, [(ラベルの組, 値), ...]) のリストにする"""
+    families = []
+    for collector, loop in collectors:
+        try:
+            for name, type_name, documentation, values in _collect(collector, loop):
+                families.append((name, type_name, documentation,
+                                 [(sorted(labels.items()), value) for labels, value in values]))
+        except Exception as e:
+            logger.warning(f"メトリクスの収集に失敗しました: {str(e) or type(e).__name__}")
+    return families
+
+
+def enable_forwarding():
+    """ワーカープロセスで、カウンターとヒストグラムの増分を記録するようにする"""
+    global _forwarding
+    _forwarding = True
+
+
+def drain():
+    """
+    受け付けプロセスに送る値を取り出す（ワーカープロセス用）
+    
+    カウンターとヒストグラムは前回から増えた分、ゲージと集計関数はその時点の値を送る。
+    
+    Returns:
+        dict: メトリクス名と {ラベルのキー: 値} の辞書（集計関数の値は None をキーにする）
+    """
+    with _lock:
+        drained = {}
+        for name, metric in _metrics.items():
+            if isinstance(metric, Gauge) or metric._unsent:
+                drained[name] = metric._drain()
+        collectors = list(_collectors)
+    drained[None] = _collect_families(collectors)
+    return drained
+
+
+def merge(drained, source=None):
+    """
+    ワーカープロセスから受け取った値を合わせる
+    
+    Args:
+        drained (dict): drain() の戻り値
+        source (object, optional): 送り元（ゲージと集計関数の値は、送り元ごとに最新の値に置き換える）
+    """
+    drained = dict(drained or {})
+    families = drained.pop(None, None)
+    with _lock:
+        for name, values in drained.items():
+            metric = _metrics.get(name)
+            if metric is not None:
+                metric._merge(values, source)
+        if families is not None:
+            _remote_families[source] = families
+
+
+def forget(source):
+    """
+    送り元のゲージと集計関数の値を破棄する（ワーカープロセスが終了した場合）
+    
+    Args:
+        source (object): merge() に指定した送り元
+    """
+    with _lock:
+        _remote_families.pop(source, None)
+        for metric in _metrics.values():
+            if isinstance(metric, Gauge):
+                metric._remote.pop(source, None)
+
+
+def render():
+    """
+    すべてのメトリクスをPrometheusのテキスト形式にする
+    
+    Returns:
+        str: 出力内容
+    """
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+        remote_families = [family for families in _remote_families.values() for family in families]
+    
+    families = [(metric.name, metric.type_name, metric.documentation, metric.samples()) for metric in metrics]
+    # 集計関数の値は、受け付けプロセスとワーカープロセスで同じメトリクス名・ラベルのものを合算する
+    collected = {}
+    for name, type_name, documentation, samples in _collect_families(collectors) + remote_families:
+        values = collected.setdefault(name, (type_name, documentation, {}))[2]
+        for pairs, value in samples:
+            key = tuple(tuple(pair) for pair in pairs)
+            values[key] = values.get(key, 0) + value
+    for name, (type_name, documentation, values) in collected.items():
+        families.append((name, type_name, documentation, [(name, list(key), value) for key, value in values.items()]))
+    
+    lines = []
+    for name, type_name, documentation, samples in families:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {type_name}')
+        for sample_name, pairs, value in samples:
+            lines.append(f'{sample_name}{_format_labels(pairs)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(path=None):
+    """
+    メトリクスをファイルに書き出す（node_exporter のテキストファイル収集などで読めるよう、置き換えで書き込む）
+    
+    Args:
+        path (str, optional): 書き出すファイルのパス（未指定の場合は METRICS_FILE）
+    """
+    path = path or config.METRICS_FILE
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+def start_file_export(path=None, interval=None):
+    """
+    一定間隔でメトリクスをファイルに書き出すスレッドを開始する（METRICS_FILE が未設定の場合は何もしない）
+    
+    Args:
+        path (str, optional): 書き出すファイルのパス
+        interval (float, optional): 書き出す間隔（秒）
+    """
+    global _file_exporter
+    path = path or config.METRICS_FILE
+    if not path or _file_exporter is not None:
+        return
+    interval = interval or config.METRICS_FILE_INTERVAL
+    stop_event = threading.Event()
+    
+    def export_loop():
+        while not stop_event.wait(interval):
+            try:
+                write_file(path)
+            except OSError as e:
+                logger.warning(f"メトリクスをファイルに書き出せませんでした: {str(e)}")
+    
+    thread = threading.Thread(target=export_loop, name='metrics-file', daemon=True)
+    thread.start()
+    _file_exporter = (path, stop_event, thread)
+    logger.info(f"メトリクスを{interval:g}秒ごとに {path} に書き出します")
+
+
+def stop_file_export():
+    """ファイルへの書き出しを停止し、最後の値を書き出す"""
+    global _file_exporter
+    if _file_exporter is None:
+        return
+    path, stop_event, thread = _file_exporter
+    _file_exporter = None
+    stop_event.set()
+    thread.join(5)
+    try:
+        write_file(path)
+    except OSError as e:
+        logger.warning(f"メトリクスをファイルに書き出せませんでした: {str(e)}")
+
+
+async def _handle_metrics(request):
+    """GET /metrics Prometheus形式のメトリクスを返す"""
+    from aiohttp import web
+    return web.Response(body=render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_server(host=None, port=None):
+    """
+    /metrics だけを返すHTTPサーバーを起動する（イベントループ内で呼び出す。ポートが0の場合は何もしない）
+    
+    ジョブAPIとは別のポートで待ち受けるため、ジョブAPIを有効にしていないDiscordボットやバッチモードでも収集できる。
+    
+    Args:
+        host (str, optional): 待ち受けるアドレス（未指定の場合は METRICS_HOST）
+        port (int, optional): 待ち受けるポート（未指定の場合は METRICS_PORT）
+    """
+    global _server
+    host = host or config.METRICS_HOST
+    port = port if port is not None else config.METRICS_PORT
+    if not port or _server is not None:
+        return
+    # ワーカープロセスでは使わないため、ここで読み込む
+    from aiohttp import web
+    app = web.Application()
+    app.add_routes([web.get('/metrics', _handle_metrics)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        await runner.cleanup()
+        logger.error(f"メトリクスのサーバーを起動できませんでした（{host}:{port}）: {str(e)}")
+        return
+    _server = runner
+    logger.info(f"メトリクスを公開しました: http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    """メトリクスのサーバーを停止する"""
+    global _server
+    if _server is not None:
+        runner, _server = _server, None
+        await runner.cleanup()
@@ -0,0 +1,888 @@
+"""
+ジョブをステージ（テキスト生成・動画作成・アップロード）ごとに並行処理するパイプラインのモジュール
+ステージごとにキューと同時実行数を持ち、別々のジョブの異なるステージが同時に進むようにする
+"""
+import os
+import sys
+import time
+import json
+import uuid
+import heapq
+import queue
+import asyncio
+import itertools
+import functools
+import contextvars
+import threading
+import unicodedata
+import logging
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules import metrics, logging_setup, tracing
+
+logger = logging.getLogger('youtube-shorts-bot.pipeline')
+
+REQUESTS_TOTAL = metrics.counter('shorts_requests_total',
+                                 'リクエスト数（new: 新しいジョブ、coalesced: 実行中のジョブの結果を共有、rejected: 受け付けを拒否）',
+                                 ('result',))
+JOBS_TOTAL = metrics.counter('shorts_jobs_total', '完了したジョブ数（結果別）', ('result',))
+STAGE_SECONDS = metrics.histogram('shorts_stage_seconds', 'ステージの処理時間（秒）', ('stage', 'outcome'))
+STAGE_WAIT_SECONDS = metrics.histogram('shorts_stage_wait_seconds', 'ステージの待ち行列で待った時間（秒）', ('stage',))
+STAGE_FAILURES = metrics.counter('shorts_stage_failures_total', 'ステージの失敗数（原因別）', ('stage', 'cause'))
+
+# ステージの所要時間の移動平均に使う重み
+STAGE_SECONDS_SMOOTHING = 0.2
+
+# 優先度クラス（先頭ほど優先して処理する。Discordは interactive、HTTP APIは normal、バッチは bulk）
+PRIORITY_CLASSES = ('interactive', 'normal', 'bulk')
+
+
+class QueueFull(Exception):
+    """ジョブの受け付け上限に達した場合の例外（メッセージはそのまま利用者に表示できる）"""
+
+
+def coalesce_key(theme, **options):
+    """
+    同じ内容のリクエストを判定するためのキーを作成する
+    
+    テーマは全角・半角、大文字・小文字、前後と連続する空白の違いを無視して比較する。
+    
+    Args:
+        theme (str): 動画のテーマ
+        **options: 結果に影響するオプション
+    
+    Returns:
+        str: キー
+    """
+    normalized = ' '.join(unicodedata.normalize('NFKC', theme).casefold().split())
+    return json.dumps([normalized, options], ensure_ascii=False, sort_keys=True, default=str)
+
+
+class PriorityExecutor:
+    """優先度クラスの順に処理するスレッドプール（同じクラスの中は投入順）"""
+    
+    def __init__(self, max_workers, thread_name_prefix='priority'):
+        """
+        初期化
+        
+        Args:
+            max_workers (int): スレッド数
+            thread_name_prefix (str): スレッド名の接頭辞
+        """
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        for index in range(max_workers):
+            threading.Thread(target=self._run, name=f'{thread_name_prefix}_{index}', daemon=True).start()
+    
+    def submit(self, fn, *args, priority='normal'):
+        """
+        関数の実行を予約する（呼び出し元のコンテキストで実行するため、ログとトレースにジョブIDが引き継がれる）
+        
+        Args:
+            fn: 実行する関数
+            *args: 関数の引数
+            priority (str): 優先度クラス（PRIORITY_CLASSES のいずれか）
+        
+        Returns:
+            concurrent.futures.Future: 関数の戻り値を受け取るFuture
+        """
+        future = Future()
+        context = contextvars.copy_context()
+        self._queue.put((PRIORITY_CLASSES.index(priority), next(self._sequence), future, context, fn, args))
+        return future
+    
+    def _run(self):
+        """優先度の高いものから取り出して実行する"""
+        while True:
+            _, _, future, context, fn, args = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(context.run(fn, *args))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class PipelineJob:
+    """パイプラインで処理する1件のジョブ"""
+    
+    def __init__(self, theme, user_id=None, channel_id=None, job_id=None, priority='normal', cancel_event=None,
+                 **options):
+        """
+        初期化
+        
+        Args:
+            theme (str): 動画のテーマ
+            user_id (str, optional): リクエストしたユーザーのID
+            channel_id (str, optional): リクエスト元のチャンネルID
+            job_id (str, optional): ジョブID（記録から再開する場合に指定）
+            priority (str): 優先度クラス（PRIORITY_CLASSES のいずれか）
+            cancel_event (threading.Event, optional): 取り消し・期限切れのときにセットするイベント
+                （ジョブより先に始める処理と共有する場合に指定する）
+            **options: ジョブの付加情報
+        
+        Raises:
+            ValueError: 優先度クラスが正しくない場合
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"優先度は {', '.join(PRIORITY_CLASSES)} のいずれかを指定してください: {priority}")
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.theme = theme
+        self.priority = priority
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.options = options
+        self.key = None
+        # 結果を待っているリクエスト元（先頭がジョブを作成したリクエスト）
+        self.requesters = [{'user_id': user_id, 'channel_id': channel_id}]
+        # 受け付け時点の待ち順と完了見込み（秒）
+        self.position = None
+        self.eta_seconds = None
+        # ステージ間で受け渡すデータ（生成したテキスト、動画のパスなど）
+        self.data = {}
+        self.stage = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.stage_seconds = {}
+        # 処理関数はこのイベントで中止を知る（FFmpegの終了・通信の切断など）
+        self.cancel_event = cancel_event or threading.Event()
+        # 実行中の処理関数のタスク（取り消し時に止める）
+        self.handler_task = None
+        # 取り消し後もスレッドで動き続けている処理関数のFuture（終わるまでステージの枠を空けない）
+        self.handler_future = None
+        # 現在のステージの待ち行列に入った時刻（待ち時間の計測用）
+        self.queued_at = None
+        self._future = asyncio.get_running_loop().create_future()
+    
+    @property
+    def loop(self):
+        """ジョブを受け付けたイベントループ"""
+        return self._future.get_loop()
+    
+    @property
+    def done(self):
+        """処理が完了しているかどうか"""
+        return self._future.done()
+    
+    @property
+    def rank(self):
+        """優先度クラスの順位（小さいほど優先）"""
+        return PRIORITY_CLASSES.index(self.priority)
+    
+    async def wait(self):
+        """
+        ジョブの完了を待つ
+        
+        Returns:
+            dict: 処理結果
+        """
+        return await asyncio.shield(self._future)
+    
+    def add_done_callback(self, callback):
+        """
+        ジョブの完了時に呼ばれる関数を登録する
+        
+        Args:
+            callback: callback(job)
+        """
+        self._future.add_done_callback(lambda _: callback(self))
+    
+    def finish(self, result):
+        """処理結果を設定する"""
+        if not self._future.done():
+            self.result = result
+            self._future.set_result(result)
+
+
+class PipelineStage:
+    """パイプラインの1ステージ（優先度付きの待ち行列・ワーカー・スレッドプール）"""
+    
+    def __init__(self, name, handler, concurrency, expected_seconds=30.0, cost=None, reserved=0, timeout=None):
+        """
+        初期化
+        
+        Args:
+            name (str): ステージ名
+            handler: 処理関数 handler(job)。非同期関数の場合はイベントループ上、通常の関数の場合は
+                     ステージ専用のスレッドプールで実行する。dictを返すとジョブはその結果で完了し、
+                     Noneを返すと次のステージに進む
+            concurrency (int): 同時に処理するジョブ数
+            expected_seconds (float): 実績がない間に完了見込みの計算に使う1件あたりの所要時間
+            cost: 待ち行列に入れるときにジョブの処理量を見積もる関数 cost(job)。同じ優先度クラスの中では
+                  見積もりの小さいジョブから処理する（Noneを返したジョブは見積もれたジョブの後に回す）
+            reserved (int): interactive のジョブのために空けておく同時実行数（同時実行数-1まで）。
+                同時実行数が1で空けておけない場合は、代わりに interactive のジョブが控えている間
+                （interactive_pending() が真の間）は bulk のジョブを始めない
+            timeout (float, optional): 1件あたりの期限（秒）。超えたジョブは job.cancel_event をセットして失敗にする
+                （スレッドで実行する処理関数は止められないため、終わるまで同時実行の枠を使い続ける）
+        """
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.average_seconds = float(expected_seconds)
+        self.cost = cost
+        self.reserved = max(0, min(reserved, concurrency - 1))
+        self.hold_bulk = reserved > 0 and self.reserved == 0
+        # このステージに来る interactive のジョブがあるかを返す関数（スケジューラーが設定する）
+        self.interactive_pending = None
+        self.timeout = timeout or None
+        # (優先度クラスの順位, 見積もり, 投入順, ジョブ) のヒープ
+        self._heap = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event()
+        # interactive 以外のジョブを処理しているワーカー数
+        self.shared_busy = 0
+        self.executor = None
+        if not asyncio.iscoroutinefunction(handler):
+            self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'pipeline-{name}')
+        self.workers = []
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.busy_seconds = 0.0
+    
+    @property
+    def queued(self):
+        """待ち行列のジョブ数"""
+        return len(self._heap)
+    
+    def put(self, job):
+        """ジョブを待ち行列に入れる（優先度クラス、見積もりの小さい順、投入順に取り出される）"""
+        job.queued_at = time.monotonic()
+        heapq.heappush(self._heap, (job.rank, self._predict(job), next(self._sequence), job))
+        self._changed.set()
+    
+    def _predict(self, job):
+        """ジョブの処理量を見積もる"""
+        if self.cost is None:
+            return 0.0
+        try:
+            cost = self.cost(job)
+        except Exception as e:
+            logger.warning(f"ジョブ {job.id} のステージ {self.name} の見積もりに失敗しました: {e}")
+            cost = None
+        return float('inf') if cost is None else float(cost)
+    
+    def promote(self, job):
+        """待ち行列にあるジョブの順位を、変更後の優先度クラスに合わせて付け直す"""
+        for index, entry in enumerate(self._heap):
+            if entry[3] is job:
+                self._heap[index] = (job.rank,) + entry[1:]
+                heapq.heapify(self._heap)
+                self._changed.set()
+                return
+    
+    def remove(self, job):
+        """
+        待ち行列からジョブを外す
+        
+        Returns:
+            bool: 待ち行列にあった場合はTrue
+        """
+        for index, entry in enumerate(self._heap):
+            if entry[3] is job:
+                self._heap.pop(index)
+                heapq.heapify(self._heap)
+                self._changed.set()
+                return True
+        return False
+    
+    def _take(self):
+        """
+        次に処理するジョブを取り出す
+        
+        Returns:
+            tuple: (ジョブ, interactive 以外の枠を使ったかどうか)、処理できるジョブがない場合はNone
+        """
+        if not self._heap:
+            return None
+        job = self._heap[0][3]
+        if job.priority == 'bulk' and self.hold_bulk and self.interactive_pending and self.interactive_pending():
+            # 処理中の bulk のジョブは止められないため、interactive のジョブが来る前に始めない
+            return None
+        shared = job.priority != 'interactive'
+        if shared and self.shared_busy >= self.concurrency - self.reserved:
+            # 残りの枠は interactive のジョブのために空けておく
+            return None
+        heapq.heappop(self._heap)
+        self.shared_busy += shared
+        return job, shared
+    
+    async def get(self):
+        """
+        次に処理するジョブを待って取り出す
+        
+        Returns:
+            tuple: (ジョブ, interactive 以外の枠を使ったかどうか)
+        """
+        while True:
+            taken = self._take()
+            if taken is not None:
+                return taken
+            self._changed.clear()
+            await self._changed.wait()
+    
+    def release(self, shared):
+        """ジョブの処理が終わった枠を空ける"""
+        self.shared_busy -= shared
+        self._changed.set()
+    
+    def wake(self):
+        """待ち行列から取り出せるかを確認し直させる"""
+        self._changed.set()
+    
+    async def run_handler(self, job):
+        """処理関数を実行する"""
+        if self.executor is None:
+            return await self.handler(job)
+        # ログにジョブIDが付くよう、スレッドでも呼び出し元のコンテキストで実行する
+        context = contextvars.copy_context()
+        future = self.executor.submit(context.run, self.handler, job)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 実行前なら取りやめる。実行中のスレッドは止められないため、呼び出し元が終わりを待てるよう残す
+            if not future.cancel():
+                job.handler_future = future
+            raise
+
+
+class PipelineScheduler:
+    """ステージごとのキューと同時実行数でジョブを流すスケジューラー"""
+    
+    def __init__(self, max_pending=None, max_per_user=None, max_per_channel=None, journal=None,
+                 interactive_reserved=None, interactive_reserved_pending=None):
+        """
+        初期化
+        
+        Args:
+            max_pending (int, optional): 処理中・待機中のジョブ数の上限
+            max_per_user (int, optional): ユーザーごとの処理中・待機中のジョブ数の上限
+            max_per_channel (int, optional): チャンネルごとの処理中・待機中のジョブ数の上限
+            journal (JobJournal, optional): ジョブの状態遷移の記録先（再起動後の再開に使う）
+            interactive_reserved (int, optional): ステージごとに interactive のジョブのために空けておく同時実行数
+            interactive_reserved_pending (int, optional): 受け付け上限のうち interactive のジョブのために空けておく件数
+        """
+        self.stages = []
+        self.journal = journal
+        # 未完了のジョブ（受け付け順）
+        self.jobs = {}
+        self.max_pending = max_pending or config.PIPELINE_MAX_PENDING
+        self.max_per_user = max_per_user or config.PIPELINE_MAX_PER_USER
+        self.max_per_channel = max_per_channel or config.PIPELINE_MAX_PER_CHANNEL
+        self.interactive_reserved = (interactive_reserved if interactive_reserved is not None
+                                     else config.PIPELINE_INTERACTIVE_RESERVED)
+        self.interactive_reserved_pending = min(
+            self.max_pending - 1,
+            interactive_reserved_pending if interactive_reserved_pending is not None
+            else config.PIPELINE_INTERACTIVE_RESERVED_PENDING)
+        self.rejected = 0
+        # 実行中のジョブのキー（同じ内容のリクエストを1つのジョブにまとめる）
+        self._inflight = {}
+        self.coalesced = 0
+        self.cancelled = 0
+        self._listeners = []
+    
+    def add_stage(self, name, handler, concurrency=1, expected_seconds=30.0, cost=None, timeout=None):
+        """
+        ステージを追加する（追加した順に処理される）
+        
+        Args:
+            name (str): ステージ名
+            handler: 処理関数（PipelineStage を参照）
+            concurrency (int): 同時に処理するジョブ数
+            expected_seconds (float): 実績がない間に完了見込みの計算に使う1件あたりの所要時間
+            cost: ジョブの処理量を見積もる関数（PipelineStage を参照）
+            timeout (float, optional): 1件あたりの期限（秒、PipelineStage を参照）
+        """
+        stage = PipelineStage(name, handler, concurrency, expected_seconds,
+                              cost=cost, reserved=self.interactive_reserved, timeout=timeout)
+        stage.interactive_pending = functools.partial(self._interactive_pending, len(self.stages))
+        self.stages.append(stage)
+    
+    def _interactive_pending(self, index):
+        """
+        指定したステージに今後来る interactive のジョブ（受け付け済みで、そのステージ以前にあるもの）があるかを返す
+        
+        Args:
+            index (int): ステージの番号
+        
+        Returns:
+            bool: 該当するジョブがある場合True
+        """
+        names = [stage.name for stage in self.stages[:index + 1]]
+        return any(job.priority == 'interactive' and job.stage in names for job in self.jobs.values())
+    
+    def _wake_held(self, job):
+        """interactive のジョブが進んだ・完了したときに、bulk のジョブを止めているステージを起こす"""
+        if job.priority != 'interactive':
+            return
+        for stage in self.stages:
+            if stage.hold_bulk:
+                stage.wake()
+    
+    def add_listener(self, listener):
+        """
+        ジョブが次のステージに進んだとき・完了したときに呼ばれる関数を追加する
+        
+        Args:
+            listener: listener(job)。イベントループ上で呼ばれるため、時間のかかる処理はしないこと
+        """
+        self._listeners.append(listener)
+    
+    def report_progress(self, job, **data):
+        """
+        処理中のジョブの途中経過を job.data に反映して通知する（ステージのスレッドからも呼び出せる）
+        
+        途中経過は記録しない（再開時は最後に完了したステージの次からやり直すため）。
+        
+        Args:
+            job (PipelineJob): 対象のジョブ
+            **data: job.data に反映する値
+        """
+        def update():
+            if job.done:
+                return
+            job.data.update(data)
+            self._notify(job)
+        try:
+            job.loop.call_soon_threadsafe(update)
+        except RuntimeError:
+            # イベントループが終了している
+            pass
+    
+    def _notify(self, job):
+        """ジョブの状態の変化を通知する"""
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.error(f"ジョブ {job.id} の状態の通知中にエラーが発生: {str(e)}")
+    
+    def start(self):
+        """各ステージのワーカーを起動する（イベントループ内で呼び出す。起動済みの場合は何もしない）"""
+        if all(stage.workers for stage in self.stages):
+            return
+        loop = asyncio.get_running_loop()
+        for index, stage in enumerate(self.stages):
+            if stage.workers:
+                continue
+            for _ in range(stage.concurrency):
+                stage.workers.append(loop.create_task(self._worker(index, stage)))
+        logger.info("パイプラインを起動しました: " +
+                    ", ".join(f"{stage.name}×{stage.concurrency}" for stage in self.stages))
+        for stage in self.stages:
+            if stage.hold_bulk:
+                logger.info(f"ステージ {stage.name} は同時実行数が1で interactive 用の枠を空けておけないため、"
+                            f"interactive のジョブが控えている間は bulk のジョブを始めません")
+    
+    def _pending_limit(self, priority):
+        """優先度クラスごとの受け付け上限（interactive 以外は空けておく分を除く）"""
+        if priority == 'interactive':
+            return self.max_pending
+        return self.max_pending - self.interactive_reserved_pending
+    
+    def has_capacity(self, priority='normal'):
+        """
+        全体の受け付け上限に空きがあるか確認する（ユーザー・チャンネルごとの上限は確認しない）
+        
+        Args:
+            priority (str): 優先度クラス
+        
+        Returns:
+            bool: 空きがある場合はTrue
+        """
+        return len(self.jobs) < self._pending_limit(priority)
+    
+    def check_admission(self, user_id=None, channel_id=None, priority='normal'):
+        """
+        ジョブを受け付けられるか確認する
+        
+        Args:
+            user_id (str, optional): リクエストしたユーザーのID
+            channel_id (str, optional): リクエスト元のチャンネルID
+            priority (str): 優先度クラス（interactive 以外は空けておく分を除いた上限で確認する）
+        
+        Raises:
+            QueueFull: 全体・ユーザー・チャンネルのいずれかの上限に達している場合
+        """
+        pending = list(self.jobs.values())
+        if not self.has_capacity(priority):
+            reason = f"現在混み合っています（処理待ち{len(pending)}件）。しばらくしてからもう一度お試しください。"
+        elif user_id and sum(job.user_id == user_id for job in pending) >= self.max_per_user:
+            reason = f"同時にリクエストできるのは1人{self.max_per_user}件までです。完了までお待ちください。"
+        elif channel_id and sum(job.channel_id == channel_id for job in pending) >= self.max_per_channel:
+            reason = f"このチャンネルのリクエストが{self.max_per_channel}件処理中です。完了までお待ちください。"
+        else:
+            return
+        self.rejected += 1
+        REQUESTS_TOTAL.inc(result='rejected')
+        logger.warning(f"ジョブの受け付けを拒否しました: {reason}")
+        raise QueueFull(reason)
+    
+    def attach(self, theme, user_id=None, channel_id=None, key_options=None, priority='normal'):
+        """
+        同じ内容の実行中のジョブがあれば、リクエスト元を追加してそのジョブを返す
+        
+        合流したリクエストの優先度クラスの方が高い場合は、ジョブの優先度クラスを引き上げる。
+        
+        Args:
+            theme (str): 動画のテーマ
+            user_id (str, optional): リクエストしたユーザーのID
+            channel_id (str, optional): リクエスト元のチャンネルID
+            key_options (dict, optional): 結果に影響するオプション（coalesce_key を参照）
+            priority (str): 優先度クラス
+        
+        Returns:
+            PipelineJob: 合流したジョブ、該当するジョブがない場合はNone
+        """
+        job = self._inflight.get(coalesce_key(theme, **(key_options or {})))
+        if job is None or job.done:
+            return None
+        job.requesters.append({'user_id': user_id, 'channel_id': channel_id})
+        if PRIORITY_CLASSES.index(priority) < job.rank:
+            job.priority = priority
+            for stage in self.stages:
+                stage.promote(job)
+        job.position = self.position(job)
+        elapsed = (datetime.now() - job.created_at).total_seconds()
+        job.eta_seconds = max(0.0, self.estimate_seconds(job.position - 1) - elapsed)
+        self.coalesced += 1
+        REQUESTS_TOTAL.inc(result='coalesced')
+        logger.info(f"「{theme}」のリクエストを実行中のジョブ {job.id} にまとめました "
+                    f"(リクエスト元{len(job.requesters)}件)")
+        return job
+    
+    def submit(self, theme, user_id=None, channel_id=None, key_options=None, priority='normal', **options):
+        """
+        ジョブを投入する
+        
+        Args:
+            theme (str): 動画のテーマ
+            user_id (str, optional): リクエストしたユーザーのID
+            channel_id (str, optional): リクエスト元のチャンネルID
+            key_options (dict, optional): 結果に影響するオプション（同じ内容のリクエストの判定に使う）
+            priority (str): 優先度クラス（PRIORITY_CLASSES のいずれか）
+            **options: ジョブの付加情報
+        
+        Returns:
+            PipelineJob: 投入したジョブ（job.wait() で結果を待つ）
+        
+        Raises:
+            QueueFull: 受け付けの上限に達している場合
+        """
+        self.check_admission(user_id, channel_id, priority)
+        self.start()
+        job = PipelineJob(theme, user_id=user_id, channel_id=channel_id, priority=priority, **options)
+        self.jobs[job.id] = job
+        # 同じ内容のジョブが実行中の場合（別のバリエーションを作る場合）は、後から来たジョブを合流先にする
+        job.key = coalesce_key(theme, **(key_options or {}))
+        self._inflight[job.key] = job
+        job.position = self.position(job)
+        job.eta_seconds = self.estimate_seconds(job.position - 1)
+        self.record(job, 'submitted', theme=theme, user_id=user_id, channel_id=channel_id,
+                    key_options=key_options or {}, priority=priority)
+        REQUESTS_TOTAL.inc(result='new')
+        self._enqueue(0, job)
+        logger.info(f"ジョブ {job.id}「{theme}」を受け付けました "
+                    f"({priority}, 待ち{job.position}番目, 完了見込み{job.eta_seconds:.0f}秒)")
+        return job
+    
+    def restore(self, state, **options):
+        """
+        記録から未完了のジョブを復元し、最後に完了したステージの次から再開する（受け付けの上限は適用しない）
+        
+        Args:
+            state (dict): JobJournal.replay が返すジョブの状態
+            **options: ジョブの付加情報
+        
+        Returns:
+            PipelineJob: 復元したジョブ
+        """
+        self.start()
+        job = PipelineJob(state['theme'], user_id=state['user_id'], channel_id=state['channel_id'],
+                          job_id=state['id'], priority=state.get('priority') or 'normal', **options)
+        job.data.update(state['data'])
+        self.jobs[job.id] = job
+        job.key = coalesce_key(job.theme, **state['key_options'])
+        self._inflight[job.key] = job
+        names = [stage.name for stage in self.stages]
+        index = names.index(state['stage']) + 1 if state['stage'] in names else 0
+        if index >= len(self.stages):
+            # 最終ステージは結果を返して終了するため、ここに来るのは記録の途中で終了した場合のみ
+            index = len(self.stages) - 1
+        self._enqueue(index, job)
+        logger.info(f"ジョブ {job.id}「{job.theme}」をステージ {self.stages[index].name} から再開します")
+        return job
+    
+    def cancel(self, job_id, user_id=None):
+        """
+        ジョブを取り消す
+        
+        待機中のジョブは待ち行列から外し、処理中のジョブは job.cancel_event をセットして処理関数のタスクを止める。
+        どちらの場合もジョブはすぐに取り消し済みとして完了し、受け付けの枠を空ける。
+        同じ内容のリクエストが合流している場合、他のユーザーが待っている間はそのユーザーの分だけを取り消す。
+        
+        Args:
+            job_id (str): ジョブID
+            user_id (str, optional): 取り消すユーザーのID（指定した場合は自分がリクエストしたジョブのみ取り消せる）
+        
+        Returns:
+            str: 'cancelled'（ジョブを取り消した）、'detached'（そのユーザーの分だけ取り消した）、
+                 'not_found'（未完了のジョブがない）、'forbidden'（リクエスト元ではない）のいずれか
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return 'not_found'
+        if user_id is not None:
+            if not any(requester['user_id'] == user_id for requester in job.requesters):
+                return 'forbidden'
+            others = [requester for requester in job.requesters if requester['user_id'] != user_id]
+            if others:
+                job.requesters = others
+                logger.info(f"ジョブ {job.id} のリクエスト元からユーザー {user_id} を外しました "
+                            f"(残り{len(others)}件)")
+                return 'detached'
+        
+        job.cancel_event.set()
+        for stage in self.stages:
+            if stage.name == job.stage:
+                stage.remove(job)
+                stage.cancelled += 1
+        if job.handler_task is not None:
+            job.handler_task.cancel()
+        self.cancelled += 1
+        logger.info(f"ジョブ {job.id}「{job.theme}」をステージ {job.stage} で取り消しました")
+        self._complete(job, {'success': False, 'cancelled': True, 'error': 'リクエストは取り消されました'})
+        return 'cancelled'
+    
+    def record(self, job, event, **fields):
+        """
+        ジョブのイベントを記録する（記録先が設定されていない場合は何もしない）
+        
+        Args:
+            job (PipelineJob): 対象のジョブ
+            event (str): イベントの種類（JobJournal.append を参照）
+            **fields: イベントの内容
+        """
+        if self.journal is not None:
+            self.journal.append(job.id, event, **fields)
+    
+    async def run(self, theme, **options):
+        """
+        ジョブを投入して完了を待つ
+        
+        Returns:
+            dict: 処理結果
+        
+        Raises:
+            QueueFull: 受け付けの上限に達している場合
+        """
+        job = self.submit(theme, **options)
+        return await job.wait()
+    
+    def position(self, job):
+        """
+        ジョブの待ち順を返す（優先度クラスが高いジョブと、同じクラスで先に受け付けたジョブの未完了の数 + 1）
+        
+        Args:
+            job (PipelineJob): 対象のジョブ
+        
+        Returns:
+            int: 待ち順、完了済みのジョブの場合はNone
+        """
+        if job.id not in self.jobs:
+            return None
+        jobs = list(self.jobs.values())
+        index = jobs.index(job)
+        # 後から受け付けた優先度クラスの高いジョブも先に処理される
+        ahead = (sum(other.rank <= job.rank for other in jobs[:index]) +
+                 sum(other.rank < job.rank for other in jobs[index + 1:]))
+        return ahead + 1
+    
+    def estimate_seconds(self, jobs_ahead):
+        """
+        ジョブの完了までの見込み時間を計算する
+        
+        先行するジョブは最も遅いステージの処理速度で捌かれるものとして、1件分の所要時間に加える。
+        
+        Args:
+            jobs_ahead (int): 先に受け付けた未完了のジョブ数
+        
+        Returns:
+            float: 見込み時間（秒）
+        """
+        if not self.stages:
+            return 0.0
+        own = sum(stage.average_seconds for stage in self.stages)
+        throughput = min(stage.concurrency / max(stage.average_seconds, 0.1) for stage in self.stages)
+        return own + jobs_ahead / throughput
+    
+    def _enqueue(self, index, job):
+        """ジョブを指定したステージのキューに入れる"""
+        stage = self.stages[index]
+        job.stage = stage.name
+        stage.put(job)
+        self._wake_held(job)
+        self._notify(job)
+    
+    async def _worker(self, index, stage):
+        """ステージのキューからジョブを取り出して処理し、次のステージに渡す"""
+        orphan = None
+        while True:
+            if orphan is not None:
+                # 中止したジョブの処理関数がスレッドで動き続けている間は、次のジョブを取り出さない
+                orphan_future, orphan_shared = orphan
+                try:
+                    await asyncio.wrap_future(orphan_future)
+                except Exception:
+                    # ジョブはすでに中止として完了している
+                    pass
+                stage.busy -= 1
+                stage.release(orphan_shared)
+                orphan = None
+            
+            job, shared = await stage.get()
+            # このジョブの処理中に記録したログにジョブIDを付与する（処理関数のタスクにも引き継がれる）
+            logging_setup.job_id.set(job.id)
+            stage.busy += 1
+            start = time.monotonic()
+            started_at = time.time()
+            if job.queued_at is not None:
+                STAGE_WAIT_SECONDS.observe(start - job.queued_at, stage=stage.name)
+                tracing.add_span(f'{stage.name} (待機)', 'queue', started_at - (start - job.queued_at),
+                                 start - job.queued_at, stage=stage.name)
+            # 取り消し・期限切れのときに止められるよう、処理関数はタスクとして実行する
+            job.handler_task = asyncio.get_running_loop().create_task(stage.run_handler(job))
+            try:
+                done, _ = await asyncio.wait({job.handler_task}, timeout=stage.timeout)
+                if not done:
+                    # 処理関数に中止を知らせ（FFmpegの終了・通信の切断など）、ジョブは失敗にする
+                    job.cancel_event.set()
+                    job.handler_task.cancel()
+                    # 取り消しが処理関数のタスクに届くのを待つ（スレッドの終わりは待たない）
+                    await asyncio.wait({job.handler_task})
+                    stage.timeouts += 1
+                    logger.warning(f"ジョブ {job.id} のステージ {stage.name} が期限（{stage.timeout:g}秒）を超えたため中止しました")
+                    result = {'success': False, 'timeout': True,
+                              'error': f'{stage.name} が{stage.timeout:g}秒以内に完了しませんでした'}
+                    outcome = 'timeout'
+                elif job.handler_task.cancelled():
+                    # 取り消されたジョブ（取り消しの時点で完了している）
+                    result = None
+                    outcome = 'cancelled'
+                else:
+                    result = job.handler_task.result()
+                    outcome = 'failed' if result is not None and not result.get('success') else 'success'
+            except Exception as e:
+                logger.error(f"ジョブ {job.id} のステージ {stage.name} でエラーが発生: {str(e)}")
+                result = {'success': False, 'error': str(e)}
+                outcome = 'error'
+            finally:
+                job.handler_task = None
+                elapsed = time.monotonic() - start
+                stage.busy_seconds += elapsed
+                if stage.processed + stage.failed == 0:
+                    # 最初の実績で目安の値を置き換える
+                    stage.average_seconds = elapsed
+                else:
+                    stage.average_seconds += STAGE_SECONDS_SMOOTHING * (elapsed - stage.average_seconds)
+                job.stage_seconds[stage.name] = round(elapsed, 2)
+                if job.handler_future is not None and not job.handler_future.done():
+                    logger.warning(f"ジョブ {job.id} のステージ {stage.name} の処理がスレッドで続いているため、"
+                                   f"終わるまで枠を空けません")
+                    orphan = (job.handler_future, shared)
+                else:
+                    stage.busy -= 1
+                    stage.release(shared)
+                job.handler_future = None
+            
+            STAGE_SECONDS.observe(elapsed, stage=stage.name, outcome=outcome)
+            tracing.add_span(stage.name, 'stage', started_at, elapsed, stage=stage.name, outcome=outcome)
+            if outcome in ('failed', 'error', 'timeout'):
+                STAGE_FAILURES.inc(stage=stage.name, cause=outcome)
+            
+            if job.done:
+                continue
+            
+            if result is not None and not result.get('success'):
+                stage.failed += 1
+            else:
+                stage.processed += 1
+            
+            if result is None and index + 1 < len(self.stages):
+                self.record(job, 'stage', stage=stage.name, data=job.data)
+                self._enqueue(index + 1, job)
+                continue
+            
+            if result is None:
+                result = {'success': False, 'error': 'パイプラインの最終ステージが結果を返しませんでした'}
+            self._complete(job, result)
+    
+    def _complete(self, job, result):
+        """ジョブを完了させる"""
+        job.stage = 'done'
+        if result.get('cancelled'):
+            JOBS_TOTAL.inc(result='cancelled')
+        elif result.get('timeout'):
+            JOBS_TOTAL.inc(result='timeout')
+        elif result.get('queued'):
+            JOBS_TOTAL.inc(result='queued')
+        else:
+            JOBS_TOTAL.inc(result='success' if result.get('success') else 'failed')
+        self.record(job, 'finished', result=result)
+        job.finish(result)
+        self.jobs.pop(job.id, None)
+        self._wake_held(job)
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        self._notify(job)
+        total = (datetime.now() - job.created_at).total_seconds()
+        logger.info(f"ジョブ {job.id}「{job.theme}」完了 ({total:.1f}秒, ステージ別: {job.stage_seconds})")
+        # 取り消しは別のコンテキストから呼ばれるため、ジョブIDを指定して記録する
+        with logging_setup.job_context(job.id):
+            tracing.add_span('job', 'job', job.created_at.timestamp(), total, theme=job.theme,
+                             success=bool(result.get('success')), stage_seconds=dict(job.stage_seconds))
+        tracing.finish_job(job.id, f'{job.id} {job.theme}')
+    
+    def metrics(self):
+        """
+        ステージごとの状況を返す
+        
+        Returns:
+            dict: 'pending'（未完了のジョブ数）、'pending_by_priority'（優先度クラスごとの未完了のジョブ数）、
+                  'rejected'（拒否したジョブ数）、'coalesced'（実行中のジョブにまとめたリクエスト数）、
+                  'cancelled'（取り消したジョブ数）、'stages'（ステージ名と {'queued', 'busy', 'concurrency',
+                  'reserved', 'processed', 'failed', 'timeouts', 'cancelled', 'busy_seconds', 'average_seconds'} の辞書）
+        """
+        return {
+            'pending': len(self.jobs),
+            'pending_by_priority': {
+                priority: sum(job.priority == priority for job in self.jobs.values())
+                for priority in PRIORITY_CLASSES
+            },
+            'rejected': self.rejected,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'stages': {
+                stage.name: {
+                    'queued': stage.queued,
+                    'busy': stage.busy,
+                    'concurrency': stage.concurrency,
+                    'reserved': stage.reserved,
+                    'processed': stage.processed,
+                    'failed': stage.failed,
+                    'timeouts': stage.timeouts,
+                    'cancelled': stage.cancelled,
+                    'busy_seconds': round(stage.busy_seconds, 1),
+                    'average_seconds': round(stage.average_seconds, 1),
+                }
+                for stage in self.stages
+            },
+        }
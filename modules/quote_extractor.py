@@ -0,0 +1,274 @@
+"""
+LLMの応答から名言を抽出・検証するモジュール
+番号付きリスト（全角数字・丸数字を含む）、箇条書き、JSON形式の応答に対応する
+"""
+import os
+import sys
+import re
+import json
+import logging
+import unicodedata
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('youtube-shorts-bot.quote_extractor')
+
+# 行頭の番号・箇条書き記号
+# 「1.」「1)」「(1)」「１．」「①」「-」「・」など。数字の直後に区切りがない「1日1歩」は番号として扱わない
+_LIST_MARKER_RE = re.compile(
+    r'^(?:'
+    r'[\(（][0-9０-９]{1,2}[\)）]'
+    r'|[0-9０-９]{1,2}(?:[\.．](?![0-9０-９])|[\)）:：、])'
+    r'|[①-⑳]'
+    r'|[-*•・●■◆▶→]'
+    r')\s*'
+)
+
+# 「**覚醒名言**: 〜」「覚醒名言：〜」のようなラベル付きの行
+_BOLD_LABEL_RE = re.compile(r'^\*\*(?P<label>[^*]+)\*\*\s*(?:[:：]\s*(?P<body>.*))?$')
+_PLAIN_LABEL_RE = re.compile(r'^(?P<label>[^\s:：「」]{1,12}名言)\s*[:：]\s*(?P<body>.+)$')
+
+# 名言ではない行（見出し、チェックリスト、前置き・後書き）
+_SKIP_LINE_RE = re.compile(r'^(?:#|\[|- \[|```|>|\||---)')
+_META_RE = re.compile(
+    r'メインテーマ|生成します|作成します|作成しました|ここでは|以下(?:は|に|の)|テーマに関する'
+    r'|いかがでしょう|お役に立て|ご要望|承知しました|名言集|名言$|名言[（(]'
+)
+
+# JSON配列を整形出力した際の1要素の行（例: `  "名言",`）
+_JSON_ITEM_RE = re.compile(r'^"(?P<body>(?:[^"\\]|\\.)*)"\s*,?$')
+
+# 名言全体を囲む括弧・引用符
+_WRAPPERS = (('「', '」'), ('『', '』'), ('"', '"'), ('“', '”'), ('**', '**'))
+
+# プロンプトの反復を判定する際に無視する記号
+_ECHO_STRIP_RE = re.compile(r'[\s*#\-\[\]「」（）()：:、。]')
+
+# プロンプトの反復とみなす最小文字数（プロンプト内の短い例文と偶然一致した名言は残す）
+_ECHO_MIN_LENGTH = 8
+
+
+def display_width(text):
+    """
+    テキストの表示幅を計算する（全角文字を2、半角文字を1として数える）
+    
+    Args:
+        text (str): 対象のテキスト
+    
+    Returns:
+        int: 表示幅
+    """
+    width = 0
+    for char in text:
+        if unicodedata.combining(char) or unicodedata.category(char) == 'Cf':
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+    return width
+
+
+def _normalize_for_echo(text):
+    """プロンプト反復判定用にテキストを正規化する"""
+    return _ECHO_STRIP_RE.sub('', unicodedata.normalize('NFKC', text))
+
+
+class QuoteExtractor:
+    """名言抽出クラス"""
+    
+    def __init__(self, prompt_text='', min_width=None, max_width=None):
+        """
+        初期化
+        
+        Args:
+            prompt_text (str): 送信したプロンプト（応答に反復された行を除外するために使用）
+            min_width (int, optional): 名言の最小表示幅
+            max_width (int, optional): 名言の最大表示幅
+        """
+        self.min_width = min_width if min_width is not None else config.QUOTE_MIN_DISPLAY_WIDTH
+        self.max_width = max_width if max_width is not None else config.QUOTE_MAX_DISPLAY_WIDTH
+        self._prompt_text = _normalize_for_echo(prompt_text)
+    
+    def parse_line(self, line):
+        """
+        応答の1行から名言を取り出す
+        
+        Args:
+            line (str): 応答テキストの1行
+        
+        Returns:
+            str: 検証済みの名言、名言でない行の場合はNone
+        """
+        text = line.strip()
+        if not text or _SKIP_LINE_RE.match(text):
+            return None
+        
+        # 整形出力されたJSON配列の要素
+        match = _JSON_ITEM_RE.match(text)
+        if match:
+            try:
+                text = json.loads(f'"{match.group("body")}"').strip()
+            except json.JSONDecodeError:
+                return None
+        
+        text = _LIST_MARKER_RE.sub('', text, count=1)
+        
+        # ラベル付きの行は本文だけを使う
+        match = _BOLD_LABEL_RE.match(text) or _PLAIN_LABEL_RE.match(text)
+        if match:
+            text = (match.group('body') or match.group('label')).strip()
+        
+        text = self._strip_wrappers(text)
+        return text if self.is_valid(text) else None
+    
+    def is_valid(self, quote):
+        """
+        名言として妥当かどうかを検証する
+        
+        Args:
+            quote (str): 検証する名言
+        
+        Returns:
+            bool: 妥当な場合True
+        """
+        if not quote or _META_RE.search(quote):
+            return False
+        
+        width = display_width(quote)
+        if width < self.min_width or width > self.max_width:
+            return False
+        
+        # プロンプトの一部をそのまま返している行を除外
+        normalized = _normalize_for_echo(quote)
+        if len(normalized) >= _ECHO_MIN_LENGTH and normalized in self._prompt_text:
+            return False
+        
+        return True
+    
+    def extract(self, raw_text, limit=10):
+        """
+        応答テキスト全体から名言を抽出する
+        
+        Args:
+            raw_text (str): 応答テキスト
+            limit (int): 抽出する名言の最大数
+        
+        Returns:
+            list: 抽出された名言のリスト
+        """
+        data = _load_json(raw_text)
+        if isinstance(data, dict):
+            data = data.get('quotes')
+        if isinstance(data, list):
+            candidates = [self.parse_line(str(item)) for item in data if isinstance(item, str)]
+        else:
+            candidates = [self.parse_line(line) for line in raw_text.split('\n')]
+        return _unique(candidates)[:limit]
+    
+    def extract_sets(self, raw_text, limit=10):
+        """
+        一括生成の応答から名言のセットを抽出する
+        
+        Args:
+            raw_text (str): 応答テキスト（{"variations": [[...], ...]} 形式）
+            limit (int): 1セットあたりの名言の最大数
+        
+        Returns:
+            list: 名言リストのリスト（空のセットは含まない）
+        """
+        data = _load_json(raw_text)
+        if isinstance(data, dict):
+            data = data.get('variations')
+        if not isinstance(data, list):
+            return []
+        
+        quote_sets = []
+        for quote_set in data:
+            if not isinstance(quote_set, list):
+                continue
+            quotes = _unique([self.parse_line(str(item)) for item in quote_set])[:limit]
+            if quotes:
+                quote_sets.append(quotes)
+        return quote_sets
+    
+    @staticmethod
+    def _strip_wrappers(text):
+        """名言全体を囲む括弧・引用符を取り除く"""
+        for opening, closing in _WRAPPERS:
+            inner = text[len(opening):-len(closing)]
+            if len(text) > len(opening) + len(closing) and text.startswith(opening) \
+               and text.endswith(closing) and opening not in inner and closing not in inner:
+                return inner.strip()
+        return text
+
+
+def _unique(quotes):
+    """Noneを除き、重複を取り除いた名言リストを返す"""
+    seen = set()
+    result = []
+    for quote in quotes:
+        if quote and quote not in seen:
+            seen.add(quote)
+            result.append(quote)
+    return result
+
+
+def _load_json(raw_text):
+    """
+    応答テキストに含まれるJSONを読み込む（コードブロックや前後の説明文は無視する）
+    
+    Returns:
+        dict or list: 読み込んだJSON、含まれていない場合はNone
+    """
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'[\[{]', raw_text):
+        try:
+            data, _ = decoder.raw_decode(raw_text, match.start())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, (dict, list)):
+            return data
+    return None
+
+
+if __name__ == "__main__":
+    # 記録済み応答コーパスに対する抽出精度と速度の計測
+    import time
+    
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(config.ROOT_DIR, 'assets', 'quote_corpus', 'responses.jsonl')
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    
+    # 本番と同じプロンプトで反復判定を行う（APIは呼び出さない）
+    from modules.text_generator import TextGenerator
+    extractor = TextGenerator(api_key='benchmark').quote_extractor
+    
+    failures = 0
+    for record in records:
+        if record.get('mode') == 'batch':
+            actual = extractor.extract_sets(record['raw'])
+        else:
+            actual = extractor.extract(record['raw'])
+        if actual != record['expected']:
+            failures += 1
+            print(f"NG {record['id']}: {record.get('note', '')}")
+            print(f"   期待値: {record['expected']}")
+            print(f"   実際値: {actual}")
+    print(f"抽出精度: {len(records) - failures}/{len(records)} 件一致")
+    
+    start = time.perf_counter()
+    total_bytes = 0
+    for _ in range(iterations):
+        for record in records:
+            if record.get('mode') == 'batch':
+                extractor.extract_sets(record['raw'])
+            else:
+                extractor.extract(record['raw'])
+            total_bytes += len(record['raw'].encode('utf-8'))
+    elapsed = time.perf_counter() - start
+    parses = iterations * len(records)
+    print(f"速度: {elapsed / parses * 1e6:.1f} µs/応答, {total_bytes / elapsed / 1e6:.1f} MB/s ({parses} 回)")
+    
+    sys.exit(1 if failures else 0)
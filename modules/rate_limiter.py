@@ -0,0 +1,374 @@
+"""
+LLM API呼び出しのレート制限とリトライを行うモジュール
+リクエスト数・トークン数のトークンバケットをプロセス全体で共有する
+"""
+import os
+import sys
+import time
+import random
+import logging
+import threading
+import email.utils
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('youtube-shorts-bot.rate_limiter')
+
+# リトライ対象のHTTPステータス（429: レート制限, 529: 過負荷, 5xx: サーバーエラー）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
+# ステータスコードを持たない通信エラーの例外クラス名（anthropic / openai SDK共通）
+RETRYABLE_ERROR_NAMES = {'APIConnectionError', 'APITimeoutError'}
+
+# ストリーミング中にエラーイベントとして届くエラー種別と対応するステータス
+STREAM_ERROR_STATUS = {'rate_limit_error': 429, 'overloaded_error': 529, 'api_error': 500}
+
+# 枠の待機中に中止の確認をする間隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class RateLimitQueueFull(Exception):
+    """待機キューが上限に達した場合の例外"""
+
+
+class CallCancelled(Exception):
+    """呼び出しが中止された場合の例外"""
+
+
+class TokenBucket:
+    """トークンバケット（1分あたりの上限をバケット容量として扱う）"""
+    
+    def __init__(self, per_minute):
+        """初期化"""
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def refill(self, now):
+        """経過時間に応じてトークンを補充する"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def time_until(self, amount):
+        """
+        指定量のトークンが貯まるまでの秒数を返す
+        
+        Args:
+            amount (float): 必要なトークン量（容量を超える場合は容量に丸める）
+        
+        Returns:
+            float: 待機秒数（すぐに取得できる場合は0）
+        """
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """リクエスト数とトークン数のレート制限、およびリトライを行うクラス"""
+    
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_queue=None,
+                 max_retries=None, base_delay=None, max_delay=None, queue_timeout=None):
+        """初期化"""
+        self.request_bucket = TokenBucket(requests_per_minute or config.LLM_REQUESTS_PER_MINUTE)
+        self.token_bucket = TokenBucket(tokens_per_minute or config.LLM_TOKENS_PER_MINUTE)
+        self.max_queue = max_queue if max_queue is not None else config.LLM_MAX_QUEUE
+        self.max_retries = max_retries if max_retries is not None else config.LLM_MAX_RETRIES
+        self.base_delay = base_delay if base_delay is not None else config.LLM_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else config.LLM_RETRY_MAX_DELAY
+        self.queue_timeout = queue_timeout if queue_timeout is not None else config.LLM_QUEUE_TIMEOUT
+        
+        self._condition = threading.Condition()
+        self._waiters = 0
+        # retry-after によって全呼び出しを停止する期限
+        self._blocked_until = 0.0
+        
+        self._metrics = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'rate_limited': 0,
+            'overloaded': 0,
+            'queue_rejected': 0,
+            'wait_seconds_total': 0.0,
+            'max_waiters': 0,
+        }
+    
+    def acquire(self, tokens=1, timeout=None, cancel_event=None):
+        """
+        リクエスト1回分と指定トークン数の枠を確保する（確保できるまで待機する）
+        
+        Args:
+            tokens (int): 消費する見込みトークン数
+            timeout (float, optional): 最大待機秒数
+            cancel_event (threading.Event, optional): セットされたら枠を消費せずに待機をやめるイベント
+        
+        Returns:
+            float: 待機した秒数
+        
+        Raises:
+            RateLimitQueueFull: 待機中の呼び出しが上限に達している、または待機がタイムアウトした場合
+            CallCancelled: cancel_event がセットされた場合
+        """
+        timeout = timeout if timeout is not None else self.queue_timeout
+        start = time.monotonic()
+        
+        with self._condition:
+            if self._waiters >= self.max_queue:
+                self._metrics['queue_rejected'] += 1
+                raise RateLimitQueueFull(f"LLM呼び出しの待機数が上限({self.max_queue})に達しています")
+            
+            self._waiters += 1
+            self._metrics['max_waiters'] = max(self._metrics['max_waiters'], self._waiters)
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise CallCancelled("LLM呼び出しの枠の待機は中止されました")
+                    now = time.monotonic()
+                    self.request_bucket.refill(now)
+                    self.token_bucket.refill(now)
+                    wait = max(
+                        self._blocked_until - now,
+                        self.request_bucket.time_until(1),
+                        self.token_bucket.time_until(tokens),
+                    )
+                    if wait <= 0:
+                        self.request_bucket.tokens -= 1
+                        self.token_bucket.tokens -= min(tokens, self.token_bucket.capacity)
+                        break
+                    
+                    if now + wait - start > timeout:
+                        self._metrics['queue_rejected'] += 1
+                        raise RateLimitQueueFull(f"LLM呼び出しの待機が{timeout}秒を超えます")
+                    if cancel_event is not None:
+                        # イベントでは条件変数を起こせないため、短い間隔で中止を確認する
+                        wait = min(wait, CANCEL_POLL_INTERVAL)
+                    self._condition.wait(wait)
+            finally:
+                self._waiters -= 1
+            
+            waited = time.monotonic() - start
+            self._metrics['requests'] += 1
+            self._metrics['wait_seconds_total'] += waited
+        
+        if waited > 0.1:
+            logger.info(f"LLM呼び出しのレート制限により{waited:.1f}秒待機しました")
+        return waited
+    
+    def reconcile(self, estimated_tokens, actual_tokens):
+        """
+        見込みと実際のトークン使用量の差をバケットに反映する
+        
+        Args:
+            estimated_tokens (int): acquire で消費した見込みトークン数
+            actual_tokens (int): 実際に使用したトークン数
+        """
+        with self._condition:
+            self.token_bucket.tokens = min(
+                self.token_bucket.capacity,
+                self.token_bucket.tokens + estimated_tokens - actual_tokens
+            )
+            self._condition.notify_all()
+    
+    def pause(self, seconds):
+        """
+        全呼び出しを指定秒数停止する（429の retry-after を全体で守るため）
+        
+        Args:
+            seconds (float): 停止する秒数
+        """
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+    
+    def call(self, func, estimated_tokens=1, description="LLM呼び出し", cancel_event=None):
+        """
+        レート制限の枠を確保してから関数を実行し、一時的なエラーはリトライする
+        
+        Args:
+            func (callable): 実行する関数（引数なし）
+            estimated_tokens (int): 1回の呼び出しで消費する見込みトークン数
+            description (str): ログ用の説明
+            cancel_event (threading.Event, optional): セットされたら枠の待機と以降のリトライを中止するイベント
+        
+        Returns:
+            object: func の戻り値
+        
+        Raises:
+            RateLimitQueueFull: 待機キューが上限に達した場合
+            CallCancelled: cancel_event がセットされた場合
+            Exception: リトライ不可能なエラー、またはリトライ上限に達した場合の最後のエラー
+        """
+        for attempt in range(self.max_retries + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise CallCancelled(f"{description}は中止されました")
+            self.acquire(estimated_tokens, cancel_event=cancel_event)
+            try:
+                return func()
+            except Exception as e:
+                status = _error_status(e)
+                retryable = status in RETRYABLE_STATUS_CODES or type(e).__name__ in RETRYABLE_ERROR_NAMES
+                
+                with self._condition:
+                    if status == 429:
+                        self._metrics['rate_limited'] += 1
+                    elif status == 529:
+                        self._metrics['overloaded'] += 1
+                    if not retryable or attempt >= self.max_retries:
+                        self._metrics['failures'] += 1
+                    else:
+                        self._metrics['retries'] += 1
+                
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                
+                delay = self._retry_delay(e, attempt)
+                if status == 429:
+                    # 他の呼び出しも同じ制限に当たるため全体を停止する
+                    self.pause(delay)
+                logger.warning(f"{description}が失敗しました（{status or type(e).__name__}）。"
+                               f"{delay:.1f}秒後にリトライします ({attempt + 1}/{self.max_retries})")
+                if cancel_event is not None:
+                    cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+    
+    def _retry_delay(self, error, attempt):
+        """
+        リトライまでの待機秒数を計算する（指数バックオフ＋ジッター、retry-after を優先）
+        
+        Args:
+            error (Exception): 発生したエラー
+            attempt (int): 試行回数（0始まり）
+        
+        Returns:
+            float: 待機秒数
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _parse_retry_after(error)
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        # ジッターで0秒近くになりすぎないよう最低限の間隔を空ける
+        return max(backoff, self.base_delay / 2)
+    
+    def metrics(self):
+        """
+        メトリクスを取得する
+        
+        Returns:
+            dict: 呼び出し数、リトライ数、待機時間などの統計
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['waiters'] = self._waiters
+            metrics['request_tokens_available'] = round(self.request_bucket.tokens, 1)
+            metrics['llm_tokens_available'] = round(self.token_bucket.tokens, 1)
+        return metrics
+
+
+def _error_status(error):
+    """
+    エラーのHTTPステータスを取得する
+    
+    ストリーミング中のエラーイベントはHTTPステータスが200のままなので、本文のエラー種別から判定する
+    """
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        detail = body.get('error')
+        error_type = detail.get('type') if isinstance(detail, dict) else body.get('type')
+        if error_type in STREAM_ERROR_STATUS:
+            return STREAM_ERROR_STATUS[error_type]
+    return getattr(error, 'status_code', None)
+
+
+def _parse_retry_after(error):
+    """
+    エラーレスポンスの retry-after ヘッダーを秒数に変換する
+    
+    Returns:
+        float: 待機秒数、ヘッダーがない場合はNone
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    
+    # HTTP日付形式
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name='anthropic'):
+    """
+    プロセス全体で共有するレート制限インスタンスを取得する（APIプロバイダーごとに1つ）
+    
+    Args:
+        name (str): APIプロバイダー名
+    
+    Returns:
+        RateLimiter: 共有インスタンス
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = RateLimiter()
+        return _rate_limiters[name]
+
+
+def get_all_rate_limiters():
+    """
+    作成済みのレート制限インスタンスを取得する
+    
+    Returns:
+        dict: プロバイダー名とRateLimiterの辞書
+    """
+    with _rate_limiters_lock:
+        return dict(_rate_limiters)
+
+
+def collect_metrics():
+    """
+    このプロセスのレート制限の状況をメトリクスとして返す（metrics.register_collector に登録して使う）
+    
+    ワーカープロセスでも登録し、受け付けプロセスで全プロセスの値を合算する。
+    
+    Returns:
+        list: (メトリクス名, 種類, 説明, [(ラベルの辞書, 値), ...]) のリスト
+    """
+    limiters = {name: limiter.metrics() for name, limiter in get_all_rate_limiters().items()}
+    return [
+        ('shorts_llm_rate_limit_waiters', 'gauge', 'レート制限の枠を待っているLLM呼び出し数',
+         [({'provider': name}, values['waiters']) for name, values in limiters.items()]),
+        ('shorts_llm_rate_limit_wait_seconds_total', 'counter', 'レート制限の枠を待った時間の合計（秒）',
+         [({'provider': name}, values['wait_seconds_total']) for name, values in limiters.items()]),
+        ('shorts_llm_retries_total', 'counter', 'LLM呼び出しのリトライ数',
+         [({'provider': name}, values['retries']) for name, values in limiters.items()]),
+        ('shorts_llm_errors_total', 'counter', 'LLM呼び出しのエラー数（原因別）',
+         [({'provider': name, 'cause': cause}, values[cause]) for name, values in limiters.items()
+          for cause in ('rate_limited', 'overloaded', 'failures', 'queue_rejected')]),
+    ]
@@ -0,0 +1,185 @@
+"""
+ジョブの進捗をDiscordに表示するモジュール
+ジョブごとに1つのメッセージを投稿して進捗に合わせて編集し、編集はチャンネルごとにまとめて送信量の上限内で行う
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules.rate_limiter import TokenBucket
+
+logger = logging.getLogger('youtube-shorts-bot.status_reporter')
+
+
+class StatusReporter:
+    """ジョブの状況メッセージを、間隔と送信量の上限を守って編集するクラス"""
+    
+    def __init__(self, interval=None, sends_per_minute=None, edits_per_channel=None):
+        """
+        初期化
+        
+        Args:
+            interval (float, optional): 編集をまとめて送信する間隔（秒）
+            sends_per_minute (int, optional): 投稿・編集を合わせた1分あたりの送信数の上限
+            edits_per_channel (int, optional): 1回の間隔でチャンネルごとに送信する編集の上限
+        """
+        self.interval = interval or config.DISCORD_STATUS_INTERVAL
+        self.bucket = TokenBucket(sends_per_minute or config.DISCORD_SENDS_PER_MINUTE)
+        self.edits_per_channel = edits_per_channel or config.DISCORD_STATUS_EDITS_PER_CHANNEL
+        # ジョブIDと状況メッセージのリスト（同じジョブに合流したリクエストはそれぞれのメッセージを持つ）
+        self._entries = defaultdict(list)
+        self._flusher = None
+        self._metrics = {'sent': 0, 'edited': 0, 'coalesced': 0, 'deferred': 0, 'errors': 0}
+    
+    def start(self):
+        """編集をまとめて送信するバックグラウンドタスクを起動する（イベントループ内で呼び出す）"""
+        if self._flusher and not self._flusher.done():
+            return
+        self._flusher = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _acquire(self):
+        """送信枠を1つ確保する（空くまで待機する）"""
+        while True:
+            self.bucket.refill(time.monotonic())
+            wait = self.bucket.time_until(1)
+            if wait <= 0:
+                self.bucket.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+    
+    def _try_acquire(self):
+        """送信枠に空きがあれば1つ確保する"""
+        self.bucket.refill(time.monotonic())
+        if self.bucket.time_until(1) > 0:
+            return False
+        self.bucket.tokens -= 1
+        return True
+    
+    async def send(self, channel, text):
+        """
+        送信枠を確保してから新しいメッセージを送信する
+        
+        Args:
+            channel: 送信先（discord.abc.Messageable）
+            text (str): 送信するメッセージ
+        
+        Returns:
+            discord.Message: 送信したメッセージ、失敗した場合はNone
+        """
+        await self._acquire()
+        try:
+            message = await channel.send(text)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Discordへのメッセージ送信に失敗しました: {e}")
+            return None
+        self._metrics['sent'] += 1
+        return message
+    
+    async def post(self, job_id, channel, text, header=None):
+        """
+        ジョブの状況メッセージを投稿する（以降は update で編集する）
+        
+        Args:
+            job_id (str): ジョブID
+            channel: 送信先（discord.abc.Messageable）
+            text (str): 最初に表示する状況
+            header (str, optional): 状況の上に表示し続ける行（受け付け時の案内など）
+        """
+        header = f"{header}\n" if header else ""
+        text = header + text
+        message = await self.send(channel, text)
+        if message is None:
+            return
+        self._entries[job_id].append({
+            'channel_id': getattr(channel, 'id', None),
+            'message': message,
+            'header': header,
+            'text': text,
+            'shown': text,
+            'dirty_since': None,
+            'final': False,
+        })
+    
+    def update(self, job_id, text, final=False):
+        """
+        ジョブの状況を更新する（次の送信タイミングで最新の内容だけを編集に反映する）
+        
+        Args:
+            job_id (str): ジョブID
+            text (str): 表示する内容
+            final (bool): 最後の更新かどうか（反映後は追跡をやめる）
+        """
+        for entry in self._entries.get(job_id, []):
+            content = entry['header'] + text
+            if entry['dirty_since'] is not None and content != entry['text']:
+                # 前の更新がまだ反映されていないため、まとめて1回の編集にする
+                self._metrics['coalesced'] += 1
+            entry['text'] = content
+            entry['final'] = entry['final'] or final
+            if entry['dirty_since'] is None and (content != entry['shown'] or entry['final']):
+                entry['dirty_since'] = time.monotonic()
+    
+    async def _run(self):
+        """一定間隔で、変更のあった状況メッセージをチャンネルごとに上限までまとめて編集する"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"状況メッセージの更新中にエラーが発生: {str(e)}")
+    
+    async def flush(self):
+        """変更のあった状況メッセージを編集する（送信枠が足りない分は次の間隔に回す）"""
+        by_channel = defaultdict(list)
+        for job_id, entries in self._entries.items():
+            for entry in entries:
+                if entry['dirty_since'] is not None:
+                    by_channel[entry['channel_id']].append((entry['dirty_since'], job_id, entry))
+        
+        for pending in by_channel.values():
+            # 古い変更から順に、チャンネルごとの上限まで
+            pending.sort(key=lambda item: item[0])
+            for _, job_id, entry in pending[:self.edits_per_channel]:
+                text = entry['text']
+                if text != entry['shown']:
+                    if not self._try_acquire():
+                        self._metrics['deferred'] += 1
+                        continue
+                    try:
+                        await entry['message'].edit(content=text)
+                        self._metrics['edited'] += 1
+                    except Exception as e:
+                        self._metrics['errors'] += 1
+                        logger.warning(f"状況メッセージの編集に失敗しました: {e}")
+                    entry['shown'] = text
+                # 編集中に届いた更新は次の間隔で反映する
+                if entry['text'] == entry['shown']:
+                    entry['dirty_since'] = None
+            self._metrics['deferred'] += max(0, len(pending) - self.edits_per_channel)
+        
+        # 最後の更新を反映したジョブは追跡をやめる
+        for job_id in list(self._entries):
+            entries = [entry for entry in self._entries[job_id]
+                       if not (entry['final'] and entry['dirty_since'] is None)]
+            if entries:
+                self._entries[job_id] = entries
+            else:
+                del self._entries[job_id]
+    
+    def metrics(self):
+        """
+        メトリクスを取得する
+        
+        Returns:
+            dict: 送信数、編集数、まとめた更新数、次の間隔に回した編集数、追跡中のメッセージ数など
+        """
+        metrics = dict(self._metrics)
+        metrics['tracked'] = sum(len(entries) for entries in self._entries.values())
+        return metrics
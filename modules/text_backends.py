@@ -0,0 +1,301 @@
+"""
+テキスト生成バックエンドのモジュール
+Anthropic / OpenAI / ローカルテンプレートの各バックエンドを共通のインターフェースで扱う
+"""
+import os
+import sys
+import time
+import random
+import logging
+import threading
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules import metrics, tracing
+from modules.rate_limiter import get_rate_limiter
+
+logger = logging.getLogger('youtube-shorts-bot.text_backends')
+
+LLM_CALL_SECONDS = metrics.histogram('shorts_llm_call_seconds',
+                                     'LLM呼び出しの所要時間（レート制限の待ちとリトライを含む、秒）', ('backend', 'outcome'))
+
+# ローカル生成用の名言テンプレート（{theme}を含むもの）
+LOCAL_THEME_TEMPLATES = [
+    "{theme}から逃げるな",
+    "今日の{theme}が未来を作る",
+    "{theme}に本気になれ",
+    "{theme}は才能より習慣だ",
+    "迷うな、{theme}を選べ",
+    "{theme}の先に光がある",
+    "明日の{theme}より今日の一歩",
+    "{theme}で人生は変わる",
+    "{theme}を信じて進め",
+    "{theme}は君を裏切らない",
+]
+
+# テーマが長い場合にも使える汎用の名言
+LOCAL_GENERIC_TEMPLATES = [
+    "眠るな、目を覚ませ",
+    "今すぐ一歩を踏み出せ",
+    "勇気は行動の後に来る",
+    "明日では遅すぎる",
+    "小さな習慣が人生を創る",
+    "壁は越えるためにある",
+    "未来は今日の選択で決まる",
+    "昨日の自分を超えろ",
+    "失敗を恐れるな",
+    "君ならできる、進め",
+]
+
+
+class TextBackend:
+    """テキスト生成バックエンドの基底クラス"""
+    
+    name = 'base'
+    
+    def __init__(self, rate_limiter=None):
+        """初期化"""
+        self.rate_limiter = rate_limiter
+        # 応答で報告された使用トークン数（呼び出したスレッドごとに記録する）
+        self._usage = threading.local()
+    
+    def stream_lines(self, system_prompt, prompt, max_tokens, theme=None):
+        """
+        応答をストリーミングで受信し、完成した行から順に返す
+        
+        ジェネレータを途中で閉じるとストリームも閉じられ、残りの生成は打ち切られる。
+        
+        Args:
+            system_prompt (str): システムプロンプト
+            prompt (str): ユーザープロンプト
+            max_tokens (int): 最大出力トークン数
+            theme (str, optional): 動画のテーマ
+        
+        Yields:
+            str: 改行で区切られた応答の1行
+        """
+        raise NotImplementedError
+    
+    def complete(self, system_prompt, prompt, max_tokens, theme=None):
+        """
+        応答全体を取得する
+        
+        Args:
+            system_prompt (str): システムプロンプト
+            prompt (str): ユーザープロンプト
+            max_tokens (int): 最大出力トークン数
+            theme (str, optional): 動画のテーマ
+        
+        Returns:
+            str: 応答テキスト
+        """
+        raise NotImplementedError
+    
+    def call(self, func, estimated_tokens=1, description="LLM呼び出し", cancel_event=None):
+        """
+        レート制限とリトライを適用して関数を実行する（レート制限がない場合はそのまま実行）
+        
+        Args:
+            func (callable): 実行する関数（引数なし）
+            estimated_tokens (int): 見込みトークン数
+            description (str): ログ用の説明
+            cancel_event (threading.Event, optional): セットされたらリトライを中止するイベント
+        
+        Returns:
+            object: func の戻り値
+        """
+        start = time.monotonic()
+        started_at = time.time()
+        outcome = 'error'
+        try:
+            if self.rate_limiter is None:
+                result = func()
+            else:
+                self._usage.tokens = None
+                result = self.rate_limiter.call(
+                    func, estimated_tokens=estimated_tokens, description=description, cancel_event=cancel_event
+                )
+                # 見込みで確保したトークン数を実際の使用量で補正する
+                if self._usage.tokens is not None:
+                    self.rate_limiter.reconcile(estimated_tokens, self._usage.tokens)
+            outcome = 'success'
+            return result
+        finally:
+            # ヘッジで他のバックエンドが先に応答した場合も中止として数える
+            if cancel_event is not None and cancel_event.is_set():
+                outcome = 'cancelled'
+            elapsed = time.monotonic() - start
+            LLM_CALL_SECONDS.observe(elapsed, backend=self.name, outcome=outcome)
+            tracing.add_span(description, 'llm', started_at, elapsed, backend=self.name, outcome=outcome)
+    
+    def _record_usage(self, tokens):
+        """
+        応答で報告された使用トークン数を記録する（call が呼び出し後に補正に使う）
+        
+        ストリームを途中で閉じた場合は使用量が報告されないため、記録せず見込みのままにする。
+        
+        Args:
+            tokens (int): 入力と出力の合計トークン数
+        """
+        self._usage.tokens = tokens
+    
+    @staticmethod
+    def _split_lines(chunks):
+        """テキストの断片を受け取り、改行ごとに行を返す"""
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            while '\n' in buffer:
+                line, buffer = buffer.split('\n', 1)
+                yield line
+        if buffer:
+            yield buffer
+
+
+class AnthropicBackend(TextBackend):
+    """Anthropic Claude バックエンド"""
+    
+    name = 'anthropic'
+    
+    def __init__(self, api_key, model=None):
+        """初期化"""
+        super().__init__(rate_limiter=get_rate_limiter(self.name))
+        import anthropic
+        # リトライはレート制限モジュールで行うため、SDK側のリトライは無効にする
+        # 応答が止まったリクエストがスレッドを占有し続けないよう、タイムアウトを設定する
+        self.client = anthropic.Anthropic(api_key=api_key, max_retries=0, timeout=config.LLM_REQUEST_TIMEOUT)
+        self.model = model or config.ANTHROPIC_MODEL
+    
+    def stream_lines(self, system_prompt, prompt, max_tokens, theme=None):
+        with self.client.messages.stream(
+            model=self.model,
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens
+        ) as stream:
+            yield from self._split_lines(stream.text_stream)
+            usage = stream.get_final_message().usage
+            self._record_usage(usage.input_tokens + usage.output_tokens)
+    
+    def complete(self, system_prompt, prompt, max_tokens, theme=None):
+        response = self.client.messages.create(
+            model=self.model,
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens
+        )
+        self._record_usage(response.usage.input_tokens + response.usage.output_tokens)
+        return response.content[0].text.strip()
+
+
+class OpenAIBackend(TextBackend):
+    """OpenAI バックエンド"""
+    
+    name = 'openai'
+    
+    def __init__(self, api_key, model=None):
+        """初期化"""
+        super().__init__(rate_limiter=get_rate_limiter(self.name))
+        import openai
+        self.client = openai.OpenAI(api_key=api_key, max_retries=0, timeout=config.LLM_REQUEST_TIMEOUT)
+        self.model = model or config.OPENAI_MODEL
+    
+    def _messages(self, system_prompt, prompt):
+        """チャット形式のメッセージを作成する"""
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def stream_lines(self, system_prompt, prompt, max_tokens, theme=None):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, prompt),
+            max_tokens=max_tokens,
+            stream=True,
+            # 最後のチャンクで使用量を受け取る
+            stream_options={"include_usage": True}
+        )
+        try:
+            yield from self._split_lines(self._stream_text(stream))
+        finally:
+            stream.close()
+    
+    def _stream_text(self, stream):
+        """ストリームのチャンクから本文の断片を返し、最後に報告された使用量を記録する"""
+        for chunk in stream:
+            if chunk.usage is not None:
+                self._record_usage(chunk.usage.total_tokens)
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+    
+    def complete(self, system_prompt, prompt, max_tokens, theme=None):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, prompt),
+            max_tokens=max_tokens
+        )
+        if response.usage is not None:
+            self._record_usage(response.usage.total_tokens)
+        return (response.choices[0].message.content or "").strip()
+
+
+class LocalTemplateBackend(TextBackend):
+    """APIを使わずにテンプレートから名言を作るオフラインのバックエンド"""
+    
+    name = 'local'
+    
+    def _lines(self, theme):
+        """テーマを埋め込んだ名言を番号付きリストの行として作成する"""
+        quotes = [template.format(theme=theme) for template in LOCAL_THEME_TEMPLATES] if theme else []
+        random.shuffle(quotes)
+        generic = list(LOCAL_GENERIC_TEMPLATES)
+        random.shuffle(generic)
+        # テーマが長く文字数制限を超える名言は抽出時に除外されるため、汎用の名言で補う
+        return [f"{i + 1}. {quote}" for i, quote in enumerate(quotes + generic)]
+    
+    def stream_lines(self, system_prompt, prompt, max_tokens, theme=None):
+        yield from self._lines(theme)
+    
+    def complete(self, system_prompt, prompt, max_tokens, theme=None):
+        return "\n".join(self._lines(theme))
+
+
+def create_backends(anthropic_api_key=None, openai_api_key=None):
+    """
+    設定に従ってリモートバックエンドを優先順に作成する
+    
+    Args:
+        anthropic_api_key (str, optional): Anthropic APIキー
+        openai_api_key (str, optional): OpenAI APIキー
+    
+    Returns:
+        list: TextBackendのリスト（APIキーが設定されていないバックエンドは含まない）
+    """
+    api_keys = {
+        'anthropic': anthropic_api_key or config.ANTHROPIC_API_KEY,
+        'openai': openai_api_key or config.OPENAI_API_KEY,
+    }
+    backend_classes = {
+        'anthropic': AnthropicBackend,
+        'openai': OpenAIBackend,
+    }
+    
+    backends = []
+    for name in config.TEXT_BACKENDS:
+        if name not in backend_classes:
+            logger.warning(f"不明なテキスト生成バックエンドです: {name}")
+            continue
+        if not api_keys[name]:
+            logger.warning(f"APIキーが設定されていないためバックエンドを無効にします: {name}")
+            continue
+        try:
+            backends.append(backend_classes[name](api_keys[name]))
+        except ImportError as e:
+            logger.warning(f"バックエンド {name} のライブラリを読み込めません: {e}")
+    return backends
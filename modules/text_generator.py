@@ -2,30 +2,57 @@
 AIを使用してテーマに基づいたテキストを生成するモジュール
 """
 import logging
-import anthropic
 from slugify import slugify
 import random
 import os
 import sys
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # 親ディレクトリをインポートパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from modules.quote_extractor import QuoteExtractor
+from modules.text_backends import create_backends, LocalTemplateBackend
 
 logger = logging.getLogger('youtube-shorts-bot.text_generator')
 
+# 中止されたかどうかを確認する間隔（秒）
+ABORT_POLL_INTERVAL = 0.5
+
+# 一括生成時にプロンプト末尾へ追加する出力形式の指示
+BATCH_PROMPT_SUFFIX = """
+
+## 一括生成の指示
+上記の条件で、互いに内容が重複しない名言のセットを{count}セット作成してください。
+各セットは10個の名言で構成してください。
+出力は次のJSON形式のみとし、説明文や番号は含めないでください。
+{{"variations": [["名言1", "名言2", ...], ["名言1", "名言2", ...]]}}"""
+
 class TextGenerator:
     """AIテキスト生成クラス"""
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, openai_api_key=None):
         """初期化"""
-        # APIキーの設定
-        self.api_key = api_key or config.ANTHROPIC_API_KEY
-        if not self.api_key:
-            raise ValueError("Anthropic APIキーが設定されていません")
+        # 優先順に並べたリモートバックエンド（先頭がプライマリ、以降がヘッジ先）
+        self.backends = create_backends(anthropic_api_key=api_key, openai_api_key=openai_api_key)
+        
+        # 期限内に応答が得られなかった場合のオフライン生成
+        self.local_backend = LocalTemplateBackend() if config.TEXT_LOCAL_FALLBACK else None
+        
+        if not self.backends and not self.local_backend:
+            raise ValueError("利用可能なテキスト生成バックエンドがありません")
+        
+        # バックエンドごとの直近の応答時間（ヘッジ開始の判定に使用）
+        self._latencies = {backend.name: deque(maxlen=config.TEXT_HEDGE_WINDOW) for backend in self.backends}
         
-        # Anthropic APIクライアントの初期化
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # ヘッジ要求を並列に実行するスレッドプール
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.TEXT_HEDGE_MAX_WORKERS, thread_name_prefix='text-hedge'
+        )
         
         # テキスト生成のプロンプトテンプレート
         self.prompt_templates = [
@@ -137,28 +164,9 @@ class TextGenerator:
 
 このプロンプトに従って、指定されたテーマに関する10個の力強い自己啓発名言（各20文字以内）を作成してください。"""
         ]
-    
-    def generate_text(self, theme, max_length=100):
-        """
-        テーマに基づいてテキストを生成する
-        
-        Args:
-            theme (str): テキスト生成のテーマ
-            max_length (int): 生成するテキストの最大文字数
         
-        Returns:
-            str: 生成されたテキスト
-            str: 生成されたテキストのslug形式（ファイル名用）
-        """
-        try:
-            # プロンプトテンプレートからランダムに選択
-            prompt_template = random.choice(self.prompt_templates)
-            prompt = prompt_template.format(theme=theme)
-            
-            logger.info(f"「{theme}」のテキスト生成を開始")
-            
-            # Anthropic Claude APIを使用してテキスト生成
-            system_prompt = """# 自己啓発ショート動画用インパクト名言生成システム
+        # テキスト生成のシステムプロンプト
+        self.system_prompt = """# 自己啓発ショート動画用インパクト名言生成システム
 
 あなたは視聴者の心を揺さぶる強力な自己啓発名言を生み出すエキスパートです。与えられたテーマとペルソナに基づき、ショート動画（15-60秒）で使用する10個の心を突き動かす名言を作成してください。
 
@@ -269,88 +277,309 @@ class TextGenerator:
 
 このプロンプトに従って、指定されたテーマに関する10個の力強い自己啓発名言（各20文字以内）を作成してください。
 必ず日本語で応答してください。"""
+        
+        # 応答から名言を抽出するパーサー（プロンプトの反復を除外するためにプロンプトを渡す）
+        self.quote_extractor = QuoteExtractor(
+            prompt_text='\n'.join([self.system_prompt] + self.prompt_templates)
+        )
+    
+    def _estimate_tokens(self, prompt, max_tokens):
+        """
+        1回の呼び出しで消費するトークン数を見積もる（日本語は概ね1文字1トークン）
+        
+        Args:
+            prompt (str): ユーザープロンプト
+            max_tokens (int): 最大出力トークン数
             
-            # Anthropicの正しいAPI呼び出し方法に修正
-            response = self.client.messages.create(
-                model="claude-3-sonnet-20240229",  # 正しいモデル名を使用
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=4000
-            )
-            # 生成されたテキストを取得
-            raw_text = response.content[0].text.strip()
+        Returns:
+            int: 見込みトークン数
+        """
+        return len(self.system_prompt) + len(prompt) + min(max_tokens, config.LLM_EXPECTED_OUTPUT_TOKENS)
+    
+    def _hedge_delay(self, backend):
+        """
+        ヘッジ要求を送るまでの待機秒数（直近の応答時間のp95）を返す
+        
+        Args:
+            backend (TextBackend): 待機中のバックエンド
+            
+        Returns:
+            float: 待機秒数（計測数が少ない間は設定値）
+        """
+        samples = sorted(self._latencies.get(backend.name, ()))
+        if len(samples) < config.TEXT_HEDGE_MIN_SAMPLES:
+            return config.TEXT_HEDGE_DEFAULT_DELAY
+        return samples[int(0.95 * (len(samples) - 1))]
+    
+    def _timed_attempt(self, backend, attempt, cancel_event):
+        """バックエンドで1回試行し、成功した場合は応答時間を記録する"""
+        start = time.monotonic()
+        result = attempt(backend, cancel_event)
+        if result and not cancel_event.is_set():
+            self._latencies[backend.name].append(time.monotonic() - start)
+        return result
+    
+    def _run_hedged(self, attempt, description, abort_event=None):
+        """
+        プライマリのバックエンドで試行し、p95を超えたら次のバックエンドにも並列に要求する
+        
+        最初に成功した結果を採用し、残りの試行は中止する。
+        ハードデッドラインまでに結果が得られない場合はローカル生成にフォールバックする。
+        ヘッジ先は次のバックエンドのみで、同じバックエンドには重ねて要求しない
+        （同じレート制限を二重に消費するため）。バックエンドが1つの場合はヘッジせず、
+        TEXT_HARD_DEADLINE まで応答を待つ。
+        
+        Args:
+            attempt (callable): attempt(backend, cancel_event) -> 結果（失敗時は偽値または例外）
+            description (str): ログ用の説明
+            abort_event (threading.Event, optional): セットされたらすべての試行を中止するイベント
+                                                     （ローカル生成にもフォールバックしない）
+            
+        Returns:
+            object: 最初に成功した試行の結果、全て失敗した場合・中止された場合はNone
+        """
+        start = time.monotonic()
+        deadline = start + config.TEXT_HARD_DEADLINE
+        cancel_event = threading.Event()
+        pending = {}
+        next_index = 0
+        hedge_at = start
+        
+        try:
+            while pending or next_index < len(self.backends):
+                now = time.monotonic()
+                if abort_event is not None and abort_event.is_set():
+                    logger.info(f"{description}は中止されました")
+                    return None
+                if now >= deadline:
+                    logger.warning(f"{description}が{config.TEXT_HARD_DEADLINE}秒以内に完了しませんでした")
+                    break
+                
+                # 実行中の試行がp95を超えた、または全て失敗した場合は次のバックエンドに要求する
+                if next_index < len(self.backends) and (now >= hedge_at or not pending):
+                    backend = self.backends[next_index]
+                    if pending:
+                        logger.info(f"{description}の応答が遅いため {backend.name} にヘッジ要求を送ります")
+                    # ログにジョブIDが付くよう、呼び出し元のコンテキストで実行する
+                    future = self._executor.submit(contextvars.copy_context().run, self._timed_attempt,
+                                                   backend, attempt, cancel_event)
+                    pending[future] = backend
+                    next_index += 1
+                    hedge_at = now + self._hedge_delay(backend)
+                    continue
+                
+                timeout = deadline - now
+                if next_index < len(self.backends):
+                    timeout = min(timeout, hedge_at - now)
+                if abort_event is not None:
+                    timeout = min(timeout, ABORT_POLL_INTERVAL)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    backend = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.warning(f"{description}が {backend.name} で失敗しました: {str(e)}")
+                        continue
+                    if result:
+                        logger.info(f"{description}に {backend.name} の結果を使用します "
+                                    f"({time.monotonic() - start:.1f}秒)")
+                        return result
+        finally:
+            # 残りの試行を中止する
+            cancel_event.set()
+        
+        if self.local_backend:
+            logger.warning(f"{description}をローカル生成にフォールバックします")
+            return attempt(self.local_backend, threading.Event())
+        return None
+    
+    def generate_text(self, theme, max_length=100, quote_count=10, on_quote=None, cancel_event=None):
+        """
+        テーマに基づいてテキストを生成する
+        
+        応答はストリーミングで受信し、行が完成するたびに名言を解析する。
+        quote_count 個の名言が揃った時点でストリームを閉じて結果を返す。
+        プライマリのバックエンドが遅い場合は別のバックエンドにもヘッジ要求を送り、先に完了した結果を使う。
+        
+        Args:
+            theme (str): テキスト生成のテーマ
+            max_length (int): 生成するテキストの最大文字数（後方互換性のために残す）
+            quote_count (int): 取得する名言の数
+            on_quote (callable, optional): 名言が1つ確定するたびに呼ばれる関数 on_quote(index, quote)。
+                ヘッジ時は最初に名言を返したバックエンドの名言のみ通知される（確定結果は戻り値を使うこと）
+            cancel_event (threading.Event, optional): セットされたら生成を中止するイベント
+        
+        Returns:
+            str: 生成されたテキスト、生成または名言の抽出に失敗した場合はNone
+            str: 生成されたテキストのslug形式（ファイル名用）
+        """
+        # slugを生成（ファイル名用）
+        text_slug = slugify(theme)
+        
+        try:
+            # プロンプトテンプレートからランダムに選択
+            prompt_template = random.choice(self.prompt_templates)
+            prompt = prompt_template.format(theme=theme)
             
-            # 生成されたテキストを行ごとに分割してから処理
-            lines = raw_text.split('\n')
+            logger.info(f"「{theme}」のテキスト生成を開始")
             
-            # 最初の行がメインテーマや説明文なら除外
-            if lines and ('メインテーマ' in lines[0] or '生成します' in lines[0] or 'テーマに関する' in lines[0]):
-                lines = lines[1:]
+            # 最初に名言を返したバックエンドだけが on_quote に通知する
+            leader = []
+            leader_lock = threading.Lock()
             
-            # 箇条書きの行を抽出する
-            formatted_lines = []
-            for line in lines:
-                # 数字や箇条書き記号を取り除く
-                clean_line = line.strip()
-                # 説明文や見出し、プロンプトが含まれている行をスキップ
-                if clean_line and not clean_line.startswith('#') and not clean_line.startswith('[') \
-                   and not 'メインテーマ' in clean_line \
-                   and not '生成します' in clean_line \
-                   and not 'ここでは' in clean_line:
-                    # 先頭の番号や記号を削除
-                    clean_line = clean_line.lstrip('0123456789.-*• \t')
-                    clean_line = clean_line.strip()
-                    if clean_line and len(clean_line) <= 30:  # 短い名言のみを抽出
-                        formatted_lines.append(clean_line)
+            def attempt(backend, cancel_event):
+                # 受信した行を逐次解析し、必要数が揃ったら打ち切る
+                # リトライ時もそれまでに確定した名言は保持し、不足分だけを補う
+                formatted_lines = []
+                
+                def collect_quotes():
+                    lines = backend.stream_lines(self.system_prompt, prompt, 4000, theme=theme)
+                    try:
+                        for line in lines:
+                            if cancel_event.is_set():
+                                break
+                            quote = self.quote_extractor.parse_line(line)
+                            if not quote or quote in formatted_lines:
+                                continue
+                            formatted_lines.append(quote)
+                            with leader_lock:
+                                if not leader:
+                                    leader.append(backend.name)
+                                is_leader = leader[0] == backend.name
+                            if on_quote and is_leader:
+                                on_quote(len(formatted_lines) - 1, quote)
+                            if len(formatted_lines) >= quote_count:
+                                logger.info(f"名言が{quote_count}個揃ったため生成を打ち切ります ({backend.name})")
+                                break
+                    finally:
+                        lines.close()
+                
+                backend.call(
+                    collect_quotes,
+                    estimated_tokens=self._estimate_tokens(prompt, 4000),
+                    description=f"テキスト生成({backend.name})",
+                    cancel_event=cancel_event
+                )
+                
+                if not formatted_lines:
+                    logger.warning(f"{backend.name} の応答から名言を抽出できませんでした: {theme}")
+                return formatted_lines
             
-            # 最大　10個の名言を取得
-            formatted_lines = formatted_lines[:10]
+            formatted_lines = self._run_hedged(attempt, f"「{theme}」のテキスト生成", abort_event=cancel_event)
             
-            # 名言が一つも取得できなかった場合は一行のテキストを使用
+            # 名言が一つも取得できなかった場合は失敗とする
             if not formatted_lines:
-                if len(raw_text) > max_length:
-                    generated_text = raw_text[:max_length] + "..."
-                else:
-                    generated_text = raw_text
-            else:
-                # 箇条書きで結合
-                generated_text = "\n".join(formatted_lines)
+                logger.error(f"テキストを生成できませんでした: {theme}")
+                return None, text_slug
             
-            logger.info(f"テキスト生成完了: {generated_text}")
+            # 箇条書きで結合
+            generated_text = "\n".join(formatted_lines)
             
-            # slugを生成（ファイル名用）
-            text_slug = slugify(theme)
+            logger.info(f"テキスト生成完了: {generated_text}")
             
             return generated_text, text_slug
             
         except Exception as e:
             logger.error(f"テキスト生成中にエラーが発生: {str(e)}")
-            # エラーの場合はデフォルトテキストとslugを返す
-            return f"{theme}についての動画です", slugify(theme)
+            return None, text_slug
     
-    def generate_multiple_variations(self, theme, count=3, max_length=100):
+    def _generate_batch(self, theme, count):
+        """
+        1回のAPI呼び出しで複数セットの名言を生成する
+        
+        Args:
+            theme (str): テーマ
+            count (int): 生成するセット数
+            
+        Returns:
+            list: 生成されたテキストのリスト（解析できたセットのみ）
+        """
+        prompt_template = random.choice(self.prompt_templates)
+        prompt = prompt_template.format(theme=theme) + BATCH_PROMPT_SUFFIX.format(count=count)
+        # セット数に応じて出力トークン数を確保
+        max_tokens = min(1000 * count, 8000)
+        
+        logger.info(f"「{theme}」のテキストを{count}セット一括生成します")
+        
+        def attempt(backend, cancel_event):
+            raw_text = backend.call(
+                lambda: backend.complete(self.system_prompt, prompt, max_tokens, theme=theme),
+                estimated_tokens=self._estimate_tokens(prompt, max_tokens),
+                description=f"テキスト一括生成({backend.name})",
+                cancel_event=cancel_event
+            )
+            return ["\n".join(quotes) for quotes in self.quote_extractor.extract_sets(raw_text)]
+        
+        try:
+            variations = self._run_hedged(attempt, f"「{theme}」のテキスト一括生成") or []
+        except Exception as e:
+            logger.error(f"一括テキスト生成中にエラーが発生: {str(e)}")
+            return []
+        
+        if len(variations) < count:
+            logger.warning(f"一括生成で取得できたセット数が不足: {len(variations)}/{count}")
+        return variations[:count]
+    
+    def generate_multiple_variations(self, theme, count=3, max_length=100, batched=True):
         """
         複数のバリエーションを生成する
         
+        一括モードでは1回のAPI呼び出しで最大 config.TEXT_BATCH_MAX_VARIATIONS セットを生成し、
+        それを超える分は複数の一括呼び出しに分割して並列に実行する。
+        
         Args:
             theme (str): テーマ
             count (int): 生成するバリエーション数
             max_length (int): 各テキストの最大長
+            batched (bool): 一括モードを使用するか（Falseの場合は個別に生成）
             
         Returns:
-            list: 生成されたテキストのリスト
+            list: 生成されたテキストのリスト（名言を抽出できなかった分は含まない）
         """
+        if count <= 0:
+            return []
+        
+        if not batched:
+            variations = []
+            for _ in range(count):
+                text, _ = self.generate_text(theme, max_length)
+                if text:
+                    variations.append(text)
+            return variations
+        
+        # 1回の呼び出しあたりのセット数で分割
+        batch_size = max(1, config.TEXT_BATCH_MAX_VARIATIONS)
+        batch_counts = [min(batch_size, count - i) for i in range(0, count, batch_size)]
+        
         variations = []
-        for _ in range(count):
-            text, _ = self.generate_text(theme, max_length)
-            variations.append(text)
-        return variations
+        if len(batch_counts) == 1:
+            variations.extend(self._generate_batch(theme, count))
+        else:
+            # 同時実行数を制限して並列に一括生成
+            max_workers = min(len(batch_counts), config.TEXT_GENERATION_MAX_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for batch in executor.map(lambda n: self._generate_batch(theme, n), batch_counts):
+                    variations.extend(batch)
+        
+        # 不足分は個別の呼び出しを並列に実行して補う
+        missing = count - len(variations)
+        if missing > 0:
+            max_workers = min(missing, config.TEXT_GENERATION_MAX_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for text, _ in executor.map(lambda _: self.generate_text(theme, max_length), range(missing)):
+                    if text:
+                        variations.append(text)
+        
+        return variations[:count]
 
 
 if __name__ == "__main__":
     # テスト用コード
+    from modules.logging_setup import setup_logging
+    setup_logging()
+    
     import sys
     if len(sys.argv) > 1:
         theme = sys.argv[1]
@@ -0,0 +1,242 @@
+"""
+ジョブごとの処理の内訳を記録するモジュール
+ステージ・FFmpegの実行などの区間を記録し、Chromeのトレースイベント形式（chrome://tracing、Perfetto で表示できるJSON）で書き出す
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules import logging_setup
+
+logger = logging.getLogger('youtube-shorts-bot.tracing')
+
+_lock = threading.Lock()
+# ジョブIDごとの記録済みの区間
+_events = defaultdict(list)
+# 書き出し済みのジョブID（取り消し後に終わった処理の区間を貯め続けないよう、新しいものから一定数を覚えておく）
+_finished = set()
+_finished_order = deque()
+FINISHED_HISTORY = 1000
+_enabled = bool(config.TRACE_DIR)
+# ワーカープロセスでは区間を記録し、タスクの結果と一緒に受け付けプロセスへ送る
+_forwarding = False
+# バッチ全体を1つのファイルに書き出す場合に、完了したジョブの区間を貯めておく
+_batch = None
+
+
+def enable():
+    """記録を有効にする（TRACE_DIR を設定した場合は最初から有効）"""
+    global _enabled
+    _enabled = True
+
+
+def enable_forwarding():
+    """ワーカープロセスで、ジョブの処理中の区間を記録するようにする"""
+    global _forwarding
+    _forwarding = True
+
+
+def _recording():
+    """現在のコンテキストで区間を記録する場合はジョブIDを返す"""
+    if not (_enabled or _forwarding):
+        return None
+    return logging_setup.job_id.get()
+
+
+def add_span(name, category, start, seconds, **args):
+    """
+    開始時刻と所要時間がわかっている区間を記録する（処理中のジョブがない場合は何もしない）
+    
+    Args:
+        name (str): 区間の名前
+        category (str): 分類（'stage'、'ffmpeg' など）
+        start (float): 開始時刻（time.time() の値）
+        seconds (float): 所要時間（秒）
+        **args: 区間に付ける情報（トレースビューアーの詳細に表示される）
+    """
+    job_id = _recording()
+    if job_id is None:
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int(start * 1e6),
+        'dur': max(1, int(seconds * 1e6)),
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'thread': threading.current_thread().name,
+        'args': args,
+    }
+    with _lock:
+        if job_id not in _finished:
+            _events[job_id].append(event)
+
+
+@contextmanager
+def span(name, category='job', **args):
+    """
+    ブロックの実行を1つの区間として記録する
+    
+    Args:
+        name (str): 区間の名前
+        category (str): 分類
+        **args: 区間に付ける情報
+    
+    Yields:
+        dict: 区間に付ける情報（ブロックの中で結果などを追加できる）
+    """
+    if _recording() is None:
+        yield args
+        return
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield args
+    finally:
+        add_span(name, category, start, time.perf_counter() - started, **args)
+
+
+def child_usage(rusage):
+    """
+    子プロセスのリソース使用量を区間に付ける情報にする
+    
+    Args:
+        rusage (resource.struct_rusage): os.wait4 が返したリソース使用量
+    
+    Returns:
+        dict: CPU時間（ユーザー・システム、秒）と最大メモリ使用量（KB）
+    """
+    if rusage is None:
+        return {}
+    return {
+        'cpu_user_seconds': round(rusage.ru_utime, 3),
+        'cpu_system_seconds': round(rusage.ru_stime, 3),
+        'max_rss_kb': rusage.ru_maxrss,
+    }
+
+
+def drain():
+    """
+    記録済みの区間をすべて取り出す（ワーカープロセス用）
+    
+    Returns:
+        dict: ジョブIDと区間のリストの辞書
+    """
+    global _events
+    with _lock:
+        drained, _events = dict(_events), defaultdict(list)
+    return drained
+
+
+def merge(drained):
+    """
+    ワーカープロセスから受け取った区間を合わせる
+    
+    Args:
+        drained (dict): drain() の戻り値
+    """
+    if not _enabled or not drained:
+        return
+    with _lock:
+        for job_id, events in drained.items():
+            if job_id not in _finished:
+                _events[job_id].extend(events)
+
+
+def finish_job(job_id, label):
+    """
+    完了したジョブの区間を取り出し、TRACE_DIR にジョブごとのファイルとして書き出す（バッチの記録中は貯めておく）
+    
+    Args:
+        job_id (str): ジョブID
+        label (str): トレースビューアーに表示するジョブの名前
+    """
+    if not _enabled:
+        return
+    with _lock:
+        events = _events.pop(job_id, [])
+        _finished.add(job_id)
+        _finished_order.append(job_id)
+        if len(_finished_order) > FINISHED_HISTORY:
+            _finished.discard(_finished_order.popleft())
+        if _batch is not None and events:
+            _batch.append((label, events))
+    if not events or not config.TRACE_DIR:
+        return
+    try:
+        write_trace(os.path.join(config.TRACE_DIR, f'{job_id}.json'), [(label, events)])
+    except OSError as e:
+        logger.warning(f"ジョブ {job_id} のトレースを書き出せませんでした: {str(e)}")
+
+
+def start_batch():
+    """以降に完了したジョブの区間を、write_batch で1つのファイルにまとめて書き出せるように貯め始める"""
+    global _batch
+    enable()
+    with _lock:
+        _batch = []
+
+
+def write_batch(path):
+    """
+    start_batch 以降に完了したジョブの区間を1つのファイルに書き出す
+    
+    Args:
+        path (str): 書き出すファイルのパス
+    
+    Returns:
+        int: 書き出したジョブ数
+    """
+    global _batch
+    with _lock:
+        jobs, _batch = _batch or [], None
+    write_trace(path, jobs)
+    logger.info(f"{len(jobs)}件のジョブのトレースを書き出しました: {path}")
+    return len(jobs)
+
+
+def write_trace(path, jobs):
+    """
+    Chromeのトレースイベント形式で書き出す
+    
+    ジョブごとに1つのプロセスとして表示し（実際のプロセスIDは区間の情報に残す）、同時に進んだジョブを並べて比べられるようにする。
+    
+    Args:
+        path (str): 書き出すファイルのパス
+        jobs (list): (ジョブの名前, 区間のリスト) のリスト
+    """
+    trace_events = []
+    for lane, (label, events) in enumerate(jobs, start=1):
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': lane, 'args': {'name': label}})
+        threads = {}
+        for event in events:
+            key = (event['pid'], event['tid'])
+            if key not in threads:
+                threads[key] = len(threads) + 1
+                trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': lane, 'tid': threads[key],
+                                     'args': {'name': f"{event['thread']} (pid {event['pid']})"}})
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['cat'],
+                'ph': 'X',
+                'ts': event['ts'],
+                'dur': event['dur'],
+                'pid': lane,
+                'tid': threads[key],
+                'args': dict(event['args'], pid=event['pid']),
+            })
+    
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
@@ -0,0 +1,444 @@
+"""
+YouTube Data APIのクォータを考慮してアップロードを予約・実行するモジュール
+"""
+import os
+import sys
+import json
+import uuid
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules.youtube_uploader import QuotaExceededError
+
+logger = logging.getLogger('youtube-shorts-bot.upload_scheduler')
+
+try:
+    from zoneinfo import ZoneInfo
+    # YouTube Data APIのクォータは太平洋時間の0時にリセットされる
+    QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except Exception:
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+def _write_json(path, data):
+    """JSONファイルを置き換えで保存する（書き込み途中で落ちても壊れないように）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def _read_json(path, default):
+    """JSONファイルを読み込む（存在しない・壊れている場合はdefault）"""
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"{path} を読み込めません: {e}")
+        return default
+
+
+class QuotaLedger:
+    """プロジェクトごとの1日のクォータ使用量を記録するクラス"""
+    
+    def __init__(self, path=None, daily_quota=None):
+        """初期化"""
+        self.path = path or config.UPLOAD_QUOTA_FILE
+        self.daily_quota = daily_quota or config.YOUTUBE_DAILY_QUOTA
+        self._lock = threading.Lock()
+        self._data = _read_json(self.path, {})
+    
+    @staticmethod
+    def quota_date(now=None):
+        """クォータの集計日（太平洋時間の日付）を返す"""
+        now = now or datetime.now(timezone.utc)
+        return now.astimezone(QUOTA_TIMEZONE).date().isoformat()
+    
+    @staticmethod
+    def seconds_until_reset(now=None):
+        """次にクォータがリセットされるまでの秒数を返す"""
+        now = (now or datetime.now(timezone.utc)).astimezone(QUOTA_TIMEZONE)
+        tomorrow = (now + timedelta(days=1)).date()
+        reset_at = datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=QUOTA_TIMEZONE)
+        return max(0.0, (reset_at - now).total_seconds())
+    
+    def _entry(self, project):
+        """当日分のエントリを取得する（日付が変わっていればリセット）"""
+        today = self.quota_date()
+        entry = self._data.get(project)
+        if not entry or entry.get('date') != today:
+            entry = {'date': today, 'used': 0, 'exhausted': False}
+            self._data[project] = entry
+        return entry
+    
+    def remaining(self, project):
+        """
+        当日の残りクォータを返す
+        
+        Args:
+            project (str): Google CloudプロジェクトID
+        
+        Returns:
+            int: 残りのクォータ（APIから上限到達を通知された場合は0）
+        """
+        with self._lock:
+            entry = self._entry(project)
+            if entry['exhausted']:
+                return 0
+            return max(0, self.daily_quota - entry['used'])
+    
+    def spend(self, project, units):
+        """クォータの使用を記録する"""
+        with self._lock:
+            self._entry(project)['used'] += units
+            _write_json(self.path, self._data)
+    
+    def refund(self, project, units):
+        """使用を記録したクォータを戻す（APIに処理されなかった呼び出し）"""
+        with self._lock:
+            entry = self._entry(project)
+            entry['used'] = max(0, entry['used'] - units)
+            _write_json(self.path, self._data)
+    
+    def mark_exhausted(self, project):
+        """APIからクォータ超過を通知されたプロジェクトを当日中は使用しない"""
+        with self._lock:
+            self._entry(project)['exhausted'] = True
+            _write_json(self.path, self._data)
+    
+    def snapshot(self):
+        """
+        全プロジェクトの当日の使用状況を返す
+        
+        Returns:
+            dict: プロジェクトIDと {'used', 'remaining', 'exhausted'} の辞書
+        """
+        with self._lock:
+            result = {}
+            for project in list(self._data):
+                entry = self._entry(project)
+                remaining = 0 if entry['exhausted'] else max(0, self.daily_quota - entry['used'])
+                result[project] = {'used': entry['used'], 'remaining': remaining, 'exhausted': entry['exhausted']}
+            return result
+
+
+class _PlannedLedger:
+    """割り当て予定のクォータを差し引いた残りを返す（チャンネル選択の見積もり用）"""
+    
+    def __init__(self, ledger):
+        """初期化"""
+        self.ledger = ledger
+        self.planned = Counter()
+    
+    def remaining(self, project):
+        """割り当て予定の分を差し引いた当日の残りクォータを返す"""
+        return self.ledger.remaining(project) - self.planned[project]
+
+
+class UploadScheduler:
+    """クォータの範囲内でアップロードを実行し、超過分を予約して翌日に実行するクラス"""
+    
+    def __init__(self, uploader, ledger=None, queue_file=None):
+        """
+        初期化
+        
+        Args:
+            uploader (YouTubeUploader): アップロードに使用するインスタンス
+            ledger (QuotaLedger, optional): クォータ使用量の記録
+            queue_file (str, optional): 予約キューの保存先
+        """
+        self.uploader = uploader
+        self.ledger = ledger or QuotaLedger()
+        self.queue_file = queue_file or config.UPLOAD_QUEUE_FILE
+        self.cost = config.YOUTUBE_UPLOAD_QUOTA_COST
+        self.queue = _read_json(self.queue_file, [])
+        self._result_listener = None
+        self._wakeup = None
+        self._worker = None
+        # チャンネルごとの実行中のアップロード数と、予約キューから実行中の項目
+        self._busy = Counter()
+        self._in_flight = set()
+        # 実行中のアップロードが終わったことを、実行枠の空きを待つ即時実行に知らせるイベント
+        self._slot_released = None
+        
+        if self.queue:
+            logger.info(f"予約済みのアップロードを{len(self.queue)}件読み込みました")
+    
+    def set_result_listener(self, listener):
+        """
+        予約されていたアップロードが完了・失敗したときに呼ばれる関数を設定する
+        
+        Args:
+            listener: 非同期関数 async def listener(item, video_id)（失敗時はvideo_id=None）
+        """
+        self._result_listener = listener
+    
+    def _save_queue(self):
+        """予約キューを保存する"""
+        _write_json(self.queue_file, self.queue)
+    
+    def start(self):
+        """予約キューを処理するバックグラウンドタスクを起動する（イベントループ内で呼び出す）"""
+        if self._worker and not self._worker.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+    
+    async def submit(self, video_path, title, description, tags=None, privacy_status='unlisted', notify=None,
+                     channel=None, session_callback=None, resume=False):
+        """
+        アップロードを実行する。クォータが足りない場合は予約キューに入れる
+        
+        Args:
+            video_path (str): アップロードする動画ファイルのパス
+            title (str): 動画のタイトル
+            description (str): 動画の説明
+            tags (list, optional): 動画のタグリスト
+            privacy_status (str, optional): プライバシー設定
+            notify (dict, optional): 予約後の完了通知に使う情報（例: {'channel_id': ...}）
+            channel (str, optional): 優先するチャンネル名（中断したアップロードを同じチャンネルで再開する場合など）
+            session_callback (callable, optional): session_callback(チャンネル名, セッションURI)。
+                                                   即時実行したアップロードのセッション開始時に呼ばれる
+            resume (bool): channel で中断したセッションを再開する場合True
+                           （クォータはセッション作成時に記録済みのため、新しいセッションを始めた場合だけ記録する）
+        
+        Returns:
+            dict: {'status': 'uploaded', 'video_id': ...}、{'status': 'queued', 'position': ..., 'release_in': 秒}、
+                  または {'status': 'failed'}
+        """
+        item = {
+            'id': uuid.uuid4().hex[:12],
+            'video_path': video_path,
+            'title': title,
+            'description': description,
+            'tags': tags or [],
+            'privacy_status': privacy_status,
+            'notify': notify or {},
+            'enqueued_at': datetime.now().isoformat(),
+        }
+        
+        preferred = self.uploader.channels.get(channel) if channel else None
+        if preferred is not None and resume:
+            item['resume_channel'] = preferred.name
+        
+        while True:
+            channel = self._select_immediate(item, preferred)
+            if channel is None:
+                if self.uploader.select_channel(title, item['tags'], self.ledger, self.cost) is None:
+                    # クォータの残っているチャンネルがない
+                    break
+                # クォータはあるが、実行枠が埋まっているか先に予約された分に割り当てるので、
+                # 実行中のアップロードが終わるのを待つ
+                if self._wakeup:
+                    self._wakeup.set()
+                await self._wait_for_slot()
+                continue
+            try:
+                video_id = await self._upload(item, channel, session_callback)
+            except QuotaExceededError:
+                # このチャンネルのプロジェクトは当日使用しないので、別のチャンネルを選び直す
+                continue
+            return {'status': 'uploaded', 'video_id': video_id} if video_id else {'status': 'failed'}
+        
+        return self._enqueue(item)
+    
+    def _select_immediate(self, item, preferred=None):
+        """
+        即時実行するチャンネルを選ぶ
+        
+        先に予約された分を追い越さないよう、予約キューで待っていて今すぐ送れる項目にクォータと実行枠を
+        先に割り当てたものとして、残りから選ぶ。実行中の項目と、送れるチャンネルがない項目は考慮しない。
+        
+        Args:
+            item (dict): アップロードする項目
+            preferred (YouTubeChannel, optional): 優先するチャンネル
+        
+        Returns:
+            YouTubeChannel: 選んだチャンネル、クォータと実行枠の空いたチャンネルがない場合はNone
+        """
+        busy = Counter(self._busy)
+        ledger = _PlannedLedger(self.ledger)
+        # 予約キューを送り出すタスクが動いていない間は、キューの項目は送られないので考慮しない
+        if self._worker is not None and not self._worker.done():
+            for queued in self.queue:
+                if queued['id'] in self._in_flight:
+                    continue
+                channel = self.uploader.select_channel(queued['title'], queued['tags'], ledger, self.cost, busy)
+                if channel is not None:
+                    busy[channel.name] += 1
+                    ledger.planned[channel.project_id] += self.cost
+        
+        if (preferred is not None and ledger.remaining(preferred.project_id) >= self.cost
+                and busy[preferred.name] < preferred.max_concurrent_uploads):
+            return preferred
+        return self.uploader.select_channel(item['title'], item['tags'], ledger, self.cost, busy)
+    
+    def _enqueue(self, item):
+        """アップロードを予約キューに入れる"""
+        self.queue.append(item)
+        self._save_queue()
+        if self._wakeup:
+            self._wakeup.set()
+        
+        position = self.queue.index(item) + 1
+        release_in = self.ledger.seconds_until_reset()
+        logger.info(f"クォータ不足のためアップロードを予約しました: {item['title']} "
+                    f"(待ち{position}件目, リセットまで{release_in / 3600:.1f}時間)")
+        return {'status': 'queued', 'position': position, 'release_in': release_in, 'queue_id': item['id']}
+    
+    async def _wait_for_slot(self):
+        """いずれかのチャンネルで実行中のアップロードが終わるまで待つ"""
+        if self._slot_released is None:
+            self._slot_released = asyncio.Event()
+        self._slot_released.clear()
+        await self._slot_released.wait()
+    
+    def _upload(self, item, channel, session_callback=None):
+        """
+        クォータと実行枠を記録してアップロードを開始する
+        
+        記録はこの呼び出しの時点で行うため、続けて選ぶチャンネルには反映済みになる。
+        中断したセッションを同じチャンネルで再開する場合、クォータは新しいセッションを始めたときだけ記録する。
+        実行枠はアップロードのスレッドが実際に終わったときに空ける（待機がキャンセルされても送信はチャンクの
+        区切りまで続き、チャンネルの同時アップロード数の枠を使い続けるため）。
+        
+        Returns:
+            coroutine: アップロードした動画のID（失敗した場合はNone）を返すコルーチン
+        """
+        project = channel.project_id
+        # セッションの作成時に記録済みのクォータを二重に記録しない
+        charged = item.get('resume_channel') != channel.name
+        if charged:
+            self.ledger.spend(project, self.cost)
+        self._busy[channel.name] += 1
+        
+        def on_session(uri):
+            nonlocal charged
+            if not charged:
+                # 再開できずに新しいセッションを始めた
+                self.ledger.spend(project, self.cost)
+                charged = True
+            if session_callback:
+                session_callback(channel.name, uri)
+        
+        def release_slot():
+            self._busy[channel.name] -= 1
+            if self._wakeup:
+                self._wakeup.set()
+            if self._slot_released:
+                self._slot_released.set()
+        
+        async def run():
+            try:
+                return await self.uploader.upload_video_async(
+                    video_path=item['video_path'],
+                    title=item['title'],
+                    description=item['description'],
+                    tags=item['tags'],
+                    privacy_status=item['privacy_status'],
+                    channel=channel.name,
+                    session_callback=on_session,
+                    finished_callback=release_slot,
+                )
+            except QuotaExceededError:
+                # 超過した呼び出しはクォータを消費しないため戻し、当日は使用を停止する
+                if charged:
+                    self.ledger.refund(project, self.cost)
+                self.ledger.mark_exhausted(project)
+                raise
+        
+        return run()
+    
+    def _next_routable(self):
+        """予約キューのうち、クォータと実行枠に空きのあるチャンネルへ送れる最初の項目を返す"""
+        for item in self.queue:
+            if item['id'] in self._in_flight:
+                continue
+            channel = self.uploader.select_channel(item['title'], item['tags'], self.ledger, self.cost, self._busy)
+            if channel is not None:
+                return item, channel
+        return None, None
+    
+    async def _release(self, item, upload):
+        """予約されていた項目のアップロード完了を待ち、結果を通知する"""
+        try:
+            video_id = await upload
+        except QuotaExceededError:
+            # キューに残したまま、別のチャンネルかリセット後に再実行する
+            self._in_flight.discard(item['id'])
+            self._wakeup.set()
+            return
+        except Exception as e:
+            logger.error(f"予約アップロード中にエラーが発生: {str(e)}")
+            video_id = None
+        
+        self._in_flight.discard(item['id'])
+        self.queue.remove(item)
+        self._save_queue()
+        self._wakeup.set()
+        
+        if self._result_listener:
+            try:
+                await self._result_listener(item, video_id)
+            except Exception as e:
+                logger.error(f"予約アップロードの結果通知中にエラーが発生: {str(e)}")
+    
+    async def _run(self):
+        """予約キューを空きのあるチャンネルへ順に送り出し、クォータが尽きたらリセットまで待機する"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            item, channel = self._next_routable()
+            if item is not None:
+                self._in_flight.add(item['id'])
+                loop.create_task(self._release(item, self._upload(item, channel)))
+                continue
+            
+            pending = len(self.queue) - len(self._in_flight)
+            if pending <= 0:
+                await self._wakeup.wait()
+                continue
+            
+            # 実行中のアップロードが終わるか、クォータがリセットされるまで待つ
+            # リセット直後に確実に日付が変わるよう少し余裕を持たせる
+            delay = self.ledger.seconds_until_reset() + 5
+            if not self._in_flight:
+                logger.info(f"クォータのリセットまで{delay / 3600:.1f}時間待機します（予約{pending}件）")
+            # wait_for は待機の完了と同時に届いたキャンセルを取りこぼすことがある（Python 3.11以前）ため、
+            # 終了時にタスクが止まらなくならないよう asyncio.wait で待つ
+            waiter = loop.create_task(self._wakeup.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=delay)
+            finally:
+                waiter.cancel()
+    
+    def backlog(self):
+        """
+        予約キューとクォータの状況を返す
+        
+        Returns:
+            dict: 予約件数、最古の予約日時、プロジェクトごとの残りクォータ、チャンネルの状態、
+                  1日あたりのアップロード可能数など
+        """
+        channels = self.uploader.channel_status()
+        for name, status in channels.items():
+            status['active_uploads'] = self._busy[name]
+        projects = {status['project_id'] for status in channels.values()}
+        return {
+            'depth': len(self.queue),
+            'in_flight': len(self._in_flight),
+            'oldest_enqueued_at': self.queue[0]['enqueued_at'] if self.queue else None,
+            'quota': self.ledger.snapshot(),
+            'channels': channels,
+            'uploads_per_day': len(projects) * (self.ledger.daily_quota // self.cost),
+            'seconds_until_reset': round(self.ledger.seconds_until_reset()),
+        }
@@ -11,6 +11,7 @@ import glob
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import tempfile
+import shutil
 
 # 親ディレクトリをインポートパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,7 +19,7 @@ import config
 
 # 字幕およびFFmpeg関連のモジュールをインポート
 from modules.subtitle_utils import write_srt_file
-from modules.ffmpeg_handler import crop_video, trim_video, mute_video, add_subtitles_to_video, add_text_to_video
+from modules.ffmpeg_handler import add_subtitles_to_video, add_text_to_video, prepare_vertical_clip
 
 logger = logging.getLogger('youtube-shorts-bot.video_creator')
 
@@ -176,28 +177,23 @@ class VideoCreator:
         
         return image
     
-    def create_video(self, text=None, output_path=None, background_video_path=None, skip_text=False, subtitles=None, mute_audio=False):
+    def prepare_background(self, background_video_path=None, mute_audio=False, cancel_event=None):
         """
-        動画を生成する
+        背景動画を選択し、縦長への変換と長さの調整を済ませた背景プレートを作成する
+        
+        テキストに依存しないため、テキスト生成と並行して実行できる。
         
         Args:
-            text (str, optional): 動画に表示するテキスト
-            output_path (str, optional): 出力ファイルパス
-            background_video_path (str, optional): 背景動画のパス
-            skip_text (bool, optional): メインテキストの表示をスキップするか
-            subtitles (list or str, optional): 字幕のリストまたはテキスト
+            background_video_path (str, optional): 背景動画のパス（未指定の場合はランダムに選択）
             mute_audio (bool, optional): 音声をミュートするか
+            cancel_event (threading.Event, optional): セットされたら変換を中止するイベント
             
         Returns:
-            str: 生成した動画のパス
+            str: 背景プレートのパス（一時ディレクトリ内）、失敗した場合はNone
         """
         try:
-            # 出力パスの設定
-            if output_path is None:
-                output_path = os.path.join(config.OUTPUT_DIR, "output.mp4")
-                
-            # 出力ディレクトリの確認
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if cancel_event is not None and cancel_event.is_set():
+                raise RuntimeError("背景プレートの作成は開始前に中止されました")
             
             # 背景動画選択
             if background_video_path is None:
@@ -205,38 +201,60 @@ class VideoCreator:
                 
             if not background_video_path or not os.path.exists(background_video_path):
                 raise ValueError(f"背景動画が見つかりません: {background_video_path}")
-                
-            logger.info(f"背景動画を選択: {os.path.basename(background_video_path)}")
             
             # 一時ファイルを保存するディレクトリ
             temp_dir = tempfile.mkdtemp(prefix="yt_shorts_")
+            plate_path = os.path.join(temp_dir, "background.mp4")
             
-            # 処理の流れ：
-            # 1. 必要に応じて音声をミュート
-            # 2. 動画をクロップして縦長に
-            # 3. 動画の長さを調整
-            # 4. 字幕を追加
+            # シーク・縦長形式への変換・長さの調整・ミュートを1回のエンコードで行う
+            logger.info(f"背景動画を縦長形式(9:16比率)・{config.VIDEO_DURATION}秒に変換します")
+            if not prepare_vertical_clip(background_video_path, plate_path, config.VIDEO_WIDTH, config.VIDEO_HEIGHT,
+                                         start_time=0, duration=config.VIDEO_DURATION, mute=mute_audio,
+                                         cancel_event=cancel_event):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise RuntimeError("背景動画の変換に失敗しました")
             
-            # ステップ1: 中間ファイルのパスを設定
-            temp_muted = os.path.join(temp_dir, "muted.mp4") if mute_audio else background_video_path
-            temp_cropped = os.path.join(temp_dir, "cropped.mp4")
-            temp_trimmed = os.path.join(temp_dir, "trimmed.mp4")
+            logger.info(f"背景プレートを作成しました: {plate_path}")
+            return plate_path
             
-            # ステップ2: 必要に応じて音声をミュート
-            if mute_audio:
-                logger.info("動画の音声を無効化します")
-                if not mute_video(background_video_path, temp_muted):
-                    raise RuntimeError("音声のミュートに失敗しました")
-            
-            # ステップ3: 動画を縦長形式に変換
-            logger.info("動画を縦長形式に変換します (9:16比率)")
-            if not crop_video(temp_muted, temp_cropped, config.VIDEO_WIDTH, config.VIDEO_HEIGHT):
-                raise RuntimeError("動画のクロップに失敗しました")
+        except Exception as e:
+            logger.error(f"背景プレート作成中にエラーが発生: {str(e)}")
+            return None
+    
+    def discard_background(self, plate_path):
+        """
+        使わなかった背景プレートを削除する
+        
+        Args:
+            plate_path (str): prepare_background で作成した背景プレートのパス
+        """
+        if not plate_path or not os.path.exists(plate_path):
+            return
+        try:
+            shutil.rmtree(os.path.dirname(plate_path))
+        except Exception as e:
+            logger.warning(f"一時ファイルの削除中にエラーが発生: {e}")
+    
+    def render_overlay(self, plate_path, output_path=None, subtitles=None, cancel_event=None):
+        """
+        背景プレートにテキストを描画して動画を完成させる（背景プレートは削除される）
+        
+        Args:
+            plate_path (str): prepare_background で作成した背景プレートのパス
+            output_path (str, optional): 出力ファイルパス
+            subtitles (list or str, optional): 字幕のリストまたはテキスト
+            cancel_event (threading.Event, optional): セットされたらFFmpegを終了して中止するイベント
             
-            # ステップ4: 動画の長さを調整
-            logger.info(f"動画の長さを{config.VIDEO_DURATION}秒に調整します")
-            if not trim_video(temp_cropped, temp_trimmed, 0, config.VIDEO_DURATION):
-                raise RuntimeError("動画の長さ調整に失敗しました")
+        Returns:
+            str: 生成した動画のパス、失敗した場合はNone
+        """
+        try:
+            # 出力パスの設定
+            if output_path is None:
+                output_path = os.path.join(config.OUTPUT_DIR, "output.mp4")
+                
+            # 出力ディレクトリの確認
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
             # 字幕が指定されている場合
             if subtitles:
@@ -250,20 +268,12 @@ class VideoCreator:
                 
                 # 字幕を直接描画
                 logger.info(f"FFmpegを使用して字幕を直接描画します: {subtitle_text}")
-                if not add_text_to_video(temp_trimmed, output_path, subtitle_text, 
-                                      font_size=60, font_color="white", bg_opacity=0.7):
+                if not add_text_to_video(plate_path, output_path, subtitle_text, 
+                                      font_size=60, font_color="white", bg_opacity=0.7, cancel_event=cancel_event):
                     raise RuntimeError("字幕の追加に失敗しました")
             else:
-                # 字幕なしの場合は、トリミング済みファイルをそのまま出力
-                import shutil
-                shutil.copy(temp_trimmed, output_path)
-            
-            # 一時ファイルのクリーンアップ
-            import shutil
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                logger.warning(f"一時ファイルの削除中にエラーが発生: {e}")
+                # 字幕なしの場合は、背景プレートをそのまま出力
+                shutil.copy(plate_path, output_path)
             
             logger.info(f"動画の作成が完了しました: {output_path}")
             return output_path
@@ -271,10 +281,39 @@ class VideoCreator:
         except Exception as e:
             logger.error(f"動画作成中にエラーが発生: {str(e)}")
             return None
-
+        
+        finally:
+            # 一時ファイルのクリーンアップ
+            self.discard_background(plate_path)
+    
+    def create_video(self, text=None, output_path=None, background_video_path=None, skip_text=False, subtitles=None, mute_audio=False):
+        """
+        動画を生成する
+        
+        Args:
+            text (str, optional): 動画に表示するテキスト
+            output_path (str, optional): 出力ファイルパス
+            background_video_path (str, optional): 背景動画のパス
+            skip_text (bool, optional): メインテキストの表示をスキップするか
+            subtitles (list or str, optional): 字幕のリストまたはテキスト
+            mute_audio (bool, optional): 音声をミュートするか
+            
+        Returns:
+            str: 生成した動画のパス
+        """
+        # 処理の流れ：
+        # 1. 背景プレートの作成（ミュート・縦長への変換・長さの調整）
+        # 2. 字幕を追加
+        plate_path = self.prepare_background(background_video_path, mute_audio=mute_audio)
+        if not plate_path:
+            return None
+        return self.render_overlay(plate_path, output_path, subtitles=subtitles)
 
 if __name__ == "__main__":
     # テスト用コード
+    from modules.logging_setup import setup_logging
+    setup_logging()
+    
     import sys
     import os
     
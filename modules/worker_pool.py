@@ -0,0 +1,445 @@
+"""
+テキスト生成・動画作成を別プロセスのワーカーで実行するモジュール
+Discordの受け付けプロセスとCPUを使う処理のGILの競合を避け、ワーカーが異常終了しても自動で再起動する
+"""
+import os
+import sys
+import time
+import uuid
+import logging
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, CancelledError, TimeoutError
+from multiprocessing.connection import wait
+
+# 親ディレクトリをインポートパスに追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from modules import metrics, logging_setup, tracing
+from modules.rate_limiter import collect_metrics as collect_rate_limit_metrics
+
+logger = logging.getLogger('youtube-shorts-bot.worker_pool')
+
+
+class WorkerCrashed(Exception):
+    """ワーカープロセスが処理中に異常終了した場合の例外"""
+
+
+class WorkerTaskError(Exception):
+    """ワーカープロセスで処理がエラーになった場合の例外"""
+
+
+# 中止の指示を確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.1
+# タスクの処理中にメトリクス（実行中のFFmpegの数などのゲージ）を受け付けプロセスへ送る間隔（秒）
+METRICS_FORWARD_INTERVAL = 5
+
+# ワーカープロセス側の処理（プロセスごとに1つずつ作成する）
+_text_generator = None
+_video_creator = None
+# 実行中のタスクの中止を知らせるイベント（タスクごとにクリアされる）
+_cancel_event = threading.Event()
+# 実行中のタスクの途中経過を受け付けプロセスへ送る関数（タスクごとに設定される）
+_progress_sender = None
+
+
+def generate_text_task(theme):
+    """
+    ワーカープロセスでテキストを生成する
+    
+    Returns:
+        tuple: (テキスト, スラッグ)
+    """
+    global _text_generator
+    if _text_generator is None:
+        from modules.text_generator import TextGenerator
+        _text_generator = TextGenerator()
+    # 確定した名言は途中経過として受け付けプロセスに送る
+    return _text_generator.generate_text(theme, cancel_event=_cancel_event,
+                                         on_quote=lambda index, quote: report_progress((index, quote)))
+
+
+def render_overlay_task(plate_path, output_path, text):
+    """
+    ワーカープロセスで背景プレートにテキストを描画する
+    
+    Returns:
+        str: 生成した動画のパス、失敗した場合はNone
+    """
+    global _video_creator
+    if _video_creator is None:
+        from modules.video_creator import VideoCreator
+        _video_creator = VideoCreator()
+    return _video_creator.render_overlay(plate_path, output_path, subtitles=text, cancel_event=_cancel_event)
+
+
+def report_progress(value):
+    """
+    実行中のタスクの途中経過を受け付けプロセスへ送る（ワーカープロセスのタスクから呼び出す）
+    
+    Args:
+        value: 途中経過（pickleできる値。WorkerPool.call の on_progress に渡される）
+    """
+    if _progress_sender is not None:
+        _progress_sender(value)
+
+
+def _divide_rate_budgets(processes):
+    """プロセスごとに持つレート制限の枠を、全体の上限をワーカー数で割った値にする"""
+    config.LLM_REQUESTS_PER_MINUTE = max(1, config.LLM_REQUESTS_PER_MINUTE // processes)
+    config.LLM_TOKENS_PER_MINUTE = max(1, config.LLM_TOKENS_PER_MINUTE // processes)
+    config.LLM_MAX_QUEUE = max(1, config.LLM_MAX_QUEUE // processes)
+
+
+def _watch_cancel(cancel_target, current):
+    """受け付けプロセスが中止を指示したタスク番号が実行中のタスクと一致したら、中止のイベントをセットする"""
+    while True:
+        time.sleep(CANCEL_POLL_INTERVAL)
+        if current[0] and cancel_target.value == current[0]:
+            _cancel_event.set()
+
+
+def _forward_metrics(connection, send_lock):
+    """タスクの処理中もゲージなどの値が受け付けプロセスで見えるよう、一定間隔でメトリクスを送る"""
+    while True:
+        time.sleep(METRICS_FORWARD_INTERVAL)
+        drained = metrics.drain()
+        try:
+            with send_lock:
+                connection.send((None, 'metrics', None, drained, None))
+        except (OSError, ValueError):
+            # 受け付けプロセスが終了した
+            return
+
+
+def _worker_main(worker_id, connection, cancel_target, processes, log_queue):
+    """
+    ワーカープロセスのメインループ
+    
+    Args:
+        worker_id (int): ワーカー番号
+        connection (multiprocessing.connection.Connection): (タスクID, タスク番号, ジョブID, 関数, 引数) を受け取り、
+            (タスクID, 'done' | 'error', 戻り値またはエラー内容, メトリクスの値, トレースの区間) を返す接続
+            （Noneを受け取ると終了。タスクIDがNoneのものは処理中に定期的に送るメトリクス、
+            'progress' のものは処理中の途中経過）
+        cancel_target (multiprocessing.Value): 中止するタスク番号（受け付けプロセスが書き込む）
+        processes (int): ワーカー数（レート制限の枠を分けるために使う）
+        log_queue (multiprocessing.Queue): ログの送り先（受け付けプロセスがまとめて書き出す）
+    """
+    global _progress_sender
+    logging_setup.setup_worker_logging(log_queue)
+    _divide_rate_budgets(processes)
+    # このプロセスで記録したメトリクスとトレースの区間は、結果と一緒に受け付けプロセスへ送って合算する
+    metrics.enable_forwarding()
+    metrics.register_collector(collect_rate_limit_metrics)
+    tracing.enable_forwarding()
+    current = [0]
+    threading.Thread(target=_watch_cancel, args=(cancel_target, current), daemon=True).start()
+    send_lock = threading.Lock()
+    threading.Thread(target=_forward_metrics, args=(connection, send_lock), daemon=True).start()
+    
+    while True:
+        try:
+            item = connection.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        task_id, number, job_id, func, args = item
+        logging_setup.job_id.set(job_id)
+        _cancel_event.clear()
+        current[0] = number
+        
+        def send_progress(value, task_id=task_id):
+            with send_lock:
+                connection.send((task_id, 'progress', value, None, None))
+        _progress_sender = send_progress
+        with tracing.span(getattr(func, '__name__', 'task'), 'worker', worker=worker_id) as span_args:
+            try:
+                kind, value = 'done', func(*args)
+            except Exception as e:
+                kind, value = 'error', f"{type(e).__name__}: {e}"
+            span_args['outcome'] = kind
+        current[0] = 0
+        _progress_sender = None
+        result = (task_id, kind, value, metrics.drain(), tracing.drain())
+        with send_lock:
+            connection.send(result)
+
+
+class WorkerPool:
+    """ワーカープロセスにタスクを配り、結果を受け取るクラス"""
+    
+    def __init__(self, processes=None, max_task_retries=None):
+        """
+        初期化
+        
+        Args:
+            processes (int, optional): ワーカープロセス数
+            max_task_retries (int, optional): ワーカーが異常終了したときにタスクを再実行する回数
+        """
+        self.processes = processes or config.WORKER_PROCESSES
+        self.max_task_retries = (max_task_retries if max_task_retries is not None
+                                 else config.WORKER_MAX_TASK_RETRIES)
+        # ワーカーは受け付けプロセスの状態（イベントループやスレッド）を引き継がないよう spawn で起動する
+        self._context = multiprocessing.get_context('spawn')
+        # ワーカー番号と (プロセス, 接続, 中止するタスク番号) の辞書。タスクは空いているワーカーに1つずつ送る
+        self._workers = {}
+        self._numbers = itertools.count(1)
+        self._idle = deque()
+        self._assigned = {}
+        self._queue = deque()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._receiver = None
+        self._metrics = {'submitted': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'restarts': 0, 'cancelled': 0}
+    
+    def start(self):
+        """ワーカープロセスと、結果を受け取るスレッドを起動する"""
+        if self._receiver is not None:
+            return self
+        for worker_id in range(self.processes):
+            self._spawn(worker_id)
+        self._receiver = threading.Thread(target=self._receive_loop, name='worker-pool', daemon=True)
+        self._receiver.start()
+        logger.info(f"ワーカープロセスを{self.processes}個起動しました")
+        return self
+    
+    def _spawn(self, worker_id):
+        """ワーカープロセスを起動して、空いているワーカーに加える"""
+        parent_connection, child_connection = self._context.Pipe()
+        cancel_target = self._context.Value('q', 0, lock=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, child_connection, cancel_target, self.processes,
+                  logging_setup.worker_log_queue(self._context)),
+            name=f'shorts-worker-{worker_id}',
+            daemon=True,
+        )
+        process.start()
+        # 子プロセス側の接続を閉じておくと、ワーカーが終了したときに受信側で EOFError になる
+        child_connection.close()
+        self._workers[worker_id] = (process, parent_connection, cancel_target)
+        self._idle.append(worker_id)
+    
+    def _dispatch(self):
+        """待機中のタスクを空いているワーカーに送る（ロックを取得した状態で呼び出す）"""
+        while self._idle and self._queue:
+            worker_id = self._idle.popleft()
+            task_id = self._queue.popleft()
+            entry = self._pending[task_id]
+            try:
+                self._workers[worker_id][1].send((task_id, entry['number'], entry['job_id'], entry['func'],
+                                                  entry['args']))
+            except (OSError, ValueError):
+                # 終了したワーカーは受信側で再起動されるため、タスクを戻して次のワーカーに送る
+                self._queue.appendleft(task_id)
+                continue
+            self._assigned[worker_id] = task_id
+    
+    def submit(self, func, *args, on_progress=None):
+        """
+        タスクをワーカーに送る
+        
+        Args:
+            func: ワーカープロセスで実行するモジュールレベルの関数
+            *args: 関数の引数（pickleできる値）
+            on_progress (callable, optional): タスクが report_progress で送った途中経過を受け取る関数
+                on_progress(value)。結果を受け取るスレッドから呼ばれる
+        
+        Returns:
+            concurrent.futures.Future: 関数の戻り値を受け取るFuture
+        """
+        future = Future()
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            # ワーカーのログにも呼び出し元のジョブIDを付与する
+            self._pending[task_id] = {'future': future, 'func': func, 'args': args, 'attempts': 0,
+                                      'number': next(self._numbers), 'job_id': logging_setup.job_id.get(),
+                                      'on_progress': on_progress}
+            self._queue.append(task_id)
+            self._metrics['submitted'] += 1
+            self._dispatch()
+        return future
+    
+    def call(self, func, *args, cancel_event=None, on_progress=None):
+        """
+        タスクをワーカーで実行し、結果を待つ（ステージのスレッドから呼び出す）
+        
+        Args:
+            func: ワーカープロセスで実行するモジュールレベルの関数
+            *args: 関数の引数
+            cancel_event (threading.Event, optional): セットされたらタスクを中止するイベント
+                （実行中の場合はワーカー側の処理が中止に応じて戻るまで待つ）
+            on_progress (callable, optional): 途中経過を受け取る関数（submit を参照）
+        
+        Returns:
+            object: 関数の戻り値（実行前に中止した場合はNone）
+        
+        Raises:
+            WorkerTaskError: ワーカーで処理がエラーになった場合
+            WorkerCrashed: ワーカーの異常終了が再実行の上限を超えた場合
+        """
+        future = self.submit(func, *args, on_progress=on_progress)
+        while cancel_event is not None:
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except TimeoutError:
+                if cancel_event.is_set():
+                    self.cancel(future)
+                    break
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+    
+    def cancel(self, future):
+        """
+        タスクを中止する（待機中の場合は取り消し、実行中の場合はワーカーに中止を指示する）
+        
+        Args:
+            future (concurrent.futures.Future): submit が返したFuture
+        """
+        with self._lock:
+            for task_id, entry in self._pending.items():
+                if entry['future'] is future:
+                    break
+            else:
+                return
+            self._metrics['cancelled'] += 1
+            if task_id in self._queue:
+                self._queue.remove(task_id)
+                del self._pending[task_id]
+                future.cancel()
+                return
+            for worker_id, assigned in self._assigned.items():
+                if assigned == task_id:
+                    self._workers[worker_id][2].value = entry['number']
+    
+    def _receive_loop(self):
+        """ワーカーからの結果を受け取ってFutureに設定し、異常終了したワーカーを再起動する"""
+        while not self._stopping.is_set():
+            connections = {connection: worker_id for worker_id, (_, connection, _) in list(self._workers.items())}
+            for connection in wait(list(connections), timeout=1):
+                worker_id = connections[connection]
+                try:
+                    task_id, kind, value, drained, spans = connection.recv()
+                except (EOFError, OSError):
+                    if not self._stopping.is_set():
+                        self._restart(worker_id)
+                    continue
+                if kind == 'progress':
+                    self._progress(task_id, value)
+                    continue
+                metrics.merge(drained, source=worker_id)
+                if task_id is None:
+                    continue
+                tracing.merge(spans)
+                self._finish(worker_id, task_id, kind, value)
+    
+    def _progress(self, task_id, value):
+        """タスクの途中経過を呼び出し元に渡す"""
+        with self._lock:
+            entry = self._pending.get(task_id)
+        if entry is None or entry['on_progress'] is None:
+            return
+        try:
+            entry['on_progress'](value)
+        except Exception as e:
+            logger.error(f"タスクの途中経過の処理中にエラーが発生: {str(e)}")
+    
+    def _finish(self, worker_id, task_id, kind, value):
+        """タスクの結果をFutureに設定し、ワーカーに次のタスクを送る"""
+        with self._lock:
+            self._assigned.pop(worker_id, None)
+            self._idle.append(worker_id)
+            entry = self._pending.pop(task_id, None)
+            if entry is not None:
+                self._metrics['completed' if kind == 'done' else 'failed'] += 1
+            self._dispatch()
+        if entry is None:
+            return
+        if kind == 'done':
+            entry['future'].set_result(value)
+        else:
+            entry['future'].set_exception(WorkerTaskError(value))
+    
+    def _restart(self, worker_id):
+        """異常終了したワーカーを再起動し、処理中だったタスクを再実行する（上限を超えた場合は失敗にする）"""
+        process, connection, _ = self._workers[worker_id]
+        process.join(5)
+        connection.close()
+        logger.error(f"ワーカー{worker_id}が異常終了しました（終了コード: {process.exitcode}）。再起動します")
+        # 終了したプロセスで実行中だった分のゲージを残さない
+        metrics.forget(worker_id)
+        
+        failed = None
+        with self._lock:
+            self._metrics['restarts'] += 1
+            if worker_id in self._idle:
+                self._idle.remove(worker_id)
+            task_id = self._assigned.pop(worker_id, None)
+            entry = self._pending.get(task_id) if task_id else None
+            if entry is not None:
+                if entry['attempts'] < self.max_task_retries:
+                    entry['attempts'] += 1
+                    self._metrics['retried'] += 1
+                    self._queue.appendleft(task_id)
+                    logger.warning(f"ワーカー{worker_id}で処理中だったタスクを再実行します ({entry['attempts']}回目)")
+                else:
+                    del self._pending[task_id]
+                    self._metrics['failed'] += 1
+                    failed = entry['future']
+            self._spawn(worker_id)
+            self._dispatch()
+        if failed is not None:
+            failed.set_exception(WorkerCrashed(f"ワーカー{worker_id}が処理中に異常終了しました"))
+    
+    def stop(self, timeout=10):
+        """
+        ワーカープロセスを終了する（処理中のタスクが終わるまで最大 timeout 秒待つ）
+        
+        Args:
+            timeout (float): 終了を待つ秒数
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        with self._lock:
+            workers = list(self._workers.values())
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._queue.clear()
+        for _, connection, _ in workers:
+            try:
+                connection.send(None)
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        for process, connection, _ in workers:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        for entry in pending:
+            entry['future'].set_exception(WorkerCrashed("ワーカープールが停止しました"))
+        logger.info("ワーカープロセスを停止しました")
+    
+    def metrics(self):
+        """
+        メトリクスを取得する
+        
+        Returns:
+            dict: ワーカー数、稼働中のワーカー数、待機中・処理中のタスク数、再起動回数などの統計
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['queued'] = len(self._queue)
+            metrics['running'] = len(self._assigned)
+            workers = list(self._workers.values())
+        metrics['processes'] = self.processes
+        metrics['alive'] = sum(process.is_alive() for process, _, _ in workers)
+        return metrics
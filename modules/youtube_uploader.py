@@ -5,80 +5,448 @@ import os
 import sys
 import logging
 import pickle
+import json
+import time
+import random
+import socket
+import hashlib
+import asyncio
+import functools
+import threading
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
 import google.oauth2.credentials
+import google.auth.credentials
+import google.auth.transport.requests
+import google_auth_httplib2
 import google_auth_oauthlib.flow
 import googleapiclient.discovery
+import googleapiclient.discovery_cache
 import googleapiclient.errors
 from googleapiclient.http import MediaFileUpload
 
 # 親ディレクトリをインポートパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from modules import metrics, tracing
 
 logger = logging.getLogger('youtube-shorts-bot.youtube_uploader')
 
+AUTH_TOTAL = metrics.counter('shorts_youtube_auth_total',
+                             '認証の回数（cached: 作成済みのクライアントを再利用）', ('channel', 'result'))
+AUTH_SECONDS = metrics.histogram('shorts_youtube_auth_seconds', '認証・トークン更新の所要時間（秒）', ('channel', 'outcome'))
+UPLOAD_BYTES = metrics.counter('shorts_upload_bytes_total', 'アップロードで送信したバイト数', ('channel',))
+UPLOAD_SECONDS = metrics.histogram('shorts_upload_seconds', '1本のアップロードの所要時間（秒）', ('channel', 'outcome'))
+
 # YouTube APIの設定
 SCOPES = ['https://www.googleapis.com/auth/youtube.upload']
 API_SERVICE_NAME = 'youtube'
 API_VERSION = 'v3'
 
-class YouTubeUploader:
-    """YouTubeアップロードクラス"""
+# アップロード中にリトライするHTTPステータスと例外（OSErrorは接続リセットやタイムアウトを含む）
+RETRYABLE_UPLOAD_STATUS_CODES = {500, 502, 503, 504}
+RETRYABLE_UPLOAD_EXCEPTIONS = (httplib2.HttpLib2Error, OSError)
+
+# クォータ超過を示すエラー理由
+QUOTA_ERROR_REASONS = {'quotaExceeded', 'dailyLimitExceeded', 'uploadLimitExceeded'}
+
+
+class QuotaExceededError(Exception):
+    """YouTube Data APIのクォータ超過"""
+
+
+class UploadCancelled(Exception):
+    """アップロードが中止された場合の例外"""
+
+
+def _build_http():
+    """
+    タイムアウトを設定したHTTPクライアントを作成する
+    
+    再開可能アップロードの 308 Resume Incomplete をhttplib2がリダイレクトとして扱わないようにする。
+    """
+    http = httplib2.Http(timeout=config.YOUTUBE_HTTP_TIMEOUT)
+    http.redirect_codes = http.redirect_codes - {308}
+    return http
+
+
+def _abort_connections(http):
+    """
+    HTTPクライアントの接続を切断し、応答待ちで止まっているリクエストをエラーで戻らせる
     
-    def __init__(self, client_secrets_file=None, credentials_dir=None):
-        """初期化"""
+    Args:
+        http: httplib2.Http またはそれをラップした AuthorizedHttp
+    """
+    inner = getattr(http, 'http', http)
+    for connection in list(getattr(inner, 'connections', {}).values()):
+        sock = getattr(connection, 'sock', None)
+        if sock is None:
+            continue
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _http_error_reasons(error):
+    """HttpErrorのレスポンスからエラー理由の一覧を取り出す"""
+    try:
+        content = error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content
+        errors = json.loads(content).get('error', {}).get('errors', [])
+        return {item.get('reason') for item in errors}
+    except (ValueError, AttributeError):
+        return set()
+
+
+class YouTubeChannel:
+    """1つのチャンネル（OAuth認証情報）へのアップロードを行うクラス"""
+    
+    def __init__(self, name='default', client_secrets_file=None, token_file=None, max_concurrent_uploads=None,
+                 themes=None):
+        """
+        初期化
+        
+        Args:
+            name (str): チャンネル名（振り分けとログに使用）
+            client_secrets_file (str, optional): OAuthクライアントの設定ファイル（クォータはこのプロジェクト単位）
+            token_file (str, optional): 認証トークンの保存先
+            max_concurrent_uploads (int, optional): 同時アップロード数の上限
+            themes (list, optional): このチャンネルに振り分けるキーワード（未指定の場合はすべて受け付ける）
+        """
+        self.name = name
         self.client_secrets_file = client_secrets_file or config.YOUTUBE_CLIENT_SECRETS_FILE
-        self.credentials_dir = credentials_dir or config.CREDENTIALS_DIR
-        self.token_pickle_path = os.path.join(self.credentials_dir, 'youtube_token.pickle')
+        self.token_pickle_path = token_file or os.path.join(config.CREDENTIALS_DIR, 'youtube_token.pickle')
+        self.max_concurrent_uploads = max_concurrent_uploads or config.YOUTUBE_MAX_CONCURRENT_UPLOADS
+        self.themes = themes or []
         self.youtube_service = None
+        self.credentials = None
+        self._project_id = None
+        
+        # 認証情報の更新と参照を直列化するロック
+        self._lock = threading.RLock()
+        # バックグラウンドでトークンを更新するスレッド
+        self._refresher = None
+        self._stop_refresher = threading.Event()
+        # 同時アップロード数の制限
+        self._upload_slots = threading.BoundedSemaphore(self.max_concurrent_uploads)
+        # httplib2はスレッドセーフではないため、アップロードはスレッドごとの接続で行う
+        self._http_local = threading.local()
+    
+    @property
+    def project_id(self):
+        """クォータの集計単位となるGoogle CloudプロジェクトID（client_secrets.jsonから取得）"""
+        if self._project_id is None:
+            try:
+                with open(self.client_secrets_file, 'r', encoding='utf-8') as f:
+                    secrets = json.load(f)
+                client = secrets.get('installed') or secrets.get('web') or {}
+                self._project_id = client.get('project_id') or 'default'
+            except (OSError, ValueError):
+                self._project_id = 'default'
+        return self._project_id
+    
+    @staticmethod
+    def _credentials_fresh(credentials):
+        """認証情報が有効で、更新期限まで余裕があるかどうか"""
+        if not credentials or not credentials.valid:
+            return False
+        if credentials.expiry is None:
+            return True
+        remaining = (credentials.expiry - datetime.utcnow()).total_seconds()
+        return remaining > config.YOUTUBE_TOKEN_REFRESH_MARGIN
+    
+    def _save_credentials(self, credentials):
+        """認証情報を保存する"""
+        with open(self.token_pickle_path, 'wb') as token:
+            pickle.dump(credentials, token)
+    
+    def _refresh_credentials(self):
+        """
+        認証情報をリフレッシュして保存する
+        
+        Returns:
+            bool: 成功した場合True
+        """
+        with self._lock:
+            try:
+                logger.info("認証情報をリフレッシュ中...")
+                self.credentials.refresh(google.auth.transport.requests.Request())
+                self._save_credentials(self.credentials)
+                return True
+            except Exception as e:
+                logger.error(f"認証情報のリフレッシュ中にエラーが発生: {str(e)}")
+                return False
     
-    def authenticate(self):
+    def authenticate(self, interactive=True):
         """
         YouTube APIに認証する
         
+        認証済みのクライアントがあり、トークンの期限まで余裕がある場合は何もしない。
+        クライアントは一度だけ作成し、以降のアップロードで再利用する。
+        
+        Args:
+            interactive (bool): 保存済みのトークンがない場合にブラウザでの認証を行うかどうか
+                （パイプラインの処理中は False にして、トークンのないチャンネルは失敗にする）
+        
         Returns:
             bool: 認証成功でTrue、失敗でFalse
         """
-        try:
-            credentials = None
-            
-            # トークンがあれば読み込む
-            if os.path.exists(self.token_pickle_path):
-                logger.info("保存された認証情報を読み込み中...")
-                with open(self.token_pickle_path, 'rb') as token:
-                    credentials = pickle.load(token)
+        if self.youtube_service and self._credentials_fresh(self.credentials):
+            AUTH_TOTAL.inc(channel=self.name, result='cached')
+            return True
+        
+        start = time.monotonic()
+        with tracing.span('authenticate', 'youtube', channel=self.name) as span_args:
+            success = self._authenticate(interactive)
+            span_args['outcome'] = 'success' if success else 'failure'
+        AUTH_TOTAL.inc(channel=self.name, result='authenticated' if success else 'failed')
+        AUTH_SECONDS.observe(time.monotonic() - start, channel=self.name, outcome='success' if success else 'failure')
+        return success
+    
+    def _authenticate(self, interactive=True):
+        """認証情報を読み込み・更新・取得し、クライアントを作成する（引数と戻り値は authenticate と同じ）"""
+        with self._lock:
+            if config.YOUTUBE_API_ENDPOINT:
+                return self._connect_endpoint()
             
-            # 有効な認証情報がなければ新規に取得
-            if not credentials or not credentials.valid:
-                if credentials and credentials.expired and credentials.refresh_token:
-                    logger.info("認証情報をリフレッシュ中...")
-                    credentials.refresh(google.auth.transport.requests.Request())
-                else:
-                    logger.info("新規認証情報を取得中...")
-                    if not os.path.exists(self.client_secrets_file):
-                        logger.error(f"client_secrets.jsonが見つかりません: {self.client_secrets_file}")
-                        return False
+            try:
+                credentials = self.credentials
+                
+                # トークンがあれば読み込む
+                if not credentials and os.path.exists(self.token_pickle_path):
+                    logger.info("保存された認証情報を読み込み中...")
+                    with open(self.token_pickle_path, 'rb') as token:
+                        credentials = pickle.load(token)
+                
+                # 有効な認証情報がなければ新規に取得
+                if not self._credentials_fresh(credentials):
+                    if credentials and credentials.refresh_token:
+                        logger.info("認証情報をリフレッシュ中...")
+                        credentials.refresh(google.auth.transport.requests.Request())
+                    else:
+                        if not interactive:
+                            logger.error(f"チャンネル {self.name} の保存済みのトークンがありません"
+                                         f"（python main.py auth {self.name} で認証してください）")
+                            return False
+                        logger.info("新規認証情報を取得中...")
+                        if not os.path.exists(self.client_secrets_file):
+                            logger.error(f"client_secrets.jsonが見つかりません: {self.client_secrets_file}")
+                            return False
+                        
+                        flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
+                            self.client_secrets_file, SCOPES)
+                        credentials = flow.run_local_server(port=8080)
                     
-                    flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
-                        self.client_secrets_file, SCOPES)
-                    credentials = flow.run_local_server(port=8080)
+                    # 認証情報を保存
+                    self._save_credentials(credentials)
                 
-                # 認証情報を保存
-                with open(self.token_pickle_path, 'wb') as token:
-                    pickle.dump(credentials, token)
-            
-            # YouTube API clientを初期化
-            self.youtube_service = googleapiclient.discovery.build(
-                API_SERVICE_NAME, API_VERSION, credentials=credentials)
+                self.credentials = credentials
+                
+                # YouTube API clientは一度だけ初期化する
+                # 同梱のディスカバリー文書を使い、接続を維持する認証済みセッションで通信する
+                if not self.youtube_service:
+                    authorized_http = google_auth_httplib2.AuthorizedHttp(credentials, http=_build_http())
+                    self.youtube_service = googleapiclient.discovery.build(
+                        API_SERVICE_NAME, API_VERSION, http=authorized_http,
+                        cache_discovery=False, static_discovery=True)
+                
+                self.start_token_refresher()
+                
+                logger.info("YouTube API認証成功")
+                return True
             
-            logger.info("YouTube API認証成功")
-            return True
+            except Exception as e:
+                logger.error(f"YouTube API認証中にエラーが発生: {str(e)}")
+                return False
+    
+    def _http(self):
+        """現在のスレッド用の認証済みHTTPクライアントを返す"""
+        http = getattr(self._http_local, 'http', None)
+        if http is None or http.credentials is not self.credentials:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=_build_http())
+            self._http_local.http = http
+        return http
+    
+    def _connect_endpoint(self):
+        """
+        config.YOUTUBE_API_ENDPOINT の疑似サーバーに接続する（OAuth認証は行わない）
+        
+        アップロードURLはdiscovery文書の rootUrl から作られるため、同梱の文書の rootUrl を書き換えて使う。
         
+        Returns:
+            bool: 成功した場合True
+        """
+        try:
+            document = json.loads(googleapiclient.discovery_cache.get_static_doc(API_SERVICE_NAME, API_VERSION))
+            document['rootUrl'] = config.YOUTUBE_API_ENDPOINT.rstrip('/') + '/'
+            self.credentials = google.auth.credentials.AnonymousCredentials()
+            self.youtube_service = googleapiclient.discovery.build_from_document(
+                document, http=google_auth_httplib2.AuthorizedHttp(self.credentials, http=_build_http()))
+            logger.info(f"YouTube APIの接続先: {config.YOUTUBE_API_ENDPOINT} (チャンネル: {self.name})")
+            return True
         except Exception as e:
-            logger.error(f"YouTube API認証中にエラーが発生: {str(e)}")
+            logger.error(f"YouTube APIの接続先を設定できません: {str(e)}")
             return False
     
-    def upload_video(self, video_path, title, description, tags=None, category_id='22', privacy_status='unlisted'):
+    def start_token_refresher(self):
+        """トークンの期限切れ前に認証情報を更新するバックグラウンドスレッドを起動する"""
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._stop_refresher.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name=f'youtube-token-refresher-{self.name}', daemon=True)
+        self._refresher.start()
+    
+    def stop_token_refresher(self):
+        """トークン更新スレッドを停止する"""
+        self._stop_refresher.set()
+    
+    def _refresh_loop(self):
+        """トークンの期限の少し前に認証情報を更新し続ける"""
+        while not self._stop_refresher.is_set():
+            credentials = self.credentials
+            if not credentials or credentials.expiry is None or not credentials.refresh_token:
+                delay = config.YOUTUBE_TOKEN_REFRESH_MARGIN
+            else:
+                remaining = (credentials.expiry - datetime.utcnow()).total_seconds()
+                delay = remaining - config.YOUTUBE_TOKEN_REFRESH_MARGIN
+                if delay <= 0:
+                    if not self._refresh_credentials():
+                        # 失敗した場合は少し待ってから再試行する
+                        delay = 60
+                    else:
+                        continue
+            self._stop_refresher.wait(max(delay, 1))
+    
+    def _resume_state_path(self, video_path):
+        """
+        動画ファイルに対応する再開情報ファイルのパスを返す
+        
+        チャンネル名とファイルのパス・サイズ・更新日時から作るため、同じファイルであればプロセス再起動後も同じパスになる。
+        """
+        stat = os.stat(video_path)
+        key = f"{self.name}:{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(config.UPLOAD_STATE_DIR, f"{digest}.json")
+    
+    def _load_resume_state(self, state_path):
+        """保存された再開情報を読み込む（なければNone）"""
+        if not os.path.exists(state_path):
+            return None
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"アップロード再開情報を読み込めません: {e}")
+            return None
+    
+    def _save_resume_state(self, state_path, state):
+        """再開情報を保存する（書き込み途中で落ちても壊れないよう置き換えで保存）"""
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        temp_path = f"{state_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, state_path)
+    
+    def _clear_resume_state(self, state_path):
+        """再開情報を削除する"""
+        try:
+            os.remove(state_path)
+        except FileNotFoundError:
+            pass
+    
+    def _execute_resumable(self, request, video_path, state_path, progress_callback=None, cancel_event=None,
+                           session_callback=None):
+        """
+        チャンク単位でアップロードを実行し、一時的なエラーはバックオフしてリトライする
+        
+        チャンクごとにセッションURIと送信済みバイト数を保存し、再起動後も続きから再開できるようにする。
+        
+        Args:
+            request: videos().insert のリクエスト
+            video_path (str): アップロードする動画ファイルのパス
+            state_path (str): 再開情報ファイルのパス
+            progress_callback (callable, optional): progress_callback(送信済みバイト数, 総バイト数, MB/s)
+            cancel_event (threading.Event, optional): セットされたら次のチャンクの前で中止するイベント
+            session_callback (callable, optional): session_callback(セッションURI)。セッションの開始時に呼ばれる
+        
+        Returns:
+            dict: アップロード完了時のレスポンス
+        
+        Raises:
+            UploadCancelled: cancel_event がセットされた場合
+        """
+        total_size = os.path.getsize(video_path)
+        start_time = time.monotonic()
+        start_offset = request.resumable_progress
+        response = None
+        retries = 0
+        reported_uri = request.resumable_uri
+        counted = start_offset
+        
+        while response is None:
+            if cancel_event is not None and cancel_event.is_set():
+                raise UploadCancelled(f"アップロードは中止されました（{request.resumable_progress}バイト送信済み）")
+            try:
+                status, response = request.next_chunk(http=self._http())
+                retries = 0
+                
+                if response is None and request.resumable_uri:
+                    self._save_resume_state(state_path, {
+                        'video_path': os.path.abspath(video_path),
+                        'resumable_uri': request.resumable_uri,
+                        'offset': request.resumable_progress,
+                        'size': total_size,
+                        'updated_at': datetime.now().isoformat(),
+                    })
+                    if session_callback and request.resumable_uri != reported_uri:
+                        reported_uri = request.resumable_uri
+                        session_callback(reported_uri)
+                
+                if status:
+                    UPLOAD_BYTES.inc(max(0, status.resumable_progress - counted), channel=self.name)
+                    counted = status.resumable_progress
+                    elapsed = max(time.monotonic() - start_time, 1e-6)
+                    mbps = (status.resumable_progress - start_offset) / elapsed / 1e6
+                    logger.info(f"アップロード中: {status.progress() * 100:.0f}% ({mbps:.2f} MB/s)")
+                    if progress_callback:
+                        progress_callback(status.resumable_progress, total_size, mbps)
+                continue
+            
+            except googleapiclient.errors.HttpError as e:
+                if e.resp.status not in RETRYABLE_UPLOAD_STATUS_CODES:
+                    raise
+                error = f"HTTP {e.resp.status}"
+            except RETRYABLE_UPLOAD_EXCEPTIONS as e:
+                error = f"{type(e).__name__}: {e}"
+            
+            retries += 1
+            if retries > config.YOUTUBE_UPLOAD_MAX_RETRIES:
+                raise RuntimeError(f"アップロードのリトライ上限に達しました（{error}）")
+            
+            # 次の next_chunk でサーバーに受信済みの位置を問い合わせてから再開する
+            request._in_error_state = True
+            delay = random.uniform(0, min(config.YOUTUBE_UPLOAD_MAX_BACKOFF, 2 ** retries))
+            logger.warning(f"アップロード中に一時的なエラー（{error}）。{delay:.1f}秒後に再開します "
+                           f"({retries}/{config.YOUTUBE_UPLOAD_MAX_RETRIES})")
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+        
+        UPLOAD_BYTES.inc(max(0, total_size - counted), channel=self.name)
+        elapsed = max(time.monotonic() - start_time, 1e-6)
+        sent = total_size - start_offset
+        logger.info(f"アップロード速度: {sent / elapsed / 1e6:.2f} MB/s "
+                    f"({sent / 1e6:.1f} MB / {elapsed:.1f}秒)")
+        if progress_callback:
+            progress_callback(total_size, total_size, sent / elapsed / 1e6)
+        return response
+    
+    def upload_video(self, video_path, title, description, tags=None, category_id='22', privacy_status='unlisted',
+                     progress_callback=None, cancel_event=None, session_callback=None):
         """
         YouTube動画をアップロードする
         
@@ -89,18 +457,65 @@ class YouTubeUploader:
             tags (list, optional): 動画のタグリスト
             category_id (str, optional): 動画カテゴリID (22=人物とブログ)
             privacy_status (str, optional): プライバシー設定 ('public', 'private', 'unlisted')
-            
+            progress_callback (callable, optional): progress_callback(送信済みバイト数, 総バイト数, MB/s)
+            cancel_event (threading.Event, optional): セットされたら次のチャンクの前で中止するイベント
+            session_callback (callable, optional): session_callback(セッションURI)。新しいセッションの開始時に呼ばれる
+        
         Returns:
             str: アップロードした動画のID、失敗した場合はNone
+        
+        Raises:
+            QuotaExceededError: APIのクォータを超過した場合
+            UploadCancelled: cancel_event がセットされた場合
         """
-        if not self.youtube_service:
-            if not self.authenticate():
-                return None
+        # 処理中にブラウザでの認証を始めないよう、保存済みのトークンがない場合は失敗にする
+        if not self.authenticate(interactive=False):
+            return None
         
         if not os.path.exists(video_path):
             logger.error(f"動画ファイルが見つかりません: {video_path}")
             return None
         
+        with self._upload_slots:
+            if cancel_event is not None and cancel_event.is_set():
+                raise UploadCancelled("アップロードは開始前に中止されました")
+            finished = threading.Event()
+            if cancel_event is not None:
+                # 中止されたら送信中のチャンクも待たずに接続を切る（再開情報は残るため続きから送信できる）
+                threading.Thread(target=self._abort_on_cancel, args=(cancel_event, finished, self._http()),
+                                 name=f'upload-abort-{self.name}', daemon=True).start()
+            start = time.monotonic()
+            started_at = time.time()
+            outcome = 'error'
+            try:
+                video_id = self._upload_video(video_path, title, description, tags, category_id, privacy_status,
+                                              progress_callback, cancel_event, session_callback)
+                outcome = 'success' if video_id else 'failure'
+                return video_id
+            except QuotaExceededError:
+                outcome = 'quota'
+                raise
+            finally:
+                finished.set()
+                if cancel_event is not None and cancel_event.is_set():
+                    outcome = 'cancelled'
+                elapsed = time.monotonic() - start
+                UPLOAD_SECONDS.observe(elapsed, channel=self.name, outcome=outcome)
+                tracing.add_span('upload', 'youtube', started_at, elapsed, channel=self.name, outcome=outcome,
+                                 bytes=os.path.getsize(video_path))
+    
+    @staticmethod
+    def _abort_on_cancel(cancel_event, finished, http):
+        """アップロードが終わるまで中止を監視し、中止されたら接続を切断する"""
+        while not finished.is_set():
+            if cancel_event.wait(1):
+                if not finished.is_set():
+                    _abort_connections(http)
+                return
+    
+    def _upload_video(self, video_path, title, description, tags, category_id, privacy_status, progress_callback,
+                      cancel_event, session_callback):
+        """アップロードを実行する（引数は upload_video と同じ）"""
         try:
             tags = tags or []
             
@@ -118,38 +533,316 @@ class YouTubeUploader:
                 }
             }
             
-            # アップロード用のMediaFileUploadオブジェクト
-            media = MediaFileUpload(
-                video_path,
-                mimetype='video/mp4',
-                resumable=True
-            )
+            state_path = self._resume_state_path(video_path)
+            state = self._load_resume_state(state_path)
             
-            # アップロードリクエスト
-            logger.info(f"YouTubeへのアップロード開始: {title}")
-            request = self.youtube_service.videos().insert(
-                part=','.join(body.keys()),
-                body=body,
-                media_body=media
-            )
+            for attempt in range(2):
+                # アップロード用のMediaFileUploadオブジェクト（チャンク単位で送信）
+                media = MediaFileUpload(
+                    video_path,
+                    mimetype='video/mp4',
+                    chunksize=config.YOUTUBE_UPLOAD_CHUNK_SIZE,
+                    resumable=True
+                )
+                
+                # アップロードリクエスト
+                request = self.youtube_service.videos().insert(
+                    part=','.join(body.keys()),
+                    body=body,
+                    media_body=media
+                )
+                
+                if state:
+                    # 前回のセッションを引き継ぎ、サーバーに受信済みの位置を問い合わせてから再開する
+                    logger.info(f"YouTubeへのアップロードを再開: {title} "
+                                f"(チャンネル: {self.name}, {state.get('offset', 0)}バイト目から)")
+                    request.resumable_uri = state['resumable_uri']
+                    request.resumable_progress = state.get('offset', 0)
+                    request._in_error_state = True
+                else:
+                    logger.info(f"YouTubeへのアップロード開始: {title} (チャンネル: {self.name})")
+                
+                try:
+                    response = self._execute_resumable(request, video_path, state_path, progress_callback,
+                                                       cancel_event, session_callback)
+                    break
+                except googleapiclient.errors.HttpError as e:
+                    # 保存していたセッションが失効している場合は最初からやり直す
+                    if state and attempt == 0 and e.resp.status in (400, 404, 410):
+                        logger.warning(f"アップロードセッションが失効しているため最初からやり直します: {e.resp.status}")
+                        self._clear_resume_state(state_path)
+                        state = None
+                        continue
+                    raise
             
-            # アップロードの実行
-            response = request.execute()
+            self._clear_resume_state(state_path)
             
             video_id = response.get('id')
-            logger.info(f"YouTubeへのアップロード完了: https://youtu.be/{video_id}")
+            logger.info(f"YouTubeへのアップロード完了: https://youtu.be/{video_id} (チャンネル: {self.name})")
             return video_id
-            
+        
         except googleapiclient.errors.HttpError as e:
+            if _http_error_reasons(e) & QUOTA_ERROR_REASONS:
+                logger.error(f"YouTube Data APIのクォータを超過しました: {str(e)}")
+                raise QuotaExceededError(str(e)) from e
             logger.error(f"YouTubeアップロード中にHTTPエラー: {str(e)}")
             return None
+        except UploadCancelled as e:
+            # 再開情報は残すため、同じファイルを再度アップロードすると続きから送信される
+            logger.info(f"{e} (チャンネル: {self.name})")
+            raise
         except Exception as e:
             logger.error(f"YouTubeアップロード中にエラーが発生: {str(e)}")
             return None
 
 
+class YouTubeUploader:
+    """YouTubeアップロードクラス（複数チャンネルへの振り分けを行う）"""
+    
+    def __init__(self, client_secrets_file=None, credentials_dir=None, channels_file=None):
+        """
+        初期化
+        
+        Args:
+            client_secrets_file (str, optional): 既定のOAuthクライアント設定ファイル
+            credentials_dir (str, optional): 認証情報のディレクトリ
+            channels_file (str, optional): チャンネル一覧の設定ファイル（ない場合は既定のチャンネル1つで動作する）
+        """
+        self.client_secrets_file = client_secrets_file or config.YOUTUBE_CLIENT_SECRETS_FILE
+        self.credentials_dir = credentials_dir or config.CREDENTIALS_DIR
+        self.channels_file = channels_file or config.YOUTUBE_CHANNELS_FILE
+        self.channels = self._load_channels()
+        logger.info(f"YouTubeチャンネル: {', '.join(self.channels)}")
+        
+        # 送信はイベントループを止めないよう専用のスレッドプールで行い、全体の同時アップロード数を制限する
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.YOUTUBE_UPLOAD_WORKERS, thread_name_prefix='youtube-upload')
+        self._cancel_events = set()
+    
+    def _credential_path(self, path, default=None):
+        """認証情報ディレクトリからの相対パスを絶対パスにする"""
+        if not path:
+            return default
+        return path if os.path.isabs(path) else os.path.join(self.credentials_dir, path)
+    
+    def _load_channels(self):
+        """
+        チャンネル一覧を読み込む
+        
+        Returns:
+            dict: チャンネル名とYouTubeChannelの辞書（設定ファイルの記載順）
+        """
+        if not os.path.exists(self.channels_file):
+            channel = YouTubeChannel(
+                name='default',
+                client_secrets_file=self.client_secrets_file,
+                token_file=os.path.join(self.credentials_dir, 'youtube_token.pickle'))
+            return {channel.name: channel}
+        
+        with open(self.channels_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        entries = data.get('channels', []) if isinstance(data, dict) else data
+        
+        channels = {}
+        for entry in entries:
+            name = entry['name']
+            channels[name] = YouTubeChannel(
+                name=name,
+                client_secrets_file=self._credential_path(entry.get('client_secrets_file'), self.client_secrets_file),
+                token_file=self._credential_path(entry.get('token_file') or f'youtube_token_{name}.pickle'),
+                max_concurrent_uploads=entry.get('max_concurrent_uploads'),
+                themes=entry.get('themes'))
+        
+        if not channels:
+            raise ValueError(f"YouTubeチャンネルが設定されていません: {self.channels_file}")
+        return channels
+    
+    def authenticate(self, channel=None, interactive=True):
+        """
+        YouTube APIに認証する
+        
+        Args:
+            channel (str, optional): 認証するチャンネル名（未指定の場合はすべて）
+            interactive (bool): 保存済みのトークンがない場合にブラウザでの認証を行うかどうか
+        
+        Returns:
+            bool: 1つ以上のチャンネルで認証に成功した場合True
+        """
+        if channel:
+            return self.channels[channel].authenticate(interactive)
+        results = [c.authenticate(interactive) for c in self.channels.values()]
+        return any(results)
+    
+    def authenticate_saved(self):
+        """保存済みのトークンがあるチャンネルだけ認証する（起動時の対話的な認証を避けるため）"""
+        for channel in self.channels.values():
+            if os.path.exists(channel.token_pickle_path):
+                channel.authenticate()
+    
+    def stop_token_refresher(self):
+        """全チャンネルのトークン更新スレッドを停止する"""
+        for channel in self.channels.values():
+            channel.stop_token_refresher()
+    
+    def _candidates(self, title, tags=None):
+        """振り分けルールに一致するチャンネルの候補を返す"""
+        text = ' '.join([title] + list(tags or []))
+        matched = [c for c in self.channels.values() if any(keyword in text for keyword in c.themes)]
+        if matched:
+            return matched
+        # ルールのないチャンネルを汎用として使い、なければ全チャンネルから選ぶ
+        general = [c for c in self.channels.values() if not c.themes]
+        return general or list(self.channels.values())
+    
+    def select_channel(self, title, tags=None, ledger=None, cost=0, busy=None):
+        """
+        アップロード先のチャンネルを選ぶ
+        
+        振り分けルールに一致するチャンネルのうち、残りクォータが最も多く、実行中のアップロードが少ないものを選ぶ。
+        
+        Args:
+            title (str): 動画のタイトル
+            tags (list, optional): 動画のタグリスト
+            ledger (QuotaLedger, optional): クォータ使用量の記録（指定した場合は残りがcost未満のチャンネルを除く）
+            cost (int): アップロード1回のクォータ消費量
+            busy (dict, optional): チャンネル名と実行中のアップロード数（指定した場合は上限に達したチャンネルを除く）
+        
+        Returns:
+            YouTubeChannel: 選んだチャンネル、候補がない場合はNone
+        """
+        busy = busy or {}
+        remaining = {}
+        candidates = []
+        for channel in self._candidates(title, tags):
+            if busy.get(channel.name, 0) >= channel.max_concurrent_uploads:
+                continue
+            if ledger is not None:
+                remaining[channel.name] = ledger.remaining(channel.project_id)
+                if remaining[channel.name] < cost:
+                    continue
+            candidates.append(channel)
+        
+        if not candidates:
+            return None
+        return max(candidates, key=lambda c: (remaining.get(c.name, 0), -busy.get(c.name, 0)))
+    
+    def upload_video(self, video_path, title, description, tags=None, category_id='22', privacy_status='unlisted',
+                     progress_callback=None, channel=None, cancel_event=None, session_callback=None):
+        """
+        YouTube動画をアップロードする
+        
+        Args:
+            video_path (str): アップロードする動画ファイルのパス
+            title (str): 動画のタイトル
+            description (str): 動画の説明
+            tags (list, optional): 動画のタグリスト
+            category_id (str, optional): 動画カテゴリID (22=人物とブログ)
+            privacy_status (str, optional): プライバシー設定 ('public', 'private', 'unlisted')
+            progress_callback (callable, optional): progress_callback(送信済みバイト数, 総バイト数, MB/s)
+            channel (str, optional): アップロード先のチャンネル名（未指定の場合は振り分けルールで選ぶ）
+            cancel_event (threading.Event, optional): セットされたら次のチャンクの前で中止するイベント
+            session_callback (callable, optional): session_callback(セッションURI)。新しいセッションの開始時に呼ばれる
+        
+        Returns:
+            str: アップロードした動画のID、失敗した場合はNone
+        
+        Raises:
+            QuotaExceededError: APIのクォータを超過した場合
+            UploadCancelled: cancel_event がセットされた場合
+        """
+        target = self.channels[channel] if channel else self.select_channel(title, tags)
+        return target.upload_video(
+            video_path=video_path,
+            title=title,
+            description=description,
+            tags=tags,
+            category_id=category_id,
+            privacy_status=privacy_status,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
+            session_callback=session_callback
+        )
+    
+    async def upload_video_async(self, video_path, title, description, tags=None, category_id='22',
+                                 privacy_status='unlisted', progress_callback=None, channel=None, cancel_event=None,
+                                 session_callback=None, finished_callback=None):
+        """
+        専用のスレッドプールでアップロードし、完了を待つ（イベントループはブロックしない）
+        
+        待機中のタスクがキャンセルされた場合は cancel_event をセットし、送信中のチャンクが終わった時点で中止する。
+        引数は upload_video と同じ。progress_callback と session_callback はアップロード用のスレッドから呼ばれる。
+        finished_callback() はアップロードのスレッドが実際に終わったとき（キャンセルされた場合も送信中のチャンクが
+        終わったとき、実行前に取りやめた場合はその時点）にイベントループ上で呼ばれる。
+        
+        Returns:
+            str: アップロードした動画のID、失敗した場合はNone
+        
+        Raises:
+            QuotaExceededError: APIのクォータを超過した場合
+            UploadCancelled: cancel_event がセットされて中止された場合
+        """
+        cancel_event = cancel_event or threading.Event()
+        self._cancel_events.add(cancel_event)
+        upload = functools.partial(
+            self.upload_video,
+            video_path=video_path,
+            title=title,
+            description=description,
+            tags=tags,
+            category_id=category_id,
+            privacy_status=privacy_status,
+            progress_callback=progress_callback,
+            channel=channel,
+            cancel_event=cancel_event,
+            session_callback=session_callback
+        )
+        loop = asyncio.get_running_loop()
+        # ログにジョブIDが付くよう、呼び出し元のコンテキストで実行する
+        future = self._executor.submit(contextvars.copy_context().run, upload)
+        if finished_callback:
+            def on_done(_):
+                try:
+                    loop.call_soon_threadsafe(finished_callback)
+                except RuntimeError:
+                    # イベントループが終了している
+                    pass
+            future.add_done_callback(on_done)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+        finally:
+            self._cancel_events.discard(cancel_event)
+    
+    def cancel_all(self):
+        """実行中・待機中の非同期アップロードをすべて中止する（終了時用）"""
+        for cancel_event in list(self._cancel_events):
+            cancel_event.set()
+    
+    def channel_status(self):
+        """
+        チャンネルごとの設定と状態を返す
+        
+        Returns:
+            dict: チャンネル名と {'project_id', 'max_concurrent_uploads', 'themes', 'authenticated'} の辞書
+        """
+        return {
+            name: {
+                'project_id': channel.project_id,
+                'max_concurrent_uploads': channel.max_concurrent_uploads,
+                'themes': channel.themes,
+                'authenticated': channel.youtube_service is not None,
+            }
+            for name, channel in self.channels.items()
+        }
+
+
 if __name__ == "__main__":
     # テスト用コード
+    from modules.logging_setup import setup_logging
+    setup_logging()
+    
     import sys
     if len(sys.argv) > 1:
         video_path = sys.argv[1]
@@ -162,6 +855,7 @@ if __name__ == "__main__":
         sys.exit(1)
     
     uploader = YouTubeUploader()
+    uploader.authenticate()
     video_id = uploader.upload_video(
         video_path=video_path,
         title="テストアップロード",
@@ -0,0 +1,8 @@
+"""
+テスト共通の設定
+"""
+import os
+import sys
+
+# リポジトリのルートをインポートパスに追加（modules と config を読み込むため）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+"""
+job_journal モジュールのテスト（再生・整理と再起動後の再開）
+"""
+import asyncio
+import os
+
+from modules.job_journal import JobJournal
+from modules.pipeline import PipelineScheduler
+
+
+def test_replay_builds_latest_state(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.jsonl'), max_bytes=10 ** 6)
+    journal.append('a', 'submitted', theme='猫', user_id='u1', channel_id='c1',
+                   key_options={'style': 'calm'}, priority='interactive')
+    journal.append('b', 'submitted', theme='犬')
+    journal.append('a', 'stage', stage='text', data={'text': '本文'})
+    journal.append('a', 'artifact', data={'upload_session': 'https://upload/session'})
+    journal.append('b', 'finished', success=True)
+    # 受け付けの記録がないジョブのイベントは無視する
+    journal.append('x', 'stage', stage='text', data={})
+    
+    states = journal.replay()
+    assert list(states) == ['a', 'b']
+    assert states['a']['stage'] == 'text'
+    assert states['a']['data'] == {'text': '本文', 'upload_session': 'https://upload/session'}
+    assert states['a']['priority'] == 'interactive'
+    assert states['a']['key_options'] == {'style': 'calm'}
+    assert not states['a']['finished']
+    assert states['b']['finished']
+    assert states['b']['priority'] == 'normal'
+    assert [state['id'] for state in journal.unfinished()] == ['a']
+
+
+def test_replay_skips_truncated_last_line(tmp_path):
+    path = tmp_path / 'jobs.jsonl'
+    journal = JobJournal(str(path), max_bytes=10 ** 6)
+    journal.append('a', 'submitted', theme='猫')
+    journal.flush()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"job_id": "a", "event": "fini')
+    
+    assert [state['id'] for state in JobJournal(str(path)).unfinished()] == ['a']
+
+
+def test_compact_drops_finished_jobs(tmp_path):
+    path = tmp_path / 'jobs.jsonl'
+    journal = JobJournal(str(path), max_bytes=10 ** 6)
+    for job_id in ('a', 'b', 'c'):
+        journal.append(job_id, 'submitted', theme=job_id)
+    journal.append('b', 'finished', success=True)
+    
+    assert journal.compact() == 2
+    with open(path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+    assert [state['id'] for state in journal.unfinished()] == ['a', 'c']
+
+
+def test_compacts_while_running_when_over_max_bytes(tmp_path):
+    path = tmp_path / 'jobs.jsonl'
+    journal = JobJournal(str(path), max_bytes=2000)
+    for i in range(50):
+        journal.append(f'job{i}', 'submitted', theme='テーマ' * 5)
+        journal.append(f'job{i}', 'finished', success=True)
+    journal.append('open', 'submitted', theme='未完了')
+    journal.flush()
+    
+    assert os.path.getsize(path) < 2000 * 2
+    assert [state['id'] for state in journal.unfinished()] == ['open']
+
+
+def test_restored_job_resumes_after_last_completed_stage(tmp_path):
+    journal = JobJournal(str(tmp_path / 'jobs.jsonl'), max_bytes=10 ** 6)
+    
+    async def first_run():
+        gate = asyncio.Event()
+        
+        async def text(job):
+            job.data['text'] = f'{job.theme}の本文'
+        
+        async def render(job):
+            # プロセスが終了したものとして、動画作成を完了させない
+            await gate.wait()
+        
+        scheduler = PipelineScheduler(journal=journal, interactive_reserved=0)
+        scheduler.add_stage('text', text)
+        scheduler.add_stage('render', render)
+        job = scheduler.submit('猫')
+        for _ in range(100):
+            if job.stage == 'render':
+                break
+            await asyncio.sleep(0.01)
+        assert job.stage == 'render'
+        return job.id
+    
+    job_id = asyncio.run(first_run())
+    
+    async def second_run(states):
+        ran = []
+        
+        async def text(job):
+            ran.append('text')
+            job.data['text'] = '作り直し'
+        
+        async def render(job):
+            ran.append('render')
+            return {'success': True, 'text': job.data['text']}
+        
+        scheduler = PipelineScheduler(journal=journal, interactive_reserved=0)
+        scheduler.add_stage('text', text)
+        scheduler.add_stage('render', render)
+        jobs = [scheduler.restore(state) for state in states]
+        results = [await job.wait() for job in jobs]
+        return ran, results
+    
+    states = journal.unfinished()
+    assert [state['id'] for state in states] == [job_id]
+    ran, results = asyncio.run(second_run(states))
+    assert ran == ['render']
+    assert results == [{'success': True, 'text': '猫の本文'}]
+    assert journal.unfinished() == []
@@ -0,0 +1,223 @@
+"""
+pipeline モジュールのテスト（優先度クラスと同時実行の枠、受け付けの上限、取り消し）
+"""
+import asyncio
+import threading
+
+import pytest
+
+from modules.pipeline import PipelineScheduler, QueueFull
+
+
+def test_bulk_waits_for_admitted_interactive_job_on_single_slot_stage():
+    async def run():
+        order = []
+        gate = asyncio.Event()
+        
+        async def text(job):
+            if job.priority == 'interactive':
+                await gate.wait()
+        
+        async def render(job):
+            order.append(job.theme)
+            return {'success': True}
+        
+        scheduler = PipelineScheduler(interactive_reserved=1)
+        scheduler.add_stage('text', text, concurrency=2)
+        scheduler.add_stage('render', render, concurrency=1)
+        interactive = scheduler.submit('chat', priority='interactive')
+        bulk = scheduler.submit('batch', priority='bulk')
+        
+        # interactive のジョブがテキスト生成中の間、bulk のジョブは動画作成を始めない
+        await asyncio.sleep(0.05)
+        assert order == []
+        assert scheduler.stages[1].queued == 1
+        
+        gate.set()
+        await asyncio.gather(interactive.wait(), bulk.wait())
+        return order
+    
+    assert asyncio.run(run()) == ['chat', 'batch']
+
+
+def test_normal_job_is_not_held_for_interactive_job():
+    async def run():
+        gate = asyncio.Event()
+        
+        async def text(job):
+            if job.priority == 'interactive':
+                await gate.wait()
+        
+        async def render(job):
+            return {'success': True}
+        
+        scheduler = PipelineScheduler(interactive_reserved=1)
+        scheduler.add_stage('text', text, concurrency=2)
+        scheduler.add_stage('render', render, concurrency=1)
+        interactive = scheduler.submit('chat', priority='interactive')
+        normal = scheduler.submit('api')
+        result = await asyncio.wait_for(normal.wait(), timeout=1)
+        gate.set()
+        await interactive.wait()
+        return result
+    
+    assert asyncio.run(run()) == {'success': True}
+
+
+def make_blocked_scheduler(**kwargs):
+    """処理関数が gate を待つ1ステージのスケジューラーを作る"""
+    gate = asyncio.Event()
+    
+    async def handler(job):
+        await gate.wait()
+        return {'success': True}
+    
+    scheduler = PipelineScheduler(interactive_reserved=0, **kwargs)
+    scheduler.add_stage('render', handler)
+    return scheduler, gate
+
+
+def test_admission_rejects_over_max_pending_and_frees_on_completion():
+    async def run():
+        scheduler, gate = make_blocked_scheduler(max_pending=2, interactive_reserved_pending=0)
+        jobs = [scheduler.submit('a'), scheduler.submit('b')]
+        with pytest.raises(QueueFull):
+            scheduler.submit('c')
+        assert scheduler.rejected == 1
+        
+        gate.set()
+        await asyncio.gather(*(job.wait() for job in jobs))
+        await scheduler.submit('c').wait()
+    
+    asyncio.run(run())
+
+
+def test_admission_keeps_room_for_interactive_jobs():
+    async def run():
+        scheduler, gate = make_blocked_scheduler(max_pending=3, interactive_reserved_pending=1)
+        jobs = [scheduler.submit('a'), scheduler.submit('b', priority='bulk')]
+        with pytest.raises(QueueFull):
+            scheduler.submit('c')
+        jobs.append(scheduler.submit('c', priority='interactive'))
+        with pytest.raises(QueueFull):
+            scheduler.submit('d', priority='interactive')
+        gate.set()
+        await asyncio.gather(*(job.wait() for job in jobs))
+    
+    asyncio.run(run())
+
+
+def test_admission_limits_per_user_and_per_channel():
+    async def run():
+        scheduler, gate = make_blocked_scheduler(max_pending=10, max_per_user=1, max_per_channel=2)
+        jobs = [scheduler.submit('a', user_id='u1', channel_id='c1')]
+        with pytest.raises(QueueFull, match='1人1件'):
+            scheduler.submit('b', user_id='u1', channel_id='c2')
+        jobs.append(scheduler.submit('b', user_id='u2', channel_id='c1'))
+        with pytest.raises(QueueFull, match='チャンネル'):
+            scheduler.submit('c', user_id='u3', channel_id='c1')
+        jobs.append(scheduler.submit('c', user_id='u3', channel_id='c2'))
+        assert scheduler.rejected == 2
+        gate.set()
+        await asyncio.gather(*(job.wait() for job in jobs))
+    
+    asyncio.run(run())
+
+
+def test_cancel_queued_job_skips_its_handler():
+    async def run():
+        started = []
+        gate = asyncio.Event()
+        
+        async def handler(job):
+            started.append(job.theme)
+            await gate.wait()
+            return {'success': True}
+        
+        scheduler = PipelineScheduler(interactive_reserved=0)
+        scheduler.add_stage('render', handler)
+        first = scheduler.submit('a')
+        second = scheduler.submit('b')
+        await asyncio.sleep(0.02)
+        
+        assert scheduler.cancel(second.id) == 'cancelled'
+        assert (await second.wait())['cancelled']
+        assert second.id not in scheduler.jobs
+        gate.set()
+        assert (await first.wait())['success']
+        assert scheduler.cancel(second.id) == 'not_found'
+        return started
+    
+    assert asyncio.run(run()) == ['a']
+
+
+def test_cancel_running_job_frees_the_slot():
+    async def run():
+        async def handler(job):
+            if job.theme == 'slow':
+                await asyncio.sleep(60)
+            return {'success': True}
+        
+        scheduler = PipelineScheduler(interactive_reserved=0)
+        scheduler.add_stage('render', handler)
+        slow = scheduler.submit('slow')
+        fast = scheduler.submit('fast')
+        await asyncio.sleep(0.02)
+        
+        assert scheduler.cancel(slow.id) == 'cancelled'
+        assert slow.cancel_event.is_set()
+        assert (await slow.wait())['cancelled']
+        result = await asyncio.wait_for(fast.wait(), timeout=1)
+        assert scheduler.cancelled == 1
+        return result
+    
+    assert asyncio.run(run()) == {'success': True}
+
+
+def test_cancelled_thread_handler_keeps_slot_until_it_returns():
+    async def run():
+        release = threading.Event()
+        order = []
+        
+        def handler(job):
+            if job.theme == 'slow':
+                # 中止の通知を受けても、スレッドの処理はすぐには終わらない
+                job.cancel_event.wait()
+                release.wait(5)
+            order.append(job.theme)
+            return {'success': True}
+        
+        scheduler = PipelineScheduler(interactive_reserved=0)
+        scheduler.add_stage('render', handler)
+        slow = scheduler.submit('slow')
+        fast = scheduler.submit('fast')
+        await asyncio.sleep(0.05)
+        
+        scheduler.cancel(slow.id)
+        await slow.wait()
+        await asyncio.sleep(0.05)
+        assert order == []
+        assert scheduler.stages[0].busy == 1
+        
+        release.set()
+        await asyncio.wait_for(fast.wait(), timeout=5)
+        return order
+    
+    assert asyncio.run(run()) == ['slow', 'fast']
+
+
+def test_cancel_by_user_only_detaches_when_others_wait():
+    async def run():
+        scheduler, gate = make_blocked_scheduler()
+        job = scheduler.submit('猫', user_id='u1')
+        assert scheduler.attach('猫', user_id='u2') is job
+        
+        assert scheduler.cancel(job.id, user_id='u3') == 'forbidden'
+        assert scheduler.cancel(job.id, user_id='u1') == 'detached'
+        assert [requester['user_id'] for requester in job.requesters] == ['u2']
+        assert not job.done
+        assert scheduler.cancel(job.id, user_id='u2') == 'cancelled'
+        assert (await job.wait())['cancelled']
+        gate.set()
+    
+    asyncio.run(run())
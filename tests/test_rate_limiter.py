@@ -0,0 +1,116 @@
+"""
+rate_limiter モジュールのテスト（retry-after の扱いと中止）
+"""
+import threading
+import time
+import email.utils
+from types import SimpleNamespace
+
+import pytest
+
+from modules.rate_limiter import RateLimiter, CallCancelled, _parse_retry_after
+
+
+class FakeAPIError(Exception):
+    """SDKのAPIエラーを模した例外"""
+    
+    def __init__(self, status_code, headers=None, body=None):
+        """初期化"""
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+        self.body = body
+
+
+def make_limiter(**kwargs):
+    options = dict(requests_per_minute=6000, tokens_per_minute=600000, max_queue=10,
+                   max_retries=2, base_delay=0.01, max_delay=0.02, queue_timeout=5)
+    options.update(kwargs)
+    return RateLimiter(**options)
+
+
+def test_parse_retry_after_formats():
+    assert _parse_retry_after(FakeAPIError(429, {'retry-after': '3'})) == 3.0
+    # retry-after-ms が優先される
+    assert _parse_retry_after(FakeAPIError(429, {'retry-after-ms': '1500', 'retry-after': '9'})) == 1.5
+    assert _parse_retry_after(FakeAPIError(429, {})) is None
+    assert _parse_retry_after(Exception("no response")) is None
+    
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= _parse_retry_after(FakeAPIError(429, {'retry-after': date})) <= 30
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert _parse_retry_after(FakeAPIError(429, {'retry-after': past})) == 0.0
+
+
+def test_retry_delay_honours_retry_after():
+    limiter = make_limiter()
+    assert limiter._retry_delay(FakeAPIError(429, {'retry-after': '2'}), 0) == 2.0
+    # retry-after がない場合はバックオフ（最低 base_delay / 2）
+    delay = limiter._retry_delay(FakeAPIError(500), 0)
+    assert limiter.base_delay / 2 <= delay <= limiter.max_delay
+
+
+def test_call_retries_429_and_pauses_other_callers():
+    limiter = make_limiter()
+    attempts = []
+    
+    def func():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise FakeAPIError(429, {'retry-after': '0.2'})
+        return 'ok'
+    
+    assert limiter.call(func) == 'ok'
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.2
+    assert limiter.metrics()['rate_limited'] == 1
+    assert limiter.metrics()['retries'] == 1
+    
+    # 429 の retry-after は他の呼び出しにも適用される
+    limiter.pause(0.2)
+    assert limiter.acquire() >= 0.15
+
+
+def test_streamed_overloaded_error_is_retried():
+    limiter = make_limiter()
+    calls = []
+    
+    def func():
+        calls.append(1)
+        if len(calls) == 1:
+            raise FakeAPIError(200, body={'type': 'error', 'error': {'type': 'overloaded_error'}})
+        return 'ok'
+    
+    assert limiter.call(func) == 'ok'
+    assert limiter.metrics()['overloaded'] == 1
+
+
+def test_non_retryable_error_is_raised_immediately():
+    limiter = make_limiter()
+    calls = []
+    
+    def func():
+        calls.append(1)
+        raise FakeAPIError(400)
+    
+    with pytest.raises(FakeAPIError):
+        limiter.call(func)
+    assert len(calls) == 1
+    assert limiter.metrics()['failures'] == 1
+
+
+def test_cancel_stops_waiting_for_retry_after():
+    limiter = make_limiter()
+    cancel_event = threading.Event()
+    calls = []
+    
+    def func():
+        calls.append(1)
+        raise FakeAPIError(429, {'retry-after': '30'})
+    
+    threading.Timer(0.1, cancel_event.set).start()
+    start = time.monotonic()
+    with pytest.raises(CallCancelled):
+        limiter.call(func, cancel_event=cancel_event)
+    assert time.monotonic() - start < 5
+    assert len(calls) == 1
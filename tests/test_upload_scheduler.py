@@ -0,0 +1,183 @@
+"""
+upload_scheduler モジュールのテスト（クォータの記録と即時実行・予約の振り分け）
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from modules.upload_scheduler import QuotaLedger, UploadScheduler
+from modules.youtube_uploader import YouTubeUploader
+
+COST = 1600
+
+
+def make_channel(name, project_id, max_concurrent_uploads=1, themes=None):
+    """振り分けに必要な属性だけを持つチャンネル"""
+    return SimpleNamespace(name=name, project_id=project_id, max_concurrent_uploads=max_concurrent_uploads,
+                           themes=themes or [])
+
+
+class FakeUploader(YouTubeUploader):
+    """送信の代わりに gate がセットされるまでスレッドで待つアップローダー"""
+    
+    def __init__(self, channels):
+        self.channels = {channel.name: channel for channel in channels}
+        self._executor = ThreadPoolExecutor(max_workers=8)
+        self._cancel_events = set()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.uploads = []
+    
+    def upload_video(self, video_path, title, description, tags=None, category_id='22', privacy_status='unlisted',
+                     progress_callback=None, channel=None, cancel_event=None, session_callback=None):
+        self.uploads.append((title, channel))
+        if session_callback and not title.startswith('resume'):
+            session_callback('https://upload.example/session')
+        # キャンセルされても送信中のチャンクが終わるまで戻らない
+        self.gate.wait()
+        return f'video-{len(self.uploads)}'
+
+
+def make_scheduler(tmp_path, channels, daily_quota=10000):
+    ledger = QuotaLedger(path=str(tmp_path / 'quota.json'), daily_quota=daily_quota)
+    uploader = FakeUploader(channels)
+    scheduler = UploadScheduler(uploader, ledger=ledger, queue_file=str(tmp_path / 'queue.json'))
+    return scheduler, uploader, ledger
+
+
+def submit(scheduler, title, **kwargs):
+    return scheduler.submit(video_path='video.mp4', title=title, description='', **kwargs)
+
+
+def queued_item(item_id, title):
+    return {'id': item_id, 'video_path': 'video.mp4', 'title': title, 'description': '', 'tags': [],
+            'privacy_status': 'unlisted', 'notify': {}, 'enqueued_at': datetime.now().isoformat()}
+
+
+def test_ledger_resets_on_new_quota_day(tmp_path):
+    ledger = QuotaLedger(path=str(tmp_path / 'quota.json'), daily_quota=10000)
+    ledger.spend('project', 9000)
+    ledger.mark_exhausted('project')
+    assert ledger.remaining('project') == 0
+    
+    # 前日の記録は当日の残りに影響しない
+    ledger._data['project']['date'] = '2000-01-01'
+    assert ledger.remaining('project') == 10000
+    assert QuotaLedger(path=str(tmp_path / 'quota.json')).snapshot()['project']['exhausted'] is True
+
+
+def test_seconds_until_reset_uses_pacific_midnight():
+    # 2024-01-15 07:00 UTC は太平洋時間の 2024-01-14 23:00（冬時間、UTC-8）
+    now = datetime(2024, 1, 15, 7, 0, tzinfo=timezone.utc)
+    assert QuotaLedger.quota_date(now) == '2024-01-14'
+    assert QuotaLedger.seconds_until_reset(now) == 3600
+
+
+def test_submit_uploads_immediately(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')])
+    result = asyncio.run(submit(scheduler, 'title'))
+    assert result == {'status': 'uploaded', 'video_id': 'video-1'}
+    assert ledger.remaining('p1') == 10000 - COST
+    assert scheduler._busy['main'] == 0
+
+
+def test_submit_queues_when_no_channel_has_quota(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')])
+    ledger.mark_exhausted('p1')
+    result = asyncio.run(submit(scheduler, 'title'))
+    assert result['status'] == 'queued'
+    assert result['position'] == 1
+    assert result['release_in'] > 0
+    assert uploader.uploads == []
+
+
+def test_in_flight_queue_item_does_not_force_queueing(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1', max_concurrent_uploads=2)])
+    scheduler.queue.append(queued_item('a', 'queued'))
+    scheduler._in_flight.add('a')
+    scheduler._busy['main'] = 1
+    
+    result = asyncio.run(submit(scheduler, 'title'))
+    assert result['status'] == 'uploaded'
+
+
+def test_unroutable_queue_item_does_not_block_other_projects(tmp_path):
+    channels = [make_channel('cats', 'p1', themes=['猫']), make_channel('general', 'p2')]
+    scheduler, uploader, ledger = make_scheduler(tmp_path, channels)
+    ledger.mark_exhausted('p1')
+    
+    async def run():
+        scheduler.start()
+        scheduler.queue.append(queued_item('a', '猫の動画'))
+        return await submit(scheduler, '犬の動画')
+    
+    result = asyncio.run(run())
+    assert result['status'] == 'uploaded'
+    assert uploader.uploads == [('犬の動画', 'general')]
+    assert [item['id'] for item in scheduler.queue] == ['a']
+
+
+def test_routable_queue_item_goes_first(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')], daily_quota=COST)
+    
+    async def run():
+        scheduler.start()
+        scheduler.queue.append(queued_item('a', 'queued'))
+        return await submit(scheduler, 'new')
+    
+    # 残りのクォータは予約済みの項目に割り当てるため、新しい項目は予約される
+    result = asyncio.run(run())
+    assert result['status'] == 'queued'
+    assert uploader.uploads[0] == ('queued', 'main')
+
+
+def test_submit_waits_for_slot_instead_of_queueing(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')])
+    uploader.gate.clear()
+    
+    async def run():
+        first = asyncio.create_task(submit(scheduler, 'first'))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(submit(scheduler, 'second'))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        uploader.gate.set()
+        return await first, await second
+    
+    first, second = asyncio.run(run())
+    assert first['status'] == second['status'] == 'uploaded'
+    assert not scheduler.queue
+
+
+def test_cancelled_upload_keeps_slot_until_thread_finishes(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')])
+    uploader.gate.clear()
+    
+    async def run():
+        task = asyncio.create_task(submit(scheduler, 'first'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        # スレッドはまだ送信中なので枠は空かない
+        assert scheduler._busy['main'] == 1
+        uploader.gate.set()
+        await asyncio.sleep(0.05)
+        assert scheduler._busy['main'] == 0
+    
+    asyncio.run(run())
+
+
+def test_resumed_upload_is_not_charged_again(tmp_path):
+    scheduler, uploader, ledger = make_scheduler(tmp_path, [make_channel('main', 'p1')])
+    
+    result = asyncio.run(submit(scheduler, 'resume', channel='main', resume=True))
+    assert result['status'] == 'uploaded'
+    assert ledger.remaining('p1') == 10000
+    
+    # 再開できずに新しいセッションを始めた場合は記録する
+    result = asyncio.run(submit(scheduler, 'restart', channel='main', resume=True))
+    assert result['status'] == 'uploaded'
+    assert ledger.remaining('p1') == 10000 - COST